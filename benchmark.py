@@ -0,0 +1,1660 @@
+import argparse
+import functools
+import gc
+import gzip
+import json
+import math
+import multiprocessing
+import operator
+import pickle
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from compression import CODECS, encode_postings, get_codec, iter_postings
+from postings import PostingsList
+from storage import document_stats
+from term import Term
+
+
+def load_snapshot(path: Path) -> dict[str, dict]:
+    """
+    Unpickle a postings snapshot written by invert.pickle_postings_list
+    :param path: Path to postings.pkl.gz
+    :return: Dictionary of term -> {"freq", "postings"}
+    """
+    with gzip.open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def replicate_snapshot(snapshot: dict[str, dict], copies: int) -> dict[str, dict]:
+    """
+    Build a synthetic collection by repeating every document `copies` times under new document IDs
+    :param snapshot: Postings snapshot
+    :param copies: Number of replicas
+    :return: Postings snapshot of the replicated collection
+    """
+    stride = 1 + max(
+        (doc_id for payload in snapshot.values() for doc_id, _, _ in payload["postings"]),
+        default=0,
+    )
+    replica = {}
+    for term, payload in snapshot.items():
+        postings = [
+            (copy * stride + doc_id, tf, positions)
+            for copy in range(copies)
+            for doc_id, tf, positions in payload["postings"]
+        ]
+        replica[term] = {"freq": payload["freq"] * copies, "postings": postings}
+    return replica
+
+
+def replay_snapshot(snapshot: dict[str, dict]) -> dict[str, Term]:
+    """
+    Rebuild terms by replaying every occurrence, the way test.load_postings used to
+    :param snapshot: Postings snapshot
+    :return: Dictionary of Term objects
+    """
+    terms_dict = {}
+    for term, payload in snapshot.items():
+        term = Term(term, frequency=0)
+        for doc_id, tf, positions in payload["postings"]:
+            if positions:
+                for pos in positions:
+                    term.add_occurrence(doc_id, pos)
+            else:
+                for _ in range(tf):
+                    term.add_occurrence(doc_id, None)
+        terms_dict[term.term] = term
+    return terms_dict
+
+
+def bulk_load_snapshot(snapshot: dict[str, dict]) -> dict[str, Term]:
+    """
+    Rebuild terms with Term.from_snapshot
+    :param snapshot: Postings snapshot
+    :return: Dictionary of Term objects
+    """
+    return {term: Term.from_snapshot(term, payload) for term, payload in snapshot.items()}
+
+
+def timed(function, *args):
+    """
+    Run a function once and time it
+    :return: (result, seconds)
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_load(args: argparse.Namespace) -> None:
+    """
+    Compare replaying every occurrence against the bulk-load path in test.load_postings
+    """
+    snapshot, duration = timed(load_snapshot, args.postings)
+    print(f"Unpickled {len(snapshot)} terms from {args.postings} in {duration:.6f} seconds")
+
+    for copies in (1, args.copies):
+        collection = snapshot if copies == 1 else replicate_snapshot(snapshot, copies)
+        occurrences = sum(
+            payload["freq"] for payload in collection.values()
+        )
+
+        replayed, replay_duration = timed(replay_snapshot, collection)
+        bulk, bulk_duration = timed(bulk_load_snapshot, collection)
+
+        for term, term_obj in bulk.items():
+            expected = replayed[term]
+            if (
+                term_obj.frequency != expected.frequency
+                or term_obj.postings.inorder_with_positions()
+                != expected.postings.inorder_with_positions()
+            ):
+                raise SystemExit(f"[ERROR]: Bulk load differs from replay for term '{term}'")
+
+        print(f"\n{copies}x collection, {occurrences} occurrences")
+        print(f"  replay:    {replay_duration:.6f} seconds")
+        print(f"  bulk load: {bulk_duration:.6f} seconds")
+        print(f"  speedup:   {replay_duration / bulk_duration:.1f}x")
+
+
+def bench_compression(args: argparse.Namespace) -> None:
+    """
+    Compare the size and decode speed of the postings codecs
+    """
+    snapshot = load_snapshot(args.postings)
+    print(f"Loaded {len(snapshot)} terms from {args.postings}")
+
+    for name, codec in CODECS.items():
+        encoded, encode_duration = timed(
+            lambda: [encode_postings(payload["postings"], codec) for payload in snapshot.values()]
+        )
+        _, decode_duration = timed(
+            lambda: [sum(1 for _ in iter_postings(buffer, codec)) for buffer in encoded]
+        )
+        size = sum(len(buffer) for buffer in encoded)
+        print(
+            f"  {name:<6} {size:>10} bytes  encode {encode_duration:.6f} seconds  decode {decode_duration:.6f} seconds"
+        )
+
+
+def read_queries(path: Path) -> dict[int, str]:
+    """
+    Read the text of the queries in a CACM query file
+    :param path: Path to query.text
+    :return: Dictionary of query ID -> query text
+    """
+    queries = {}
+    query_id = None
+    pointer = None
+    with path.open("r", encoding="utf-8") as f:
+        for raw in f:
+            line = raw.rstrip("\n")
+            if line.startswith(".I "):
+                query_id = int(line.split()[1])
+                queries[query_id] = ""
+                pointer = None
+            elif line in (".W", ".A", ".N", ".B", ".T"):
+                pointer = line[1]
+            elif pointer == "W" and query_id is not None:
+                queries[query_id] = f"{queries[query_id]} {line.strip()}".strip()
+
+    # query.text ends with an empty ".I 0" entry
+    return {query_id: text for query_id, text in queries.items() if text}
+
+
+def bench_intersect(args: argparse.Namespace) -> None:
+    """
+    Compare linear merge, galloping and skip pointer intersection on term pairs from the CACM queries
+    """
+    # query imports invert, only pay for it when queries are analyzed
+    from query import analyze, read_stopwords
+
+    terms_dict = bulk_load_snapshot(load_snapshot(args.postings))
+    stopword_set = read_stopwords(args.stopwords_file)
+
+    pairs = set()
+    for text in read_queries(args.queries).values():
+        terms = sorted(set(t for t in analyze(text, stopword_set, True) if t in terms_dict))
+        pairs.update((a, b) for i, a in enumerate(terms) for b in terms[i + 1 :])
+    pairs = sorted(pairs)
+    postings = sum(len(terms_dict[a].postings) + len(terms_dict[b].postings) for a, b in pairs)
+    print(f"{len(pairs)} term pairs from {args.queries}, {postings} postings per round")
+
+    expected = None
+    for method in ("merge", "gallop", "skip"):
+        result, duration = timed(
+            lambda: [
+                terms_dict[a].postings.intersect(terms_dict[b].postings, method)
+                for _ in range(args.rounds)
+                for a, b in pairs
+            ]
+        )
+        if expected is None:
+            expected = result
+        elif result != expected:
+            raise SystemExit(f"[ERROR]: {method} intersection differs from merge")
+        print(f"  {method:<6} {duration / args.rounds:.6f} seconds per round")
+
+
+def query_phrases(text: str, lengths=(2, 3)) -> list[str]:
+    """
+    Runs of consecutive words in a query, not crossing punctuation
+    :param text: Query text
+    :param lengths: Number of words per phrase
+    :return: Phrases
+    """
+    phrases = []
+    for run in re.split(r"[^A-Za-z ]+", text):
+        words = run.split()
+        for n in lengths:
+            phrases.extend(" ".join(words[i : i + n]) for i in range(len(words) - n + 1))
+    return phrases
+
+
+def nested_phrase_search(terms_dict: dict[str, Term], terms: list) -> list[int]:
+    """
+    Phrase search with nested loops over grab_positions copies, the baseline for the phrase benchmark
+    :param terms_dict: Dictionary of Term objects
+    :param terms: (offset, term) pairs
+    :return: Matching document IDs
+    """
+    if any(term not in terms_dict for _, term in terms):
+        return []
+    result = []
+    first = terms_dict[terms[0][1]].postings
+    for document_id, _ in first.inorder():
+        if not all(document_id in terms_dict[term].postings for _, term in terms[1:]):
+            continue
+        positions = [
+            (offset, terms_dict[term].postings.grab_positions(document_id)) for offset, term in terms
+        ]
+        for start in positions[0][1]:
+            if all(start + offset in candidates for offset, candidates in positions[1:]):
+                result.append(document_id)
+                break
+    return result
+
+
+def bench_phrase(args: argparse.Namespace) -> None:
+    """
+    Compare the merge-based phrase and NEAR evaluation against nested loops over positions,
+    queries are parsed up front so only evaluation is timed
+    """
+    # query imports invert, only pay for it when queries are analyzed
+    from dictionary import CompactIndex
+    from query import NearNode, PhraseNode, QueryEngine, TermNode, read_stopwords
+
+    snapshot = load_snapshot(args.postings)
+    terms_dict = bulk_load_snapshot(snapshot)
+    index = {term: len(term_obj.postings) for term, term_obj in terms_dict.items()}
+    engine = QueryEngine(terms_dict, index, stopword_set=read_stopwords(args.stopwords_file))
+
+    phrases = []
+    for text in read_queries(args.queries).values():
+        for phrase in query_phrases(text):
+            node = engine.parse(f'"{phrase}"')
+            if isinstance(node, PhraseNode):
+                phrases.append((phrase, node))
+    print(f"{len(phrases)} phrases from {args.queries}")
+
+    merged, merge_duration = timed(lambda: [list(engine.execute(node)) for _, node in phrases])
+    nested, nested_duration = timed(
+        lambda: [nested_phrase_search(terms_dict, node.terms) for _, node in phrases]
+    )
+    if merged != nested:
+        raise SystemExit("[ERROR]: Merge-based phrase search differs from nested loops")
+    print(f"  phrase, nested loops: {nested_duration:.6f} seconds")
+    print(f"  phrase, merge:        {merge_duration:.6f} seconds")
+    print(f"  matches:              {sum(map(len, merged))}")
+
+    pairs = [
+        NearNode(TermNode(a), TermNode(b), args.k)
+        for _, node in phrases
+        if len(node.terms) == 2
+        for (_, a), (_, b) in [node.terms]
+    ]
+    near, near_duration = timed(lambda: [list(engine.execute(node)) for node in pairs])
+    print(f"  {len(pairs)} NEAR/{args.k} queries: {near_duration:.6f} seconds")
+
+    if args.codec is None:
+        return
+    compact = CompactIndex.from_snapshot(snapshot, get_codec(args.codec))
+    compressed = QueryEngine(compact.terms(), compact.frequencies(), stopword_set=engine.stopword_set)
+    compressed_merged, compressed_duration = timed(
+        lambda: [list(compressed.execute(node)) for _, node in phrases]
+    )
+    compressed_near, compressed_near_duration = timed(
+        lambda: [list(compressed.execute(node)) for node in pairs]
+    )
+    if compressed_merged != merged or compressed_near != near:
+        raise SystemExit(f"[ERROR]: Phrase or NEAR results differ with {args.codec} postings")
+    print(f"  {args.codec} postings, {compact.nbytes() / 2**20:.2f} MB")
+    print(f"  phrase, merge:        {compressed_duration:.6f} seconds")
+    print(f"  NEAR/{args.k}:               {compressed_near_duration:.6f} seconds")
+
+
+def bench_ranking(args: argparse.Namespace) -> None:
+    """
+    Latency and postings evaluated when ranking every CACM query with BM25 and cosine TF-IDF,
+    exhaustive scoring vs WAND pruning
+    """
+    # query imports invert, only pay for it when queries are analyzed
+    from dictionary import CompactIndex
+    from query import read_stopwords
+    from ranking import PRUNING, SCHEMES, Ranker
+
+    snapshot = load_snapshot(args.postings)
+    terms_dict = bulk_load_snapshot(snapshot)
+    index = {term: len(term_obj.postings) for term, term_obj in terms_dict.items()}
+    lengths, norms = document_stats(terms_dict)
+    stopword_set = read_stopwords(args.stopwords_file)
+    rankers = {"arrays": Ranker(terms_dict, index, lengths, norms, stopword_set=stopword_set)}
+    if args.codec is not None:
+        compact = CompactIndex.from_snapshot(snapshot, get_codec(args.codec))
+        rankers[args.codec] = Ranker(
+            compact.terms(), compact.frequencies(), lengths, norms, stopword_set=stopword_set
+        )
+        print(f"{args.codec} postings, {compact.nbytes() / 2**20:.2f} MB")
+
+    queries = read_queries(args.queries)
+    print(f"{len(queries)} queries from {args.queries}, top {args.k}")
+    for scheme in SCHEMES:
+        results = {}
+        for name, ranker in rankers.items():
+            # the snapshot has no stored score bounds, compute them before timing
+            for text in queries.values():
+                for term in ranker.query_weights(text, scheme):
+                    ranker.term_bound(term, scheme)
+
+            for pruning in PRUNING:
+                latencies = []
+                postings = 0
+                documents = 0
+                results[name, pruning] = []
+                for text in queries.values():
+                    results[name, pruning].append(ranker.search(text, args.k, scheme, pruning))
+                    latencies.append(ranker.last_stats["latency"])
+                    postings += ranker.last_stats["postings_evaluated"]
+                    documents += ranker.last_stats["documents_scored"]
+                print(
+                    f"  {scheme:<6} {name:<6} {pruning:<10} "
+                    f"{1000 * sum(latencies) / len(queries):.3f} ms per query, "
+                    f"{postings} postings evaluated, {documents} documents scored"
+                )
+            if results[name, "wand"] != results[name, "exhaustive"]:
+                print(f"  {scheme} {name}: WAND results differ from exhaustive scoring")
+        if any(results[key] != results["arrays", key[1]] for key in results):
+            raise SystemExit(f"[ERROR]: {scheme} results differ with {args.codec} postings")
+
+
+def read_qrels(path: Path) -> dict[int, set[int]]:
+    """
+    Read the relevance judgements in a CACM qrels file
+    :param path: Path to qrels.text
+    :return: Dictionary of query ID -> IDs of the relevant documents
+    """
+    qrels = {}
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 2:
+                qrels.setdefault(int(fields[0]), set()).add(int(fields[1]))
+    return qrels
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    Percentile with linear interpolation between the closest ranks
+    :param values: Sample
+    :param p: Percentile between 0 and 100
+    :return: Value at the percentile, 0.0 for an empty sample
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def average_precision(ranking: list[int], relevant: set[int]) -> float:
+    """
+    Average precision of a ranking, relevant documents that were not retrieved count as zero
+    """
+    hits = 0
+    total = 0.0
+    for rank, document_id in enumerate(ranking, start=1):
+        if document_id in relevant:
+            hits += 1
+            total += hits / rank
+    return total / len(relevant) if relevant else 0.0
+
+
+def precision_at(ranking: list[int], relevant: set[int], n: int) -> float:
+    """
+    Fraction of the first n documents that are relevant
+    """
+    return sum(1 for document_id in ranking[:n] if document_id in relevant) / n
+
+
+def ndcg(ranking: list[int], relevant: set[int], k: int) -> float:
+    """
+    Normalized discounted cumulative gain at k of a ranking with binary relevance, the ideal
+    ranking fills all k ranks even when fewer documents were retrieved
+    """
+    dcg = sum(
+        1 / math.log2(rank + 1)
+        for rank, document_id in enumerate(ranking, start=1)
+        if document_id in relevant
+    )
+    ideal = sum(1 / math.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal if ideal else 0.0
+
+
+def load_ranker(args: argparse.Namespace):
+    """
+    Build a Ranker over the index given on the command line, binary or pickled
+    :return: Ranker object
+    """
+    from invert import set_tokenizer
+    from query import read_stopwords
+    from ranking import Ranker
+    from storage import DiskIndex, is_binary_index, read_document_stats
+
+    set_tokenizer(args.tokenizer)
+    dict_path, postings_path = args.input
+    bounds = None
+    if is_binary_index(dict_path):
+        disk_index = DiskIndex(dict_path, postings_path)
+        terms_dict = disk_index.terms()
+        index = disk_index.frequencies()
+        bounds = disk_index.bounds()
+    else:
+        terms_dict = bulk_load_snapshot(load_snapshot(postings_path))
+        index = {term: len(term_obj.postings) for term, term_obj in terms_dict.items()}
+
+    stats_path = postings_path.parent / "doclengths.bin"
+    if stats_path.is_file():
+        lengths, norms = read_document_stats(stats_path)
+    else:
+        lengths, norms = document_stats(terms_dict)
+
+    return Ranker(
+        terms_dict,
+        index,
+        lengths,
+        norms,
+        stopword_set=read_stopwords(args.stopwords_file) if args.stopwords else set(),
+        stemming=args.stemming,
+        bounds=bounds,
+    )
+
+
+# ranker of an evaluation worker process
+worker_ranker = None
+
+# barrier of the evaluation workers, passed at process start as it cannot be pickled into a task
+worker_barrier = None
+
+
+def init_worker(args: argparse.Namespace, barrier=None) -> None:
+    """
+    Load the index once per worker process
+    """
+    global worker_ranker, worker_barrier
+    worker_ranker = load_ranker(args)
+    worker_barrier = barrier
+
+
+def worker_ready() -> None:
+    """
+    Wait until every worker has loaded the index. A worker blocks here until all of them do, so
+    one call per worker reaches every worker process
+    """
+    worker_barrier.wait()
+
+
+def run_query(query: tuple[int, str], scheme: str, k: int, pruning: str) -> tuple:
+    """
+    Rank one query with the worker's ranker
+    :param query: (query ID, query text)
+    :return: (query ID, ranked document IDs, latency in seconds, postings evaluated)
+    """
+    query_id, text = query
+    results = worker_ranker.search(text, k, scheme, pruning)
+    stats = worker_ranker.last_stats
+    return query_id, [document_id for document_id, _ in results], stats["latency"], stats[
+        "postings_evaluated"
+    ]
+
+
+def bench_evaluate(args: argparse.Namespace) -> None:
+    """
+    Run every CACM query through the ranker and report latency, throughput and MAP / P@10 / nDCG
+    against the relevance judgements as JSON
+    """
+    queries = read_queries(args.queries)
+    qrels = read_qrels(args.qrels)
+    search = functools.partial(run_query, scheme=args.ranking, k=args.k, pruning=args.pruning)
+
+    if args.workers > 1:
+        barrier = multiprocessing.Barrier(args.workers)
+        with ProcessPoolExecutor(
+            max_workers=args.workers, initializer=init_worker, initargs=(args, barrier)
+        ) as executor:
+            # wait for every worker to load the index before the clock starts
+            for ready in [executor.submit(worker_ready) for _ in range(args.workers)]:
+                ready.result()
+            start = time.perf_counter()
+            runs = list(executor.map(search, queries.items()))
+            wall = time.perf_counter() - start
+    else:
+        init_worker(args)
+        start = time.perf_counter()
+        runs = [search(query) for query in queries.items()]
+        wall = time.perf_counter() - start
+
+    per_query = []
+    for query_id, ranking, latency, postings in runs:
+        entry = {
+            "query_id": query_id,
+            "latency": latency,
+            "postings_evaluated": postings,
+            "retrieved": len(ranking),
+        }
+        relevant = qrels.get(query_id)
+        if relevant:
+            entry["average_precision"] = average_precision(ranking, relevant)
+            entry["precision_at_10"] = precision_at(ranking, relevant, 10)
+            entry["ndcg"] = ndcg(ranking, relevant, args.k)
+        per_query.append(entry)
+
+    latencies = [entry["latency"] for entry in per_query]
+    judged = [entry for entry in per_query if "average_precision" in entry]
+
+    def mean(key):
+        return sum(entry[key] for entry in judged) / len(judged) if judged else 0.0
+
+    report = {
+        "config": {
+            "dictionary": str(args.input[0]),
+            "postings": str(args.input[1]),
+            "stopwords": args.stopwords,
+            "stemming": args.stemming,
+            "tokenizer": args.tokenizer,
+            "ranking": args.ranking,
+            "pruning": args.pruning,
+            "k": args.k,
+            "workers": args.workers,
+        },
+        "queries": len(per_query),
+        "judged_queries": len(judged),
+        "latency": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+        },
+        "wall_time": wall,
+        "qps": len(per_query) / wall if wall else 0.0,
+        "map": mean("average_precision"),
+        "precision_at_10": mean("precision_at_10"),
+        "ndcg": mean("ndcg"),
+        "per_query": per_query,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(output + "\n", encoding="utf-8")
+        print(
+            f"MAP {report['map']:.4f}  P@10 {report['precision_at_10']:.4f}  nDCG {report['ndcg']:.4f}  "
+            f"p50 {1000 * report['latency']['p50']:.3f} ms  {report['qps']:.1f} QPS -> {args.output}"
+        )
+
+
+def bench_lexicon(args: argparse.Namespace) -> None:
+    """
+    Check prefix, wildcard and fuzzy lookups against a scan of the vocabulary, on operands made
+    from the words of the CACM queries, and report their latency
+    """
+    import fnmatch
+    import random
+
+    from lexicon import Lexicon, auto_distance, edit_distance
+
+    vocabulary = list(load_snapshot(args.postings))
+    lexicon, build_duration = timed(Lexicon, vocabulary)
+    _, gram_duration = timed(lambda: lexicon.gram_index)
+    print(
+        f"{len(vocabulary)} terms, sorted in {1000 * build_duration:.1f} ms, "
+        f"{len(lexicon.gram_index)} grams indexed in {1000 * gram_duration:.1f} ms"
+    )
+
+    rng = random.Random(args.seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyz"
+    words = sorted(
+        {
+            word
+            for text in read_queries(args.queries).values()
+            for word in re.findall(r"[a-z]+", text.lower())
+            if len(word) > 3
+        }
+    )
+
+    def typo(word: str) -> str:
+        i = rng.randrange(len(word))
+        edit = rng.choice(("insert", "delete", "replace"))
+        if edit == "insert":
+            return word[:i] + rng.choice(alphabet) + word[i:]
+        if edit == "delete":
+            return word[:i] + word[i + 1 :]
+        return word[:i] + rng.choice(alphabet) + word[i + 1 :]
+
+    terms = sorted(vocabulary)
+
+    def fuzzy_scan(word: str) -> list[tuple[str, int]]:
+        bound = auto_distance(word)
+        distances = ((term, edit_distance(word, term, bound)) for term in terms)
+        return [(term, distance) for term, distance in distances if distance <= bound]
+
+    cases = {
+        "prefix": (
+            [word[: rng.randint(2, 5)] for word in words],
+            lambda prefix: lexicon.prefix(prefix, None),
+            lambda prefix: [term for term in terms if term.startswith(prefix)],
+        ),
+        "wildcard": (
+            [
+                pattern
+                for word in words
+                for pattern in (f"*{word[-4:]}", f"{word[:2]}*{word[-2:]}", f"*{word[1:4]}*")
+            ],
+            lambda pattern: lexicon.wildcard(pattern, None),
+            lambda pattern: [term for term in terms if fnmatch.fnmatchcase(term, pattern)],
+        ),
+        "fuzzy": (
+            [typo(word) for word in words],
+            lambda word: sorted(lexicon.fuzzy(word, auto_distance(word), None)),
+            fuzzy_scan,
+        ),
+    }
+
+    for name, (operands, lookup, scan) in cases.items():
+        latencies = []
+        for operand in operands:
+            result, duration = timed(lookup, operand)
+            latencies.append(1000 * duration)
+            if result != scan(operand):
+                raise SystemExit(f"[ERROR]: {name} lookup of '{operand}' differs from a scan")
+        under = sum(1 for latency in latencies if latency < 1)
+        print(
+            f"  {name:<8} {len(operands):>4} lookups  p50 {percentile(latencies, 50):.3f} ms  "
+            f"p95 {percentile(latencies, 95):.3f} ms  max {max(latencies):.3f} ms  "
+            f"{100 * under / len(latencies):.0f}% under 1 ms"
+        )
+    print("  every lookup matches a scan of the vocabulary")
+
+
+def bench_cache(args: argparse.Namespace) -> None:
+    """
+    Replay the CACM queries with Zipfian repetition, each request written with random case and
+    inflection, through the ranker with and without a query cache in front of it
+    """
+    import random
+
+    from query import read_stopwords
+    from querycache import QueryCache
+    from ranking import Ranker
+
+    terms_dict = bulk_load_snapshot(load_snapshot(args.postings))
+    index = {term: len(term_obj.postings) for term, term_obj in terms_dict.items()}
+    lengths, norms = document_stats(terms_dict)
+    ranker = Ranker(
+        terms_dict, index, lengths, norms, stopword_set=read_stopwords(args.stopwords_file)
+    )
+
+    rng = random.Random(args.seed)
+    queries = list(read_queries(args.queries).values())
+    rng.shuffle(queries)
+    weights = [1 / rank**args.skew for rank in range(1, len(queries) + 1)]
+
+    def variant(text: str) -> str:
+        words = []
+        for word in text.split():
+            if rng.random() < 0.3:
+                word = word.capitalize()
+            if word.isalpha() and rng.random() < 0.2:
+                word += "s"
+            words.append(word)
+        return " ".join(words)
+
+    requests = [variant(text) for text in rng.choices(queries, weights, k=args.requests)]
+    print(
+        f"{args.requests} requests over {len(queries)} queries from {args.queries} "
+        f"(Zipf s={args.skew}), top {args.k} with BM25"
+    )
+
+    def rank(cache: QueryCache | None, text: str):
+        if cache is None:
+            return ranker.search(text, args.k)
+        key = tuple(sorted(ranker.query_terms(text).items()))
+        return cache.get_or_compute(key, lambda: ranker.search(text, args.k))
+
+    expected = {}
+    for size in (None, *args.sizes):
+        cache = None if size is None else QueryCache(size)
+        latencies = []
+        for text in requests:
+            results, duration = timed(rank, cache, text)
+            latencies.append(1000 * duration)
+            if expected.setdefault(text, results) != results:
+                raise SystemExit(f"[ERROR]: cached results of '{text[:40]}' differ from ranking it")
+        label = "no cache" if cache is None else f"cache {size}"
+        line = (
+            f"  {label:<10} {sum(latencies) / len(latencies):.3f} ms per request  "
+            f"p50 {percentile(latencies, 50):.3f} ms  p95 {percentile(latencies, 95):.3f} ms"
+        )
+        if cache is not None:
+            stats = cache.stats()
+            line += f"  {100 * stats['hit_rate']:.1f}% hits, {stats['evictions']} evictions"
+        print(line)
+    print("  every cached result matches ranking the request")
+
+
+def bench_stemmer(args: argparse.Namespace) -> None:
+    """
+    Check FastPorterStemmer against PorterStemmer on every word of the collection and compare
+    their speed per distinct word and over the token stream
+    """
+    from invert import iter_documents, normalize, tokenize
+    from stemming import FastPorterStemmer, PorterStemmer
+
+    tokens = [
+        term
+        for doc in iter_documents(args.input)
+        for term in (normalize(token) for token in tokenize(doc.text))
+        if term
+    ]
+    vocabulary = sorted(set(tokens))
+    print(f"{len(tokens)} tokens, {len(vocabulary)} distinct words")
+
+    fast = FastPorterStemmer()
+    mismatches = [
+        word
+        for word in vocabulary
+        if fast.stem_word(word) != PorterStemmer().stem(word, 0, len(word) - 1)
+    ]
+    if mismatches:
+        raise SystemExit(
+            f"[ERROR]: {len(mismatches)} word(s) stem differently, e.g. {mismatches[:10]}"
+        )
+    print("  fast stems are identical to PorterStemmer on the whole vocabulary")
+
+    reference = PorterStemmer()
+    for label, words in (("per distinct word", vocabulary), ("per token", tokens)):
+        _, new_duration = timed(lambda: [PorterStemmer().stem(w, 0, len(w) - 1) for w in words])
+        _, reused_duration = timed(lambda: [reference.stem(w, 0, len(w) - 1) for w in words])
+        _, fast_duration = timed(lambda: [fast.stem_word(w) for w in words])
+        _, many_duration = timed(fast.stem_many, words)
+        print(f"\n{label}")
+        for name, duration in (
+            ("PorterStemmer() per word", new_duration),
+            ("reused PorterStemmer", reused_duration),
+            ("FastPorterStemmer", fast_duration),
+            ("stem_many", many_duration),
+        ):
+            print(
+                f"  {name:<25} {1e6 * duration / len(words):.3f} us  "
+                f"{new_duration / duration:.1f}x"
+            )
+
+
+def bench_tokenizer(args: argparse.Namespace) -> None:
+    """
+    Check the fast tokenizer against split_tokens + normalize on every document of the collection
+    and on random strings, list where it differs from nltk's word_tokenize, and compare the
+    throughput in tokens per second of the fast tokenizer, split_tokens and word_tokenize
+    """
+    import random
+    from collections import Counter
+    from difflib import SequenceMatcher
+
+    from invert import PUNCTUATION, fast_terms, iter_documents, normalize, split_tokens
+
+    texts = [doc.text for doc in iter_documents(args.input)]
+
+    def reference(text: str) -> list[str]:
+        return [normalize(token) for token in split_tokens(text)]
+
+    mismatches = [i for i, text in enumerate(texts) if fast_terms(text) != reference(text)]
+
+    # random strings over punctuation, unicode whitespace and letters whose lowercase is special
+    rng = random.Random(args.seed)
+    alphabet = (
+        list(PUNCTUATION) + list(" \t\n\x1c\xa0") + list("aZ9+=*#_\xe9\u0130\u03a3\xdf\ufb01\xbd")
+    )
+    fuzzed = 0
+    for _ in range(args.fuzz):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+        if fast_terms(text) != reference(text):
+            fuzzed += 1
+            if fuzzed == 1:
+                print(f"  first fuzz mismatch: {text!r}")
+
+    if mismatches or fuzzed:
+        raise SystemExit(
+            f"[ERROR]: {len(mismatches)} document(s) and {fuzzed} random string(s) tokenize "
+            f"differently, e.g. documents {mismatches[:10]}"
+        )
+    print(
+        f"  fast terms are identical to split_tokens + normalize on {len(texts)} documents "
+        f"and {args.fuzz} random strings"
+    )
+
+    timings = []
+    try:
+        from nltk.tokenize import word_tokenize
+
+        word_tokenize("punkt")
+    except (ImportError, LookupError):
+        print(
+            "  nltk punkt tokenizer is not installed, --tokenizer nltk falls back to split_tokens "
+            "and gives the fast terms, word_tokenize is skipped"
+        )
+    else:
+        # runs of tokens whose terms or positions differ between word_tokenize and fast, e.g.
+        # "don't" -> do n't / don ' t
+        divergences = Counter()
+        same = 0
+        for text in texts:
+            expected = word_tokenize(text)
+            terms = [normalize(token) for token in expected]
+            fast = fast_terms(text)
+            if terms == fast:
+                same += 1
+                continue
+            # fast terms line up with the split_tokens tokens
+            tokens = split_tokens(text)
+            matcher = SequenceMatcher(None, terms, fast, autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag != "equal":
+                    divergences[(" ".join(expected[i1:i2]), " ".join(tokens[j1:j2]))] += 1
+        print(
+            f"  word_tokenize gives the same terms as fast on {same} of {len(texts)} documents, "
+            f"{sum(divergences.values())} differing token runs, most common:"
+        )
+        for (expected, tokens), count in divergences.most_common(args.divergences):
+            print(f"    {count:>6}  word_tokenize {expected!r:<24} fast {tokens!r}")
+        timings.append(
+            ("word_tokenize + normalize", lambda text: [normalize(t) for t in word_tokenize(text)])
+        )
+    timings += [("split_tokens + normalize", reference), ("fast", fast_terms)]
+
+    print()
+    baseline = None
+    for name, function in timings:
+        tokens, duration = timed(lambda: sum(len(function(text)) for text in texts))
+        baseline = baseline or duration
+        print(
+            f"  {name:<26} {tokens:>8} tokens {tokens / duration:>12,.0f} tokens/s  "
+            f"{baseline / duration:.1f}x"
+        )
+
+
+def import_times(module: str) -> list[tuple[str, int, int]]:
+    """
+    Import a module in a fresh interpreter with `python -X importtime`
+    :param module: Module name
+    :return: (module, self microseconds, cumulative microseconds) of every module imported, in
+             the order the report lists them, the module itself last
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=Path(__file__).resolve().parent,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"[ERROR]: import {module} failed:\n{result.stderr}")
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        times.append((name.strip(), int(own), int(cumulative)))
+    return times
+
+
+def bench_startup(args: argparse.Namespace) -> None:
+    """
+    Import time of the modules of the program in fresh interpreters, fails when a module takes
+    longer than the budget or pulls in a forbidden package such as nltk
+    """
+    failures = []
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        total = statistics.median(run[-1][2] for run in runs) / 1000
+        print(f"{module}: {total:.1f} ms (median of {args.repeat}), {len(runs[0])} modules imported")
+
+        slowest = sorted(runs[0][:-1], key=lambda entry: entry[2], reverse=True)[: args.top]
+        for name, _, cumulative in slowest:
+            print(f"  {cumulative / 1000:>8.1f} ms  {name}")
+
+        loaded = {name.split(".")[0] for name, _, _ in runs[0]}
+        for package in args.forbid:
+            if package in loaded:
+                failures.append(f"import {module} loads {package}")
+        if total > args.budget_ms:
+            failures.append(f"import {module} takes {total:.1f} ms, over {args.budget_ms} ms")
+
+    if failures:
+        raise SystemExit("[ERROR]: " + "; ".join(failures))
+    print(f"\nEvery module imports in under {args.budget_ms} ms without {', '.join(args.forbid)}")
+
+
+def traced(function, *args):
+    """
+    Run a function once under tracemalloc
+    :return: (result, bytes still allocated by the result, peak bytes while it ran)
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, current, peak
+
+
+def bench_dictionary(args: argparse.Namespace) -> None:
+    """
+    Memory of terms_dict and the index dict against CompactIndex, and the cost of a lookup in each
+    """
+    from dictionary import CompactDictionary, CompactIndex
+
+    snapshot = load_snapshot(args.postings)
+    postings = sum(len(payload["postings"]) for payload in snapshot.values())
+    print(f"Loaded {len(snapshot)} terms, {postings} postings from {args.postings}")
+
+    def current_structures():
+        terms_dict = bulk_load_snapshot(snapshot)
+        index = {term: term_obj.postings.size for term, term_obj in terms_dict.items()}
+        return terms_dict, index
+
+    (terms_dict, index), current_size, current_peak = traced(current_structures)
+    compact, compact_size, compact_peak = traced(CompactIndex.from_snapshot, snapshot)
+
+    mismatches = [
+        term
+        for term, term_obj in terms_dict.items()
+        if compact.document_frequency(term) != index[term]
+        or compact.term(term).frequency != term_obj.frequency
+        or compact.term(term).postings.inorder_with_positions()
+        != term_obj.postings.inorder_with_positions()
+    ]
+    if mismatches or len(compact) != len(terms_dict):
+        raise SystemExit(f"[ERROR]: CompactIndex differs for {len(mismatches)} term(s), e.g. {mismatches[:10]}")
+
+    # the dictionary alone: strings, document and collection frequencies
+    def current_dictionary():
+        return {term: (len(payload["postings"]), payload["freq"]) for term, payload in snapshot.items()}
+
+    def compact_dictionary():
+        dictionary = CompactDictionary(snapshot)
+        return dictionary, array("I", (len(snapshot[term]["postings"]) for term in dictionary)), array(
+            "I", (snapshot[term]["freq"] for term in dictionary)
+        )
+
+    _, current_dictionary_size, _ = traced(current_dictionary)
+    _, compact_dictionary_size, _ = traced(compact_dictionary)
+
+    print("\nallocated (tracemalloc)")
+    for name, size, peak in (
+        ("terms_dict + index", current_size, current_peak),
+        ("CompactIndex", compact_size, compact_peak),
+    ):
+        print(
+            f"  {name:<20} {size / 2**20:>8.2f} MB  {size / len(snapshot):>7.1f} B/term  "
+            f"{size / postings:>6.1f} B/posting  peak {peak / 2**20:.2f} MB"
+        )
+    print(f"  CompactIndex arrays and blob: {compact.nbytes() / 2**20:.2f} MB")
+    print(f"  {current_size / compact_size:.1f}x smaller")
+
+    print("\ndictionary only (terms, df, cf)")
+    print(f"  dict[str, (df, cf)]  {current_dictionary_size / 1024:>8.1f} KB")
+    print(
+        f"  front-coded blob     {compact_dictionary_size / 1024:>8.1f} KB  "
+        f"({len(compact.dictionary.blob) / 1024:.1f} KB of terms, block size {compact.dictionary.block_size})"
+    )
+
+    terms = list(snapshot) * args.repeat
+    _, dict_duration = timed(lambda: [index.get(term) for term in terms])
+    _, find_duration = timed(lambda: [compact.document_frequency(term) for term in terms])
+    _, dict_term_duration = timed(lambda: [terms_dict[term] for term in terms])
+    _, view_duration = timed(lambda: [compact.term(term) for term in terms])
+    print("\nlookup")
+    print(f"  dict df            {1e6 * dict_duration / len(terms):.3f} us")
+    print(f"  CompactIndex df    {1e6 * find_duration / len(terms):.3f} us")
+    print(f"  dict Term          {1e6 * dict_term_duration / len(terms):.3f} us")
+    print(f"  CompactIndex Term  {1e6 * view_duration / len(terms):.3f} us (postings copied out)")
+
+
+class PlainNode:
+    """Node as it was before it was slotted"""
+
+    def __init__(self, document_id, tf=0, positions=None):
+        self.document_id = document_id
+        self.tf = tf
+        self.positions = positions if positions is not None else []
+
+
+class PlainTerm:
+    """Term as it was before it was slotted"""
+
+    def __init__(self, term, frequency=0, postings=None):
+        self.term = term
+        self.frequency = frequency
+        self.postings = postings if postings is not None else PostingsList()
+
+
+class PlainDocument:
+    """Document as it was before it was slotted"""
+
+    def __init__(self, document_id, title, text, publication_date, authors, n, x):
+        self.document_id = document_id
+        self.title = title
+        self.text = text
+        self.publication_date = publication_date
+        self.authors = authors
+        self.n = n
+        self.x = x
+
+
+def bench_objects(args: argparse.Namespace) -> None:
+    """
+    Memory per object and construction / attribute read time of the slotted Node, Term and Document
+    against the plain classes they replaced
+    """
+    from document import Document
+    from invert import iter_documents
+    from postings import Node
+
+    # strings are built up front, the line lists are copied per object as the parser does
+    fields = [
+        (doc.document_id, doc.title, doc.text, doc.publication_date, doc.authors, doc.n, doc.x)
+        for doc in iter_documents(args.input)
+    ]
+    copies = max(1, args.count // len(fields))
+    fields = [field for _ in range(copies) for field in fields]
+    words = [f"term{i}" for i in range(args.count)]
+    positions = [[i, i + 7, i + 19] for i in range(args.count)]
+
+    cases = (
+        ("Node, no positions", PlainNode, Node, lambda cls: [cls(i, 1) for i in range(args.count)], "tf"),
+        (
+            "Node, 3 positions",
+            PlainNode,
+            Node,
+            lambda cls: [cls(i, 3, positions[i]) for i in range(args.count)],
+            "positions",
+        ),
+        ("Term, no postings", PlainTerm, Term, lambda cls: [cls(word) for word in words], "frequency"),
+        (
+            "Document",
+            PlainDocument,
+            Document,
+            lambda cls: [
+                cls(document_id, title, text, date, authors[:], n[:], x[:])
+                for document_id, title, text, date, authors, n, x in fields
+            ],
+            "title",
+        ),
+    )
+    print(f"{args.count} objects per class, {len(fields)} documents ({copies}x {args.input})")
+    for label, plain_class, slotted_class, build, attribute in cases:
+        print(f"\n{label}")
+        results = {}
+        for name, cls in (("plain", plain_class), ("slotted", slotted_class)):
+            objects, size, _ = traced(build, cls)
+            _, build_duration = timed(build, cls)
+            getter = operator.attrgetter(attribute)
+            _, read_duration = timed(lambda: [getter(obj) for obj in objects])
+            results[name] = size / len(objects)
+            print(
+                f"  {name:<8} {size / len(objects):>7.1f} B/object  "
+                f"build {1e9 * build_duration / len(objects):>6.1f} ns  "
+                f"read .{attribute} {1e9 * read_duration / len(objects):>6.1f} ns"
+            )
+            del objects
+        print(f"  saving   {results['plain'] - results['slotted']:.1f} B/object")
+
+
+def replicate_collection(source: Path, target: Path, copies: int) -> int:
+    """
+    Write a synthetic collection repeating every document of a CACM file under new document IDs
+    :param source: Path to cacm.all
+    :param target: Path of the synthetic file
+    :param copies: Number of replicas
+    :return: Size of the synthetic file in bytes
+    """
+    lines = source.read_text(encoding="utf-8").splitlines(keepends=True)
+    stride = 1 + max(
+        (int(line.split()[1]) for line in lines if line.startswith(".I ")), default=0
+    )
+    with target.open("w", encoding="utf-8") as f:
+        for copy in range(copies):
+            for line in lines:
+                if line.startswith(".I "):
+                    line = f".I {copy * stride + int(line.split()[1])}\n"
+                f.write(line)
+    return target.stat().st_size
+
+
+def parse_collection(path: Path, mode: str) -> tuple[int, float, int]:
+    """
+    Parse a collection in a fresh worker process
+    :param path: Path to the collection
+    :param mode: "list" to read every document with read_documents, "stream" to consume
+                 iter_documents one document at a time
+    :return: (number of documents, seconds, peak resident memory in KB)
+    """
+    import resource
+
+    from invert import iter_documents, read_documents
+
+    start = time.perf_counter()
+    if mode == "list":
+        count = len(read_documents(path))
+    else:
+        count = sum(1 for _ in iter_documents(path))
+    duration = time.perf_counter() - start
+    return count, duration, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_parse(args: argparse.Namespace) -> None:
+    """
+    Peak memory of parsing a synthetic concatenation of the collection into a list vs streaming
+    """
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as tmpdir:
+        path = Path(tmpdir) / "synthetic.all"
+        size = replicate_collection(args.input, path, args.copies)
+        print(f"{args.copies}x {args.input}: {size / 2**20:.1f} MB")
+
+        for mode in ("stream", "list"):
+            # a new process per mode so the peak of one does not hide the other
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                count, duration, peak = executor.submit(parse_collection, path, mode).result()
+            print(
+                f"  {mode:<6} {count} documents in {duration:.3f} seconds, "
+                f"peak memory {peak / 1024:.1f} MB"
+            )
+
+
+def bench_analysis(args: argparse.Namespace) -> None:
+    """
+    Build the collection with and without --stemming and check that test.load_collection analyzes
+    the words of the CACM queries into the indexed terms of each build, for ranked and boolean
+    queries, and that ranking them with WAND gives the results of exhaustive scoring
+    """
+    import contextlib
+    import io
+
+    import test
+    from invert import text_terms
+    from query import read_stopwords
+    from stemcache import stem_cache
+
+    queries = read_queries(args.queries)
+    stopword_set = read_stopwords(args.stopwords_file)
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as tmpdir:
+        for stemming in (True, False):
+            output = Path(tmpdir) / ("stemmed" if stemming else "unstemmed")
+            command = [
+                sys.executable,
+                "invert.py",
+                "--input",
+                str(args.input),
+                "--output",
+                str(output / "output.txt"),
+                "--stopwords",
+                "--stopwords-file",
+                str(args.stopwords_file),
+            ]
+            subprocess.run(
+                command + (["--stemming"] if stemming else []),
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            dict_path, postings_path = output / "dictionary.bin", output / "postings.bin"
+
+            # the build's setting, and the default of test.py whatever the build
+            for flag in {stemming, True}:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    test.load_collection(
+                        dict_path, postings_path, args.stopwords_file, True, flag
+                    )
+                ranker = test.ranker
+                engine = test.query_engine
+                label = f"{'stemmed' if stemming else 'unstemmed':<9} build, stemming={flag!s:<5}"
+                missing = 0
+                words = 0
+                for text in queries.values():
+                    terms = ranker.query_terms(text)
+                    for word in text_terms(text):
+                        if not word or word in stopword_set:
+                            continue
+                        expected = stem_cache.stem(word) if stemming else word
+                        if expected not in ranker.index:
+                            continue
+                        words += 1
+                        if expected not in terms:
+                            missing += 1
+                            if flag == stemming:
+                                raise SystemExit(
+                                    f"[ERROR]: {label}: '{word}' of query '{text[:40]}' is not "
+                                    f"analyzed into the indexed term '{expected}'"
+                                )
+                        elif flag == stemming and engine.search(word) != list(
+                            engine.terms_dict[expected].postings.doc_ids
+                        ):
+                            raise SystemExit(f"[ERROR]: {label}: boolean query '{word}' differs")
+                    for scheme in ("bm25", "cosine"):
+                        wand = ranker.search(text, args.k, scheme, "wand")
+                        if wand != ranker.search(text, args.k, scheme, "exhaustive"):
+                            raise SystemExit(f"[ERROR]: {label}: WAND differs for '{text[:40]}'")
+                print(
+                    f"  {label}  {words} indexed query words, "
+                    f"{words - missing} analyzed into their indexed term"
+                )
+    print("  every query word of a build is analyzed into its indexed term with its own setting")
+
+
+def read_cli() -> argparse.Namespace:
+    """
+    Read command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for the inverted index",
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    load = subparsers.add_parser("load", help="Postings load time, replay vs bulk load")
+    load.add_argument(
+        "--postings",
+        type=Path,
+        default=Path("output/postings.pkl.gz"),
+        help="Postings snapshot written by invert.py --format pickle",
+    )
+    load.add_argument(
+        "--copies",
+        type=int,
+        default=100,
+        help="Size of the synthetic replica relative to the collection",
+    )
+    load.set_defaults(run=bench_load)
+
+    compression = subparsers.add_parser("compression", help="Postings size and decode time per codec")
+    compression.add_argument(
+        "--postings",
+        type=Path,
+        default=Path("output/postings.pkl.gz"),
+        help="Postings snapshot written by invert.py --format pickle",
+    )
+    compression.set_defaults(run=bench_compression)
+
+    intersect = subparsers.add_parser("intersect", help="AND intersection of CACM query term pairs")
+    intersect.add_argument(
+        "--postings",
+        type=Path,
+        default=Path("output/postings.pkl.gz"),
+        help="Postings snapshot written by invert.py --format pickle",
+    )
+    intersect.add_argument(
+        "--queries",
+        type=Path,
+        default=Path("cacm/query.text"),
+        help="CACM query file",
+    )
+    intersect.add_argument(
+        "--stopwords-file",
+        type=Path,
+        default=Path("stopwords.txt"),
+        help="Stopwords dropped from the queries",
+    )
+    intersect.add_argument(
+        "--rounds",
+        type=int,
+        default=5,
+        help="Number of times every pair is intersected",
+    )
+    intersect.set_defaults(run=bench_intersect)
+
+    phrase = subparsers.add_parser("phrase", help="Phrase and NEAR queries from the CACM queries")
+    phrase.add_argument(
+        "--postings",
+        type=Path,
+        default=Path("output/postings.pkl.gz"),
+        help="Postings snapshot written by invert.py --format pickle",
+    )
+    phrase.add_argument(
+        "--queries",
+        type=Path,
+        default=Path("cacm/query.text"),
+        help="CACM query file",
+    )
+    phrase.add_argument(
+        "--stopwords-file",
+        type=Path,
+        default=Path("stopwords.txt"),
+        help="Stopwords file the index was built with",
+    )
+    phrase.add_argument(
+        "-k",
+        type=int,
+        default=5,
+        help="Window of the NEAR queries",
+    )
+    phrase.add_argument(
+        "--codec",
+        choices=sorted(CODECS),
+        default=None,
+        help="Also run with the postings kept encoded in memory with this codec and check the results match",
+    )
+    phrase.set_defaults(run=bench_phrase)
+
+    ranking = subparsers.add_parser(
+        "ranking", help="Ranked retrieval latency on the CACM queries, exhaustive vs WAND"
+    )
+    ranking.add_argument(
+        "--postings",
+        type=Path,
+        default=Path("output/postings.pkl.gz"),
+        help="Postings snapshot written by invert.py --format pickle",
+    )
+    ranking.add_argument(
+        "--queries",
+        type=Path,
+        default=Path("cacm/query.text"),
+        help="CACM query file",
+    )
+    ranking.add_argument(
+        "--stopwords-file",
+        type=Path,
+        default=Path("stopwords.txt"),
+        help="Stopwords file the index was built with",
+    )
+    ranking.add_argument(
+        "-k",
+        type=int,
+        default=10,
+        help="Number of results per query",
+    )
+    ranking.add_argument(
+        "--codec",
+        choices=sorted(CODECS),
+        default=None,
+        help="Also run with the postings kept encoded in memory with this codec and check the results match",
+    )
+    ranking.set_defaults(run=bench_ranking)
+
+    lexicon = subparsers.add_parser(
+        "lexicon", help="Correctness and latency of prefix, wildcard and fuzzy term lookup"
+    )
+    lexicon.add_argument(
+        "--postings",
+        type=Path,
+        default=Path("output/postings.pkl.gz"),
+        help="Postings snapshot written by invert.py --format pickle",
+    )
+    lexicon.add_argument(
+        "--queries",
+        type=Path,
+        default=Path("cacm/query.text"),
+        help="CACM query file the operands are made from",
+    )
+    lexicon.add_argument("--seed", type=int, default=0, help="Seed of the misspellings")
+    lexicon.set_defaults(run=bench_lexicon)
+
+    cache = subparsers.add_parser(
+        "cache", help="Ranked queries with Zipfian repetition, with and without the query cache"
+    )
+    cache.add_argument(
+        "--postings",
+        type=Path,
+        default=Path("output/postings.pkl.gz"),
+        help="Postings snapshot written by invert.py --format pickle",
+    )
+    cache.add_argument(
+        "--queries",
+        type=Path,
+        default=Path("cacm/query.text"),
+        help="CACM query file",
+    )
+    cache.add_argument(
+        "--stopwords-file",
+        type=Path,
+        default=Path("stopwords.txt"),
+        help="Stopwords file the index was built with",
+    )
+    cache.add_argument("--requests", type=int, default=5000, help="Number of requests replayed")
+    cache.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[8, 32, 1024],
+        help="Cache sizes to compare, in queries",
+    )
+    cache.add_argument("--skew", type=float, default=1.1, help="Exponent of the Zipf distribution")
+    cache.add_argument("-k", type=int, default=10, help="Number of results per query")
+    cache.add_argument("--seed", type=int, default=0, help="Seed of the requests")
+    cache.set_defaults(run=bench_cache)
+
+    analysis = subparsers.add_parser(
+        "analysis", help="Query analysis and ranking against a stemmed and an unstemmed build"
+    )
+    analysis.add_argument(
+        "--input",
+        type=Path,
+        default=Path("cacm/cacm.all"),
+        help="Collection to build",
+    )
+    analysis.add_argument(
+        "--queries",
+        type=Path,
+        default=Path("cacm/query.text"),
+        help="CACM query file",
+    )
+    analysis.add_argument(
+        "--stopwords-file",
+        type=Path,
+        default=Path("stopwords.txt"),
+        help="Stopwords file of the builds",
+    )
+    analysis.add_argument("-k", type=int, default=10, help="Number of results per query")
+    analysis.add_argument(
+        "--tmpdir", type=Path, default=None, help="Directory of the temporary builds"
+    )
+    analysis.set_defaults(run=bench_analysis)
+
+    stemmer = subparsers.add_parser(
+        "stemmer", help="Conformance and speed of the fast stemmer against PorterStemmer"
+    )
+    stemmer.add_argument(
+        "--input",
+        "-i",
+        type=Path,
+        default=Path("cacm/cacm.all"),
+        help="Collection the vocabulary is taken from",
+    )
+    stemmer.set_defaults(run=bench_stemmer)
+
+    tokenizer = subparsers.add_parser(
+        "tokenizer", help="Conformance and throughput of the fast tokenizer against nltk"
+    )
+    tokenizer.add_argument(
+        "--input",
+        "-i",
+        type=Path,
+        default=Path("cacm/cacm.all"),
+        help="Collection that is tokenized",
+    )
+    tokenizer.add_argument(
+        "--fuzz",
+        type=int,
+        default=100000,
+        help="Number of random strings checked",
+    )
+    tokenizer.add_argument("--seed", type=int, default=0, help="Seed of the random strings")
+    tokenizer.add_argument(
+        "--divergences",
+        type=int,
+        default=20,
+        help="Number of the most common differences from word_tokenize listed",
+    )
+    tokenizer.set_defaults(run=bench_tokenizer)
+
+    dictionary = subparsers.add_parser(
+        "dictionary", help="Memory of terms_dict against the compact dictionary (tracemalloc)"
+    )
+    dictionary.add_argument(
+        "--postings",
+        type=Path,
+        default=Path("output/postings.pkl.gz"),
+        help="Postings snapshot written by invert.py --format pickle",
+    )
+    dictionary.add_argument(
+        "--repeat", type=int, default=3, help="Lookups of every term in the lookup timings"
+    )
+    dictionary.set_defaults(run=bench_dictionary)
+
+    objects = subparsers.add_parser(
+        "objects", help="Memory and speed of the slotted Node, Term and Document classes"
+    )
+    objects.add_argument(
+        "--input",
+        "-i",
+        type=Path,
+        default=Path("cacm/cacm.all"),
+        help="Collection the Document fields are taken from",
+    )
+    objects.add_argument(
+        "--count", type=int, default=100000, help="Number of objects built per class"
+    )
+    objects.set_defaults(run=bench_objects)
+
+    startup = subparsers.add_parser(
+        "startup", help="Import time of the program's modules, python -X importtime"
+    )
+    startup.add_argument(
+        "--modules",
+        nargs="+",
+        default=["invert", "query", "ranking", "segments", "test"],
+        help="Modules to import",
+    )
+    startup.add_argument("--repeat", type=int, default=5, help="Imports per module")
+    startup.add_argument("--top", type=int, default=5, help="Slowest dependencies listed")
+    startup.add_argument(
+        "--budget-ms",
+        type=float,
+        default=250.0,
+        help="Fail when a module takes longer than this to import",
+    )
+    startup.add_argument(
+        "--forbid",
+        nargs="*",
+        default=["nltk"],
+        help="Fail when importing a module loads one of these packages",
+    )
+    startup.set_defaults(run=bench_startup)
+
+    parse = subparsers.add_parser(
+        "parse", help="Peak memory of parsing a synthetic collection, list vs streaming"
+    )
+    parse.add_argument(
+        "--input",
+        "-i",
+        type=Path,
+        default=Path("cacm/cacm.all"),
+        help="Collection that is replicated",
+    )
+    parse.add_argument(
+        "--copies",
+        type=int,
+        default=1000,
+        help="Number of replicas, 1000 copies of cacm.all are about 2 GB",
+    )
+    parse.add_argument(
+        "--tmpdir",
+        type=Path,
+        default=None,
+        help="Directory the synthetic collection is written to",
+    )
+    parse.set_defaults(run=bench_parse)
+
+    evaluate = subparsers.add_parser(
+        "evaluate", help="Latency, throughput and MAP / P@10 / nDCG of the CACM queries as JSON"
+    )
+    evaluate.add_argument(
+        "--input",
+        "-i",
+        type=Path,
+        nargs=2,
+        metavar=("DICTIONARY", "POSTINGS"),
+        default=[Path("output/dictionary.bin"), Path("output/postings.bin")],
+        help="Dictionary and postings files written by invert.py, binary or pickled",
+    )
+    evaluate.add_argument(
+        "--queries",
+        type=Path,
+        default=Path("cacm/query.text"),
+        help="CACM query file",
+    )
+    evaluate.add_argument(
+        "--qrels",
+        type=Path,
+        default=Path("cacm/qrels.text"),
+        help="CACM relevance judgements",
+    )
+    evaluate.add_argument(
+        "--stopwords",
+        action="store_true",
+        default=False,
+        help="The index was built with --stopwords",
+    )
+    evaluate.add_argument(
+        "--stopwords-file",
+        type=Path,
+        default=Path("stopwords.txt"),
+        help="Stopwords file the index was built with",
+    )
+    evaluate.add_argument(
+        "--stemming",
+        action="store_true",
+        default=False,
+        help="The index was built with --stemming",
+    )
+    evaluate.add_argument(
+        "--tokenizer",
+        choices=("nltk", "fast"),
+        default="nltk",
+        help="Tokenizer the index was built with",
+    )
+    evaluate.add_argument(
+        "--ranking",
+        choices=("bm25", "cosine"),
+        default="bm25",
+        help="Scoring scheme",
+    )
+    evaluate.add_argument(
+        "--pruning",
+        choices=("wand", "exhaustive"),
+        default="wand",
+        help="Query processing strategy",
+    )
+    evaluate.add_argument(
+        "-k",
+        type=int,
+        default=100,
+        help="Number of results per query, MAP and nDCG are computed over them",
+    )
+    evaluate.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes the queries are spread over",
+    )
+    evaluate.add_argument(
+        "--output",
+        "-o",
+        type=Path,
+        default=None,
+        help="Write the JSON report to this file instead of printing it",
+    )
+    evaluate.set_defaults(run=bench_evaluate)
+
+    return parser.parse_args()
+
+
+def main():
+    args = read_cli()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+import sys
+from array import array
+from bisect import bisect_right
+from typing import Iterable, Iterator, List, Tuple
+
+from postings import Node
+
+# postings per independently encoded block of a CompressedPostingsList, cursors jump whole blocks
+BLOCK_SIZE = 128
+
+
+class RawCodec:
+    """Fixed width little-endian 32-bit integers, no gaps"""
+
+    name = "raw"
+    gaps = False
+
+    def encode(self, values: Iterable[int]) -> bytes:
+        """
+        Encode integers
+        :param values: Non-negative integers
+        :return: Encoded bytes
+        """
+        values = array("I", values)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values.tobytes()
+
+    def decode(self, buffer) -> Iterator[int]:
+        """
+        Decode integers written by encode
+        :param buffer: Bytes-like object
+        :return: Iterator over the integers
+        """
+        values = array("I")
+        values.frombytes(buffer)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return iter(values)
+
+
+class VByteCodec:
+    """Variable-byte, 7 bits per byte with the high bit marking the last byte of a number"""
+
+    name = "vbyte"
+    gaps = True
+
+    def encode(self, values: Iterable[int]) -> bytes:
+        """
+        Encode integers
+        :param values: Non-negative integers
+        :return: Encoded bytes
+        """
+        result = bytearray()
+        for value in values:
+            if value < 0:
+                raise ValueError(f"Cannot encode negative value {value}.")
+            if value < 128:
+                result.append(value | 128)
+                continue
+            chunk = []
+            while True:
+                chunk.append(value & 127)
+                if value < 128:
+                    break
+                value >>= 7
+            chunk[0] |= 128
+            result.extend(reversed(chunk))
+        return bytes(result)
+
+    def decode(self, buffer) -> Iterator[int]:
+        """
+        Decode integers written by encode, one at a time
+        :param buffer: Bytes-like object
+        :return: Iterator over the integers
+        """
+        n = 0
+        for byte in bytes(buffer):
+            if byte < 128:
+                n = (n << 7) | byte
+            else:
+                yield (n << 7) | (byte & 127)
+                n = 0
+
+
+class GammaCodec:
+    """Elias-gamma, bit aligned, values are shifted by one so zero can be encoded"""
+
+    name = "gamma"
+    gaps = True
+
+    def encode(self, values: Iterable[int]) -> bytes:
+        """
+        Encode integers
+        :param values: Non-negative integers
+        :return: Encoded bytes
+        """
+        bits = []
+        for value in values:
+            if value < 0:
+                raise ValueError(f"Cannot encode negative value {value}.")
+            binary = bin(value + 1)[2:]
+            bits.append("0" * (len(binary) - 1))
+            bits.append(binary)
+        bits = "".join(bits)
+
+        # pad with zeros, an unterminated run of zeros marks the end of the stream
+        bits += "0" * (-len(bits) % 8)
+        return int(bits, 2).to_bytes(len(bits) // 8, "big") if bits else b""
+
+    def decode(self, buffer) -> Iterator[int]:
+        """
+        Decode integers written by encode, one at a time
+        :param buffer: Bytes-like object
+        :return: Iterator over the integers
+        """
+        buffer = bytes(buffer)
+        bits = format(int.from_bytes(buffer, "big"), f"0{len(buffer) * 8}b") if buffer else ""
+        i = 0
+        while True:
+            start = bits.find("1", i)
+            if start == -1:
+                return
+            length = start - i
+            yield int(bits[start : start + length + 1], 2) - 1
+            i = start + length + 1
+
+
+CODECS = {codec.name: codec for codec in (RawCodec(), VByteCodec(), GammaCodec())}
+
+
+def get_codec(name: str):
+    """
+    Look up a codec by name
+    :param name: One of CODECS
+    :return: Codec object
+    """
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown codec '{name}', expected one of {sorted(CODECS)}.") from None
+
+
+def encode_postings(postings: Iterable[Tuple[int, int, List[int]]], codec) -> bytes:
+    """
+    Encode a postings list as doc_id, tf, n_positions, positions... per posting. Codecs that use
+    gaps store document IDs and positions as differences from the previous one
+    :param postings: (document_id, tf, positions) tuples in document ID order
+    :param codec: Codec object
+    :return: Encoded bytes
+    """
+
+    def values():
+        previous_doc = 0
+        for document_id, tf, positions in postings:
+            if codec.gaps:
+                yield document_id - previous_doc
+                previous_doc = document_id
+            else:
+                yield document_id
+            yield tf
+            yield len(positions)
+            previous_pos = 0
+            for pos in positions:
+                if codec.gaps:
+                    yield pos - previous_pos
+                    previous_pos = pos
+                else:
+                    yield pos
+
+    return codec.encode(values())
+
+
+def iter_postings(buffer, codec) -> Iterator[Tuple[int, int, List[int]]]:
+    """
+    Decode a postings list written by encode_postings one posting at a time
+    :param buffer: Bytes-like object
+    :param codec: Codec object
+    :return: Iterator over (document_id, tf, positions) tuples
+    """
+    values = codec.decode(buffer)
+    document_id = 0
+    for first in values:
+        document_id = document_id + first if codec.gaps else first
+        tf = next(values)
+        count = next(values)
+        positions = []
+        pos = 0
+        for _ in range(count):
+            if codec.gaps:
+                pos += next(values)
+            else:
+                pos = next(values)
+            positions.append(pos)
+        yield document_id, tf, positions
+
+
+class CompressedPostingsList:
+    """
+    Read-only postings list kept encoded in memory
+
+    The postings are encoded with encode_postings in blocks of BLOCK_SIZE postings, and the first
+    document ID and byte offset of every block are kept as skip pointers. Postings are decoded one
+    at a time while they are iterated, and a cursor jumping ahead skips whole blocks without
+    decoding them, so the full list is never materialised. A buffer without skip pointers, such
+    as the postings of a term in the binary postings file, is one block.
+    """
+
+    __slots__ = ("buffer", "codec", "_size", "block_docs", "block_offsets")
+
+    def __init__(self, buffer, codec, size: int, block_docs=None, block_offsets=None):
+        """
+        Wrap encoded postings
+        :param buffer: Bytes-like object written by encode_postings, one block after another
+        :param codec: Codec object used for the buffer
+        :param size: Number of postings in the buffer
+        :param block_docs: First document ID of every block, None when the buffer is one block
+        :param block_offsets: Byte offset of every block in the buffer
+        """
+        self.buffer = buffer
+        self.codec = codec
+        self._size = size
+        self.block_docs = block_docs if block_docs is not None else array("I", [0])
+        self.block_offsets = block_offsets if block_offsets is not None else array("I", [0])
+
+    @classmethod
+    def from_postings(
+        cls, postings: Iterable[Tuple[int, int, List[int]]], codec, block_size: int = BLOCK_SIZE
+    ) -> "CompressedPostingsList":
+        """
+        Compress postings
+        :param postings: (document_id, tf, positions) tuples in document ID order
+        :param codec: Codec object
+        :param block_size: Postings per block
+        :return: CompressedPostingsList object
+        """
+        buffer = bytearray()
+        block_docs = array("I")
+        block_offsets = array("I")
+        block = []
+        size = 0
+        for posting in postings:
+            block.append(posting)
+            if len(block) == block_size:
+                block_docs.append(block[0][0])
+                block_offsets.append(len(buffer))
+                buffer += encode_postings(block, codec)
+                size += len(block)
+                block = []
+        if block or not block_docs:
+            block_docs.append(block[0][0] if block else 0)
+            block_offsets.append(len(buffer))
+            buffer += encode_postings(block, codec)
+            size += len(block)
+        return cls(bytes(buffer), codec, size, block_docs, block_offsets)
+
+    @property
+    def size(self):
+        return self._size
+
+    def _block(self, block: int) -> Iterator[Tuple[int, int, List[int]]]:
+        """Decode the postings of a block one at a time"""
+        offsets = self.block_offsets
+        end = offsets[block + 1] if block + 1 < len(offsets) else len(self.buffer)
+        return iter_postings(memoryview(self.buffer)[offsets[block] : end], self.codec)
+
+    def __iter__(self) -> Iterator[Tuple[int, int, List[int]]]:
+        for block in range(len(self.block_offsets)):
+            yield from self._block(block)
+
+    def cursor(self) -> "CompressedCursor":
+        return CompressedCursor(self)
+
+    def _find(self, document_id):
+        """Decode the block that can hold `document_id`, stopping as soon as it is passed"""
+        block = bisect_right(self.block_docs, document_id) - 1
+        if block < 0:
+            return None
+        for posting in self._block(block):
+            if posting[0] == document_id:
+                return posting
+            if posting[0] > document_id:
+                break
+        return None
+
+    def inorder(self):
+        return [(document_id, tf) for document_id, tf, _ in self]
+
+    def inorder_with_positions(self):
+        return list(self)
+
+    def __contains__(self, document_id):
+        return self._find(document_id) is not None
+
+    def __getitem__(self, document_id):
+        posting = self._find(document_id)
+        if posting is None:
+            raise KeyError(f"Document ID {document_id} not found in postings list.")
+        return Node(*posting)
+
+    def grab_positions(self, document_id):
+        return self[document_id].positions
+
+    def nbytes(self) -> int:
+        """
+        Size of the encoded postings and skip pointers
+        :return: Number of bytes
+        """
+        return len(self.buffer) + 4 * (len(self.block_docs) + len(self.block_offsets))
+
+    def __len__(self):
+        return self._size
+
+
+class CompressedCursor:
+    """
+    Cursor over a CompressedPostingsList, with the interface of postings.PostingsCursor. The
+    postings of the current block are decoded one at a time as the cursor moves
+    """
+
+    __slots__ = ("postings", "block", "_decoder", "doc", "tf", "_positions")
+
+    def __init__(self, postings: CompressedPostingsList):
+        self.postings = postings
+        self.doc = None
+        self.tf = 0
+        self._positions = []
+        self._start(0)
+
+    def _start(self, block: int) -> None:
+        """Start decoding at the first posting of a block"""
+        self.block = block
+        self._decoder = self.postings._block(block)
+        self.next()
+
+    def next(self):
+        for self.doc, self.tf, self._positions in self._decoder:
+            return
+        if self.block + 1 < len(self.postings.block_offsets):
+            self._start(self.block + 1)
+        else:
+            self.doc = None
+
+    def advance(self, target: int):
+        """Move to the first document ID >= target, blocks that end before it are skipped"""
+        if self.doc is None or self.doc >= target:
+            return
+        block = bisect_right(self.postings.block_docs, target, self.block + 1) - 1
+        if block > self.block:
+            self._start(block)
+        while self.doc is not None and self.doc < target:
+            self.next()
+
+    def positions(self) -> tuple:
+        """
+        Positions of the current posting
+        :return: (positions buffer, start, end)
+        """
+        return self._positions, 0, len(self._positions)
@@ -0,0 +1,120 @@
+import queue
+import threading
+from contextlib import nullcontext
+from pathlib import Path
+from typing import List, Optional
+
+from document import Document
+
+# where invert.py --debug-dump writes when no path is given
+DEFAULT_PATH = Path("debug/docs_terms_debug.txt")
+
+# write buffer of the dump file
+BUFFER_SIZE = 1 << 20
+
+
+def document_debug(doc: Document, doc_terms: List[str]) -> str:
+    """
+    Entry of a document in debug/docs_terms_debug.txt
+    """
+    return (
+        f"Document ID: {doc.document_id}\n"
+        f"Title: {doc.title}\n"
+        f"Text: {doc.text}\n"
+        f"Terms: {sorted(doc_terms)}\n\n"
+    )
+
+
+class DebugDump:
+    """
+    Writer of the per-document debug dump
+
+    In the background mode the indexing loop only queues references to the document and its terms,
+    and a thread formats the entries and writes them through a large buffer. The queue is bounded
+    so a slow disk holds at most queue_size documents in memory, the loop waits only when it is
+    full. Otherwise entries are formatted by the caller and written through the same buffer.
+    """
+
+    def __init__(self, path: Path, background: bool = True, queue_size: int = 1024):
+        """
+        :param path: Path to the dump file
+        :param background: Format and write entries in a background thread
+        :param queue_size: Number of entries queued before write waits for the thread
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = path.open("w", encoding="utf-8", buffering=BUFFER_SIZE)
+        self.error: Optional[BaseException] = None
+        self.queue = None
+        self.thread = None
+        if background:
+            self.queue = queue.Queue(maxsize=queue_size)
+            self.thread = threading.Thread(target=self._drain, name="debug-dump", daemon=True)
+            self.thread.start()
+
+    def write(self, doc: Document, doc_terms: List[str]) -> None:
+        """
+        Add the entry of a document, doc_terms must not be modified afterwards
+        :param doc: Document object
+        :param doc_terms: Normalized terms of the document
+        :return: None
+        """
+        if self.queue is None:
+            self.file.write(document_debug(doc, doc_terms))
+        else:
+            self.queue.put((doc, doc_terms))
+
+    def write_text(self, text: str) -> None:
+        """
+        Add entries already formatted, such as those of a worker process
+        :param text: Entries from document_debug
+        :return: None
+        """
+        if self.queue is None:
+            self.file.write(text)
+        else:
+            self.queue.put((None, text))
+
+    def _drain(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # keep emptying the queue so writers never wait on a dead thread
+                continue
+            doc, payload = item
+            try:
+                self.file.write(payload if doc is None else document_debug(doc, payload))
+            except Exception as e:
+                self.error = e
+
+    def close(self) -> None:
+        """
+        Wait for the queued entries to be written and close the file
+        :return: None
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_debug_dump(path: Optional[Path], background: bool = True):
+    """
+    Context manager of the debug dump
+    :param path: Path to the dump file, None to skip the dump
+    :param background: Format and write entries in a background thread
+    :return: DebugDump, or a context manager giving None when path is None
+    """
+    if path is None:
+        return nullcontext()
+    return DebugDump(path, background)
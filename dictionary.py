@@ -0,0 +1,365 @@
+from array import array
+from typing import Iterable, Iterator, List, Tuple
+
+from compression import CompressedPostingsList
+from postings import PostingsList
+from storage import FrequencyView, TermsView
+from term import Term
+
+# terms per front-coded block, a lookup decodes at most this many terms after the binary search
+BLOCK_SIZE = 16
+
+
+def _write_varint(buffer: bytearray, value: int) -> None:
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class CompactDictionary:
+    """
+    Sorted terms front-coded into a single blob
+
+    Terms are sorted by their UTF-8 bytes, like the binary dictionary, and a term's ID is its rank.
+    Every block of BLOCK_SIZE terms starts with a full term, the others only store the length of
+    the prefix they share with the previous term and the rest of their bytes. Lookups binary search
+    the first terms of the blocks and decode one block.
+    """
+
+    def __init__(self, terms: Iterable[str], block_size: int = BLOCK_SIZE):
+        """
+        :param terms: Distinct terms, in any order
+        :param block_size: Terms per front-coded block
+        """
+        self.block_size = block_size
+        keys = sorted(term.encode("utf-8") for term in terms)
+        blob = bytearray()
+        self.block_offsets = array("I")
+        previous = b""
+        for i, key in enumerate(keys):
+            if i % block_size == 0:
+                self.block_offsets.append(len(blob))
+                _write_varint(blob, len(key))
+                blob += key
+            else:
+                prefix = 0
+                limit = min(len(key), len(previous))
+                while prefix < limit and key[prefix] == previous[prefix]:
+                    prefix += 1
+                _write_varint(blob, prefix)
+                _write_varint(blob, len(key) - prefix)
+                blob += key[prefix:]
+            previous = key
+        self.blob = bytes(blob)
+        self.size = len(keys)
+
+    def _head(self, block: int) -> bytes:
+        blob = self.blob
+        offset = self.block_offsets[block]
+        length = blob[offset]
+        if length < 0x80:
+            return blob[offset + 1 : offset + 1 + length]
+        length, offset = _read_varint(blob, offset)
+        return blob[offset : offset + length]
+
+    def _block(self, block: int) -> Iterator[bytes]:
+        """
+        Decode the terms of a block
+        :param block: Block number
+        :return: Iterator over the terms' UTF-8 bytes
+        """
+        blob = self.blob
+        length, offset = _read_varint(blob, self.block_offsets[block])
+        key = blob[offset : offset + length]
+        offset += length
+        yield key
+        end = min(self.block_size, self.size - block * self.block_size)
+        for _ in range(1, end):
+            prefix, offset = _read_varint(blob, offset)
+            length, offset = _read_varint(blob, offset)
+            key = key[:prefix] + blob[offset : offset + length]
+            offset += length
+            yield key
+
+    def find(self, term: str) -> int:
+        """
+        Look up the ID of a term
+        :param term: Term to look up
+        :return: Term ID, -1 if not found
+        """
+        if not self.size:
+            return -1
+        key = term.encode("utf-8")
+        head = self._head
+        lo, hi = 0, len(self.block_offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < head(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        block = lo - 1
+        if block < 0:
+            return -1
+        for i, current in enumerate(self._block(block)):
+            if current == key:
+                return block * self.block_size + i
+            if current > key:
+                break
+        return -1
+
+    def term_at(self, term_id: int) -> str:
+        """
+        Term with a given ID
+        :param term_id: Term ID
+        :return: Term string
+        """
+        if not 0 <= term_id < self.size:
+            raise IndexError(f"Term ID {term_id} out of range.")
+        block, i = divmod(term_id, self.block_size)
+        for j, key in enumerate(self._block(block)):
+            if j == i:
+                return key.decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for block in range(len(self.block_offsets)):
+            for key in self._block(block):
+                yield key.decode("utf-8")
+
+    def __contains__(self, term) -> bool:
+        return isinstance(term, str) and self.find(term) != -1
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class CompactIndex:
+    """
+    In-memory index without a Python object per term
+
+    Terms live in a CompactDictionary, document and collection frequencies in arrays indexed by
+    term ID, and the postings of every term in four arrays shared by the whole index: document IDs,
+    term frequencies, and a flat positions buffer with its offsets, where the postings of term t are
+    entries starts[t]:starts[t + 1]. Term objects are only built when a term is looked up, it has
+    the same interface as DiskIndex so its terms() and frequencies() views stand in for terms_dict
+    and the index dict.
+
+    With a codec, the postings are kept encoded instead: the blocks of every term's
+    CompressedPostingsList share one buffer, where the postings of term t are bytes
+    buffer_starts[t]:buffer_starts[t + 1], and their skip pointers share two arrays, where the
+    blocks of term t are entries block_starts[t]:block_starts[t + 1].
+    """
+
+    def __init__(
+        self,
+        postings: Iterable[Tuple[str, int, Iterable[Tuple[int, int, List[int]]]]],
+        codec=None,
+    ):
+        """
+        :param postings: (term, collection frequency, (document_id, tf, positions) tuples in
+                         document ID order) per term, in any order of terms
+        :param codec: Codec object to keep the postings encoded in memory with, None for arrays
+        """
+        entries = {term: (frequency, postings) for term, frequency, postings in postings}
+        self.dictionary = CompactDictionary(entries)
+        self.has_bounds = False
+        self.codec = codec
+        self.dfs = array("I")
+        self.cfs = array("I")
+        self.starts = array("I", [0])
+        self.doc_ids = array("I")
+        self.tfs = array("I")
+        self.offsets = array("I", [0])
+        self.positions = array("I")
+        buffer = bytearray()
+        self.buffer_starts = array("I", [0])
+        self.block_starts = array("I", [0])
+        self.block_docs = array("I")
+        self.block_offsets = array("I")
+        for term in self.dictionary:
+            frequency, term_postings = entries.pop(term)
+            if codec is not None:
+                compressed = CompressedPostingsList.from_postings(term_postings, codec)
+                buffer += compressed.buffer
+                self.buffer_starts.append(len(buffer))
+                self.block_docs.extend(compressed.block_docs)
+                self.block_offsets.extend(compressed.block_offsets)
+                self.block_starts.append(len(self.block_docs))
+                self.dfs.append(len(compressed))
+                self.cfs.append(frequency)
+                continue
+            for document_id, tf, positions in term_postings:
+                self.doc_ids.append(document_id)
+                self.tfs.append(tf)
+                self.positions.extend(positions)
+                self.offsets.append(len(self.positions))
+            self.dfs.append(len(self.doc_ids) - self.starts[-1])
+            self.cfs.append(frequency)
+            self.starts.append(len(self.doc_ids))
+        self.buffer = bytes(buffer)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict[str, dict], codec=None) -> "CompactIndex":
+        """
+        Build from the postings snapshot written by invert.pickle_postings_list
+        :param snapshot: Dictionary of term -> {"freq", "postings"}
+        :param codec: Codec object to keep the postings encoded in memory with, None for arrays
+        :return: CompactIndex
+        """
+        return cls(
+            (
+                (term, payload["freq"], payload["postings"])
+                for term, payload in snapshot.items()
+            ),
+            codec,
+        )
+
+    @classmethod
+    def from_terms(cls, terms_dict, codec=None) -> "CompactIndex":
+        """
+        Build from a mapping of term -> Term object
+        :param terms_dict: Mapping such as invert.terms_dict
+        :param codec: Codec object to keep the postings encoded in memory with, None for arrays
+        :return: CompactIndex
+        """
+
+        def postings(plist: PostingsList) -> Iterator[Tuple[int, int, List[int]]]:
+            # decoded one term at a time while the arrays are filled
+            yield from plist.inorder_with_positions()
+
+        return cls(
+            (
+                (term, term_obj.frequency, postings(term_obj.postings))
+                for term, term_obj in terms_dict.items()
+            ),
+            codec,
+        )
+
+    def find(self, term: str) -> int:
+        """
+        Look up the ID of a term
+        :param term: Term to look up
+        :return: Term ID, -1 if not found
+        """
+        return self.dictionary.find(term)
+
+    def term_at(self, term_id: int) -> str:
+        """
+        Term with a given ID
+        :param term_id: Term ID
+        :return: Term string
+        """
+        return self.dictionary.term_at(term_id)
+
+    def document_frequency(self, term: str) -> int | None:
+        """
+        Document frequency of a term
+        :param term: Term to look up
+        :return: Document frequency if found, None otherwise
+        """
+        i = self.find(term)
+        return None if i == -1 else self.dfs[i]
+
+    def collection_frequency(self, term: str) -> int | None:
+        """
+        Number of occurrences of a term in the collection
+        :param term: Term to look up
+        :return: Collection frequency if found, None otherwise
+        """
+        i = self.find(term)
+        return None if i == -1 else self.cfs[i]
+
+    def postings_list(self, term_id: int) -> PostingsList | CompressedPostingsList:
+        """
+        Copy the postings of a term into a PostingsList, or wrap its encoded postings in a
+        CompressedPostingsList when the index keeps them encoded
+        :param term_id: Term ID
+        :return: PostingsList or CompressedPostingsList of the term
+        """
+        if self.codec is not None:
+            first, last = self.block_starts[term_id], self.block_starts[term_id + 1]
+            return CompressedPostingsList(
+                memoryview(self.buffer)[
+                    self.buffer_starts[term_id] : self.buffer_starts[term_id + 1]
+                ],
+                self.codec,
+                self.dfs[term_id],
+                self.block_docs[first:last],
+                self.block_offsets[first:last],
+            )
+        start, end = self.starts[term_id], self.starts[term_id + 1]
+        base = self.offsets[start]
+        plist = PostingsList()
+        plist.doc_ids = self.doc_ids[start:end]
+        plist.tfs = self.tfs[start:end]
+        plist.offsets = array("I", (offset - base for offset in self.offsets[start : end + 1]))
+        plist.positions = self.positions[base : self.offsets[end]]
+        return plist
+
+    def term(self, term: str) -> Term | None:
+        """
+        Build a Term object for a term
+        :param term: Term to look up
+        :return: Term object if found, None otherwise
+        """
+        i = self.find(term)
+        if i == -1:
+            return None
+        return Term(term, frequency=self.cfs[i], postings=self.postings_list(i))
+
+    def bounds(self) -> None:
+        """
+        Score bounds are only stored in the binary dictionary
+        """
+        return None
+
+    def terms(self) -> TermsView:
+        """
+        Read-only `term: str -> Term` mapping over the index
+        """
+        return TermsView(self)
+
+    def frequencies(self) -> FrequencyView:
+        """
+        Read-only `term: str -> document frequency: int` mapping over the index
+        """
+        return FrequencyView(self)
+
+    def nbytes(self) -> int:
+        """
+        Size of the blobs and arrays, without the fixed size of the Python objects holding them
+        :return: Number of bytes
+        """
+        arrays = (
+            self.dictionary.block_offsets,
+            self.dfs,
+            self.cfs,
+            self.starts,
+            self.doc_ids,
+            self.tfs,
+            self.offsets,
+            self.positions,
+            self.buffer_starts,
+            self.block_starts,
+            self.block_docs,
+            self.block_offsets,
+        )
+        return len(self.dictionary.blob) + len(self.buffer) + sum(
+            len(values) * values.itemsize for values in arrays
+        )
+
+    def __len__(self):
+        return len(self.dictionary)
@@ -1,8 +1,22 @@
+def _pack_lines(lines):
+    # None for no lines, so [] and [""] stay apart
+    return None if not lines else "\n".join(lines)
+
+
+def _unpack_lines(packed):
+    return [] if packed is None else packed.split("\n")
+
+
 class Document:
     """
     Class representing a document with metadata
+
+    Slotted, and the line lists of the authors, .N and .X fields are stored as one string each,
+    they are split back into lists when read.
     """
 
+    __slots__ = ("document_id", "title", "text", "publication_date", "_authors", "_n", "_x")
+
     def __init__(self, document_id, title, text, publication_date, authors, n, x):
         """
         Initialize a Document object
@@ -15,6 +29,57 @@ class Document:
         self.n = n
         self.x = x
 
+    @property
+    def authors(self):
+        return _unpack_lines(self._authors)
+
+    @authors.setter
+    def authors(self, authors):
+        self._authors = _pack_lines(authors)
+
+    @property
+    def n(self):
+        return _unpack_lines(self._n)
+
+    @n.setter
+    def n(self, n):
+        self._n = _pack_lines(n)
+
+    @property
+    def x(self):
+        return _unpack_lines(self._x)
+
+    @x.setter
+    def x(self, x):
+        self._x = _pack_lines(x)
+
+    def __getstate__(self):
+        return (
+            self.document_id,
+            self.title,
+            self.text,
+            self.publication_date,
+            self._authors,
+            self._n,
+            self._x,
+        )
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # pickled before Document was slotted
+            for name, value in state.items():
+                setattr(self, name, value)
+            return
+        (
+            self.document_id,
+            self.title,
+            self.text,
+            self.publication_date,
+            self._authors,
+            self._n,
+            self._x,
+        ) = state
+
     def word_count(self):
         """
         Get the word count of the document text
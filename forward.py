@@ -0,0 +1,271 @@
+import mmap
+import os
+import shutil
+import struct
+import sys
+from array import array
+from contextlib import nullcontext
+from itertools import chain
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+FORWARD_MAGIC = b"CPSFWD01"
+
+# magic, number of documents, number of terms, offset of the vocabulary, offset of the table
+FORWARD_HEADER = struct.Struct("<8sIIQQ")
+
+# document ID, number of tokens, offset of the document's arrays
+TABLE_ENTRY = struct.Struct("<IIQ")
+
+# term IDs of positions without an indexed term
+EMPTY = 0xFFFFFFFF  # punctuation and tokens without letters or digits
+STOPWORD = 0xFFFFFFFE
+
+# arrays are stored little-endian
+NATIVE_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def _to_bytes(values: array) -> bytes:
+    if not NATIVE_LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(data) -> array:
+    values = array("I")
+    values.frombytes(data)
+    if not NATIVE_LITTLE_ENDIAN:
+        values.byteswap()
+    return values
+
+
+class ForwardWriter:
+    """
+    Streaming writer of the forward index: for every document its token sequence as term IDs,
+    and the character span of each token in the document's text. The file is the documents'
+    arrays followed by the vocabulary and the table of documents, so documents are written as
+    they are indexed and can be appended later without indexing them again. The vocabulary, the
+    table and the header are written when the writer is closed. The file is written next to the
+    old one and replaces it on close, since a running test.py or server.py may have it memory
+    mapped.
+    """
+
+    def __init__(self, path: Path, append: bool = False):
+        """
+        :param path: Path to the forward index file
+        :param append: Add the documents to an existing file, a document already in it is replaced
+        """
+        self.vocabulary: List[str] = []
+        self.table: dict[int, Tuple[int, int]] = {}
+        self.offset = FORWARD_HEADER.size
+        self.path = path
+        self.tmp = path.with_name(f"{path.name}.tmp")
+        if append and path.is_file():
+            with ForwardIndex(path) as existing:
+                self.vocabulary = list(existing.vocabulary)
+                self.table = dict(existing.table)
+                self.offset = existing.vocabulary_offset
+            # the documents' arrays are kept, the vocabulary and the table are written again
+            shutil.copyfile(path, self.tmp)
+            self.file = self.tmp.open("r+b")
+            self.file.seek(self.offset)
+            self.file.truncate()
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = self.tmp.open("wb")
+            self.file.write(bytes(FORWARD_HEADER.size))
+
+        # EMPTY and STOPWORD map to themselves
+        self.term_ids = {term: i for i, term in enumerate(self.vocabulary)}
+        self.term_ids[EMPTY] = EMPTY
+        self.term_ids[STOPWORD] = STOPWORD
+        self.count = 0
+
+    def add(self, document_id: int, terms: List[str | int], spans: List[Tuple[int, int]]) -> None:
+        """
+        Write the arrays of a document
+        :param document_id: Document ID
+        :param terms: Processed term per position, or EMPTY / STOPWORD for positions without an
+                      indexed term
+        :param spans: (start, end) character span per position
+        :return: None
+        """
+        term_ids = self.term_ids
+        vocabulary = self.vocabulary
+        for term in terms:
+            if term not in term_ids:
+                term_ids[term] = len(vocabulary)
+                vocabulary.append(term)
+        ids = array("I", map(term_ids.__getitem__, terms))
+        flat = array("I", chain.from_iterable(spans))
+        self.file.write(_to_bytes(ids))
+        self.file.write(_to_bytes(flat))
+        self.table[document_id] = (len(ids), self.offset)
+        self.offset += 12 * len(ids)
+        self.count += 1
+
+    def close(self) -> None:
+        """
+        Write the vocabulary, the table of documents and the header, close the file and replace
+        the old one with it
+        :return: None
+        """
+        f = self.file
+        with f:
+            blob = "\n".join(self.vocabulary).encode("utf-8")
+            vocabulary_offset = self.offset
+            f.write(struct.pack("<I", len(blob)))
+            f.write(blob)
+            table_offset = vocabulary_offset + 4 + len(blob)
+            for document_id in sorted(self.table):
+                f.write(TABLE_ENTRY.pack(document_id, *self.table[document_id]))
+            f.seek(0)
+            f.write(
+                FORWARD_HEADER.pack(
+                    FORWARD_MAGIC,
+                    len(self.table),
+                    len(self.vocabulary),
+                    vocabulary_offset,
+                    table_offset,
+                )
+            )
+        os.replace(self.tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            self.tmp.unlink(missing_ok=True)
+
+
+def open_forward_writer(path: Optional[Path], append: bool = False):
+    """
+    Context manager of the forward index writer
+    :param path: Path to the forward index file, None to skip the forward index
+    :param append: Add the documents to an existing file
+    :return: ForwardWriter, or a context manager giving None when path is None
+    """
+    if path is None:
+        return nullcontext()
+    return ForwardWriter(path, append)
+
+
+def write_forward_index(
+    path: Path,
+    documents: Iterable[Tuple[int, List[str | int], List[Tuple[int, int]]]],
+    append: bool = False,
+) -> int:
+    """
+    Write the forward index of documents with a ForwardWriter
+    :param path: Path to the forward index file
+    :param documents: (document ID, processed terms, (start, end) spans) per document, a term is
+                      a string or EMPTY / STOPWORD for positions without an indexed term
+    :param append: Add the documents to an existing file, a document already in it is replaced
+    :return: Number of documents written
+    """
+    with ForwardWriter(path, append) as writer:
+        for document_id, terms, spans in documents:
+            writer.add(document_id, terms, spans)
+    return writer.count
+
+
+class ForwardIndex:
+    """
+    Memory mapped forward index written by write_forward_index
+
+    The vocabulary and the table of documents are read when the file is opened, the arrays of a
+    document are only read when it is looked up, so a lookup costs the length of the document.
+    """
+
+    def __init__(self, path: Path):
+        self._file = path.open("rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, documents, terms, self.vocabulary_offset, table_offset = (
+            FORWARD_HEADER.unpack_from(self._data, 0)
+        )
+        if magic != FORWARD_MAGIC:
+            raise ValueError(f"{path} is not a forward index file.")
+
+        (size,) = struct.unpack_from("<I", self._data, self.vocabulary_offset)
+        start = self.vocabulary_offset + 4
+        blob = self._data[start : start + size].decode("utf-8")
+        self.vocabulary = blob.split("\n") if terms else []
+
+        self.table: dict[int, Tuple[int, int]] = {}
+        for document_id, length, offset in TABLE_ENTRY.iter_unpack(
+            self._data[table_offset : table_offset + documents * TABLE_ENTRY.size]
+        ):
+            self.table[document_id] = (length, offset)
+
+    def token_ids(self, document_id: int) -> array:
+        """
+        Term IDs of a document's positions, EMPTY or STOPWORD where no term is indexed
+        :param document_id: Document ID
+        :return: Array of term IDs, one per position
+        """
+        length, offset = self.table[document_id]
+        return _from_bytes(self._data[offset : offset + 4 * length])
+
+    def spans(self, document_id: int) -> array:
+        """
+        Character spans of a document's tokens in its text
+        :param document_id: Document ID
+        :return: Flat array of start, end pairs, one pair per position
+        """
+        length, offset = self.table[document_id]
+        offset += 4 * length
+        return _from_bytes(self._data[offset : offset + 8 * length])
+
+    def terms(self, document_id: int) -> List[str]:
+        """
+        Distinct terms of a document
+        :param document_id: Document ID
+        :return: Sorted terms
+        """
+        vocabulary = self.vocabulary
+        return sorted(
+            {vocabulary[i] for i in set(self.token_ids(document_id)) if i < STOPWORD}
+        )
+
+    def window(self, document_id: int, position: int, n: int) -> Tuple[int, int, int, int]:
+        """
+        Span of the n words before and after a position, punctuation is not counted
+        :param document_id: Document ID
+        :param position: Position of the term in the document
+        :param n: Number of words on each side
+        :return: (first position, last position, start character, end character)
+        """
+        ids = self.token_ids(document_id)
+        spans = self.spans(document_id)
+        first = position
+        words = 0
+        while first > 0 and words < n:
+            first -= 1
+            words += ids[first] != EMPTY
+        last = position
+        words = 0
+        while last + 1 < len(ids) and words < n:
+            last += 1
+            words += ids[last] != EMPTY
+        return first, last, spans[2 * first], spans[2 * last + 1]
+
+    def close(self) -> None:
+        self._data.close()
+        self._file.close()
+
+    def __contains__(self, document_id) -> bool:
+        return document_id in self.table
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,19 +1,35 @@
 import argparse
+import functools
 import gzip
+import heapq
+import os
 import pickle
-import ssl
+import re
 import sys
+import tempfile
 import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, islice
 from pathlib import Path
-from typing import List, Optional
-
-import nltk
-
-nltk.download("punkt")
-from nltk.tokenize import word_tokenize
+from typing import Iterable, Iterator, List, Optional, Tuple
 
+from compression import CODECS
+from debugdump import DEFAULT_PATH, document_debug, open_debug_dump
 from document import Document
-from stemming import PorterStemmer
+from forward import EMPTY, STOPWORD, open_forward_writer
+from postings import PostingsList
+from segments import SegmentedIndex, add_segment, clear_updates, compact, delete_documents
+from stemcache import DEFAULT_SIZE, stem_cache
+from storage import (
+    average_length,
+    document_stats,
+    is_binary_index,
+    score_bounds,
+    term_bounds,
+    write_binary_index,
+    write_document_stats,
+)
 from term import Term
 
 global index
@@ -25,12 +41,40 @@ terms_dict: dict[str, Term] = {}
 global document_dict
 document_dict: dict[int, Document] = {}
 
+# IDs of the documents written by spool_documents, in file order
+global document_ids
+document_ids: List[int] = []
 
-def read_documents(file_path: Path) -> List[Document]:
+TOKENIZERS = ("nltk", "fast")
+
+# tokenizer of grab_terms and query analysis, changed with set_tokenizer
+global tokenizer
+tokenizer = "nltk"
+
+# split off as tokens of their own by the fallback tokenizer and the fast tokenizer
+PUNCTUATION = ".,!?;:'\"()-[]{}/"
+
+# ascii text: pad punctuation with spaces so str.split separates it, then drop everything but
+# letters and digits from each token, punctuation tokens become empty
+PUNCTUATION_TABLE = str.maketrans({char: f" {char} " for char in PUNCTUATION})
+NON_ALNUM_TABLE = str.maketrans({chr(i): None for i in range(128) if not chr(i).isalnum()})
+
+# any other text: one punctuation character, or a run of anything but whitespace and punctuation
+FAST_TOKEN_PATTERN = re.compile(r"[.,!?;:'\"()\[\]{}/-]|[^\s.,!?;:'\"()\[\]{}/-]+")
+PUNCTUATION_SET = frozenset(PUNCTUATION)
+
+# rough cost of the in-memory block of spimi_build, in bytes: a new term pays for its Term,
+# PostingsList arrays and dictionary slot, an occurrence for its position and a share of a posting
+TERM_BYTES = 600
+OCCURRENCE_BYTES = 16
+
+
+def iter_documents(file_path: Path) -> Iterator[Document]:
     """
-    Read documents from a file in the specified format
+    Parse documents from a file in the specified format one at a time, only the document being
+    parsed is held in memory
     :param file_path: Path to the input file
-    :return: List of Document objects
+    :return: Iterator over Document objects in file order
     """
 
     if not file_path.exists():
@@ -50,14 +94,12 @@ def read_documents(file_path: Path) -> List[Document]:
     n_parts: List[str] = []
     x_parts: List[str] = []
 
-    documents: List[Document] = []
-
-    def flush_current():
-        global document_dict
+    found = False
 
+    def flush_current() -> Optional[Document]:
         nonlocal document_id, title_parts, text_parts, date_parts, authors, n_parts, x_parts
         if document_id is None:
-            return
+            return None
         doc = Document(
             document_id,
             " ".join(title_parts).strip(),
@@ -67,9 +109,6 @@ def read_documents(file_path: Path) -> List[Document]:
             n_parts[:],
             x_parts[:],
         )
-        documents.append(doc)
-
-        document_dict[document_id] = doc
 
         # reset
         document_id = None
@@ -79,6 +118,7 @@ def read_documents(file_path: Path) -> List[Document]:
         authors.clear()
         n_parts.clear()
         x_parts.clear()
+        return doc
 
     with open(file_path, "r", encoding="utf-8") as file:
         for raw in file:
@@ -100,7 +140,10 @@ def read_documents(file_path: Path) -> List[Document]:
                 continue
 
             if line.startswith(".I"):
-                flush_current()
+                doc = flush_current()
+                if doc is not None:
+                    found = True
+                    yield doc
                 parts = line.split()
                 if len(parts) < 2 or not parts[1].isdigit():
                     print(f"[ERROR]: Invalid Document ID line: {line}", file=sys.stderr)
@@ -129,15 +172,96 @@ def read_documents(file_path: Path) -> List[Document]:
                 pass
 
     if document_id is not None:
-        flush_current()
-    else:
-        if not documents:
-            print(f"[ERROR]: No documents found in {file_path}", file=sys.stderr)
-            sys.exit(1)
+        yield flush_current()
+    elif not found:
+        print(f"[ERROR]: No documents found in {file_path}", file=sys.stderr)
+        sys.exit(1)
+
+
+def read_documents(file_path: Path) -> List[Document]:
+    """
+    Read documents from a file in the specified format
+    :param file_path: Path to the input file
+    :return: List of Document objects
+    """
+    global document_dict
 
+    documents = list(iter_documents(file_path))
+    for doc in documents:
+        document_dict[doc.document_id] = doc
     return documents
 
 
+def spool_documents(
+    documents: Iterable[Document], path: Path, batch_size: int = 256, mode: str = "wb"
+) -> Iterator[Document]:
+    """
+    Pass documents through while writing them to the documents file, in pickled batches of
+    {document ID: Document} so the collection is never held in memory at once. The IDs are
+    recorded in document_ids
+    :param documents: Documents to write
+    :param path: Path to the gzip file
+    :param batch_size: Number of documents per pickled batch
+    :param mode: "wb" to start a new file, "ab" to add the documents to an existing one
+    :return: Iterator over the same documents
+    """
+    global document_ids
+    document_ids = []
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, mode) as f:
+        batch = {}
+        for doc in documents:
+            document_ids.append(doc.document_id)
+            batch[doc.document_id] = doc
+            if len(batch) >= batch_size:
+                pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+                batch = {}
+            yield doc
+        if batch:
+            pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def iter_document_batches(path: Path) -> Iterator[dict[int, Document]]:
+    """
+    Read the {document ID: Document} batches written by spool_documents
+    :param path: Path to the gzip file
+    :return: Iterator over the batches in file order
+    """
+    with gzip.open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def compact_documents(path: Path, live: set[int]) -> int:
+    """
+    Rewrite the documents file without deleted documents. A document deleted and appended again
+    is in the file twice, the last copy is kept
+    :param path: Path to the gzip file
+    :param live: IDs of the documents in the index
+    :return: Number of documents kept
+    """
+    copies = Counter(document_id for batch in iter_document_batches(path) for document_id in batch)
+    seen = Counter()
+    kept = 0
+    tmp = path.with_name(f"{path.name}.tmp")
+    with gzip.open(tmp, "wb") as f:
+        for batch in iter_document_batches(path):
+            current = {}
+            for document_id, doc in batch.items():
+                seen[document_id] += 1
+                if document_id in live and seen[document_id] == copies[document_id]:
+                    current[document_id] = doc
+            if current:
+                pickle.dump(current, f, protocol=pickle.HIGHEST_PROTOCOL)
+                kept += len(current)
+    os.replace(tmp, path)
+    return kept
+
+
 def write_documents(file_path: Path, documents: List[Document]) -> None:
     """
     Write documents to a file
@@ -235,16 +359,72 @@ def pickle_postings_list(path) -> None:
         pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 
-def pickle_documents(path: Path) -> None:
+def write_binary_postings(dict_path: Path, postings_path: Path, codec: str) -> None:
     """
-    Pickle the documents dictionary
-    :param path: Path to the gzip file
+    Write the dictionary and postings list in the binary format read by test.py
+    :param dict_path: Path to the dictionary file
+    :param postings_path: Path to the postings file
+    :param codec: Compression codec for the postings file
     :return: None
     """
-    global document_dict
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with gzip.open(path, "wb") as f:
-        pickle.dump(document_dict, f, protocol=pickle.HIGHEST_PROTOCOL)
+    global terms_dict
+
+    entries = (
+        (
+            term,
+            terms_dict[term].postings.size,
+            terms_dict[term].frequency,
+            terms_dict[term].postings.inorder_with_positions(),
+        )
+        for term in sorted(terms_dict.keys())
+    )
+    lengths, norms = collection_stats()
+    write_binary_index(
+        dict_path, postings_path, entries, score_bounds(terms_dict, lengths, norms), codec
+    )
+
+
+def collection_stats() -> Tuple[dict[int, int], dict[int, float]]:
+    """
+    Length and norm of every document, documents without indexed terms have length 0
+    :return: (lengths, norms)
+    """
+    global terms_dict, document_ids
+
+    lengths, norms = document_stats(terms_dict)
+    for document_id in document_ids:
+        lengths.setdefault(document_id, 0)
+    return lengths, norms
+
+
+def write_doc_stats(path: Path) -> None:
+    """
+    Write the length and norm of every document
+    :param path: Path to the output file
+    :return: None
+    """
+    write_document_stats(path, *collection_stats())
+
+
+@functools.lru_cache(maxsize=None)
+def load_word_tokenize():
+    """
+    Import nltk's word_tokenize on first use, so nltk is only loaded when text is tokenized with
+    --tokenizer nltk. Nothing is downloaded, install the punkt model with `python -m nltk.downloader punkt`
+    :return: word_tokenize, None if nltk or its punkt model is not installed
+    """
+    try:
+        from nltk.tokenize import word_tokenize
+
+        word_tokenize("punkt")
+    except (ImportError, LookupError) as e:
+        print(
+            f"[WARNING]: nltk word_tokenize is not available ({type(e).__name__}), "
+            "falling back to split_tokens",
+            file=sys.stderr,
+        )
+        return None
+    return word_tokenize
 
 
 def tokenize(text: str) -> List[str]:
@@ -252,32 +432,45 @@ def tokenize(text: str) -> List[str]:
     :param text: Input text
     :return: List of tokens
     """
+    word_tokenize = load_word_tokenize()
+    if word_tokenize is None:
+        return split_tokens(text)
     try:
         return word_tokenize(text)
     except Exception as e:
-        punctuation = ".,!?;:'\"()-[]{}/"
-
-        result = []
-        current_word = ""
-
-        for char in text:
-            if char in punctuation:
-                if current_word:
-                    result.append(current_word)
-                    current_word = ""
-                result.append(char)
-            elif char.isspace():
-                if current_word:
-                    result.append(current_word)
-                    current_word = ""
-            else:
-                current_word += char
+        return split_tokens(text)
+
 
-        # Add last word if exists
-        if current_word:
-            result.append(current_word)
+def split_tokens(text: str) -> List[str]:
+    """
+    Fallback of tokenize when the nltk tokenizer is not available: split on whitespace, and
+    split off every punctuation character as a token of its own
+    :param text: Input text
+    :return: List of tokens
+    """
+    punctuation = PUNCTUATION
+
+    result = []
+    current_word = ""
+
+    for char in text:
+        if char in punctuation:
+            if current_word:
+                result.append(current_word)
+                current_word = ""
+            result.append(char)
+        elif char.isspace():
+            if current_word:
+                result.append(current_word)
+                current_word = ""
+        else:
+            current_word += char
+
+    # Add last word if exists
+    if current_word:
+        result.append(current_word)
 
-        return result
+    return result
 
 
 def normalize(text: str) -> str:
@@ -300,6 +493,78 @@ def normalize(text: str) -> str:
     return text.strip().lower()
 
 
+def fast_terms(text: str) -> List[str]:
+    """
+    Tokenize, strip punctuation and lowercase in one pass. Gives the same terms as normalize over
+    split_tokens, including the empty terms that keep punctuation in the positions
+    :param text: Input text
+    :return: Normalized terms
+    """
+    if text.isascii():
+        tokens = text.lower().translate(PUNCTUATION_TABLE).split()
+        return [
+            token if token.isalnum() else token.translate(NON_ALNUM_TABLE) for token in tokens
+        ]
+
+    terms = []
+    for token in FAST_TOKEN_PATTERN.findall(text):
+        if token.isalnum():
+            terms.append(token.lower())
+        elif token in PUNCTUATION_SET:
+            terms.append("")
+        else:
+            # filtered before lowercasing, like normalize
+            terms.append("".join(char for char in token if char.isalnum()).lower())
+    return terms
+
+
+def set_tokenizer(name: str) -> None:
+    """
+    Select the tokenizer of text_terms
+    :param name: "nltk" or "fast"
+    :return: None
+    """
+    global tokenizer
+    if name not in TOKENIZERS:
+        raise ValueError(f"Unknown tokenizer '{name}', expected one of {TOKENIZERS}.")
+    tokenizer = name
+
+
+def text_terms(text: str) -> List[str]:
+    """
+    Normalized terms of a text with the selected tokenizer, one per position, empty for tokens
+    without letters or digits
+    :param text: Input text
+    :return: Normalized terms
+    """
+    # without punkt the nltk tokenizer falls back to split_tokens, which fast_terms reproduces
+    if tokenizer == "fast" or load_word_tokenize() is None:
+        return fast_terms(text)
+    return [normalize(token) for token in tokenize(text)]
+
+
+def term_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    Character spans of the tokens of text_terms in the text
+    :param text: Input text
+    :return: (start, end) of each token
+    """
+    if tokenizer == "fast" or load_word_tokenize() is None:
+        return [match.span() for match in FAST_TOKEN_PATTERN.finditer(text)]
+
+    # word_tokenize rewrites some tokens such as quotes, those get an empty span where they are
+    spans = []
+    end = 0
+    for token in tokenize(text):
+        start = text.find(token, end)
+        if start == -1:
+            spans.append((end, end))
+        else:
+            end = start + len(token)
+            spans.append((start, end))
+    return spans
+
+
 def grab_terms(doc: Document) -> dict[str, List[str]]:
     """
     Grab terms from a specific document
@@ -307,80 +572,508 @@ def grab_terms(doc: Document) -> dict[str, List[str]]:
     :return: List of terms
     """
     # grab terms from a specific document
-    terms = []
-    for term in tokenize(doc.text):
-        terms.append(normalize(term))
+    terms = text_terms(doc.text)
     #   for term in tokenize(doc.title):
     #       terms.append(normalize(term))
     return terms
 
 
+def read_stopword_set(stopwords: bool, stopwords_file: Path) -> set[str]:
+    """
+    Read the normalized stopwords if stopword removal is enabled and the file exists
+    :param stopwords: Whether to remove stopwords
+    :param stopwords_file: Path to stopwords file
+    :return: Set of stopwords, empty if disabled
+    """
+    stopword_set = set()
+    if stopwords and stopwords_file.exists():
+        with stopwords_file.open("r", encoding="utf-8") as f:
+            for line in f:
+                stopword_set.add(normalize(line.strip()))
+    return stopword_set
+
+
+def index_document(
+    doc: Document,
+    doc_terms: List[str],
+    stopwords: bool,
+    stopword_set: set[str],
+    stemming: bool,
+    terms: dict[str, Term],
+) -> List[str | int]:
+    """
+    Add the occurrences of a document's terms to a term -> Term dictionary
+    :param doc: Document object
+    :param doc_terms: Normalized terms of the document, from grab_terms
+    :param stopwords: Whether to remove stopwords
+    :param stopword_set: Stopwords to remove
+    :param stemming: Whether to apply Porter stemming
+    :param terms: Dictionary to add the occurrences to
+    :return: Processed term of every position, EMPTY or STOPWORD where none is indexed, the
+             document's entry in the forward index
+    """
+    stem = stem_cache.stem
+    position_pointer = 0
+    sequence = []
+
+    # count terms in global index
+    for term in doc_terms:
+        # Skip empty terms
+        if not term:
+            sequence.append(EMPTY)
+            position_pointer += 1
+            continue
+
+        # Skip stopwords but still increment position
+        if stopwords and term in stopword_set:
+            sequence.append(STOPWORD)
+            position_pointer += 1
+            continue
+
+        # Apply stemming if enabled
+        processed_term = term
+        if stemming:
+            processed_term = stem(term)
+
+        # Get or create term object
+        term_obj = terms.get(processed_term)
+        if term_obj is None:
+            term_obj = Term(processed_term)
+            terms[processed_term] = term_obj
+
+        # Add occurrence with current position
+        term_obj.add_occurrence(doc.document_id, position_pointer)
+        sequence.append(processed_term)
+
+        position_pointer += 1
+
+    return sequence
+
+
+def index_shard(
+    docs: List[Document],
+    stopwords: bool,
+    stopword_set: set[str],
+    stemming: bool,
+    debug_dump: bool = False,
+    forward: bool = False,
+) -> Tuple[dict[str, Tuple[int, list]], str, dict, list, list]:
+    """
+    Build the partial index of a chunk of documents, run in a worker process
+    :param docs: Documents in document ID order
+    :param stopwords: Whether to remove stopwords
+    :param stopword_set: Stopwords to remove
+    :param stemming: Whether to apply Porter stemming
+    :param debug_dump: Whether to format the debug dump entries of the documents
+    :param forward: Whether to return the forward index entries of the documents
+    :return: (term -> (frequency, postings) in order of first occurrence, debug text,
+              stem cache stats, stem cache table, (document ID, terms, spans) per document)
+    """
+    stem_cache.hits = stem_cache.misses = 0
+    terms = {}
+    debug = []
+    entries = []
+    for doc in docs:
+        doc_terms = grab_terms(doc)
+        if debug_dump:
+            debug.append(document_debug(doc, doc_terms))
+        sequence = index_document(doc, doc_terms, stopwords, stopword_set, stemming, terms)
+        if forward:
+            entries.append((doc.document_id, sequence, term_spans(doc.text)))
+
+    partial = {
+        term: (term_obj.frequency, term_obj.postings.inorder_with_positions())
+        for term, term_obj in terms.items()
+    }
+    return partial, "".join(debug), stem_cache.stats(), list(stem_cache.table.items()), entries
+
+
+def merge_shards(shards: List[dict[str, Tuple[int, list]]]) -> dict[str, Term]:
+    """
+    K-way merge of partial indexes into Term objects, postings stay in document ID order and terms
+    are inserted in order of first occurrence, the same as a serial build
+    :param shards: Partial indexes from index_shard, in document ID order
+    :return: Dictionary of term -> Term
+    """
+    order = {}
+    for shard in shards:
+        for term in shard:
+            order.setdefault(term, None)
+
+    merged = {}
+    for term in order:
+        parts = [shard[term] for shard in shards if term in shard]
+        if len(parts) == 1:
+            frequency, postings = parts[0]
+        else:
+            frequency = sum(part[0] for part in parts)
+            postings = heapq.merge(*(part[1] for part in parts), key=lambda posting: posting[0])
+        merged[term] = Term(term, frequency, PostingsList.from_sorted(postings))
+    return merged
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    """
+    Split an iterable into lists of `size` items, the last one may be shorter
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
 def grab_terms_from_all_documents(
-    Documents: List[Document], stopwords: bool, stopwords_file: Path, stemming: bool
+    Documents: Iterable[Document],
+    stopwords: bool,
+    stopwords_file: Path,
+    stemming: bool,
+    workers: int = 1,
+    batch_size: int = 256,
+    debug_path: Optional[Path] = None,
+    forward_path: Optional[Path] = None,
 ) -> None | List[str]:
     """
-    Grab terms from all documents
-    :param Documents: List of Document objects
+    Grab terms from all documents, documents are consumed one at a time so they can be streamed.
+    The forward index is written in the same pass
+    :param Documents: Document objects in document ID order
     :param stopwords: Whether to remove stopwords
     :param stopwords_file: Path to stopwords file
     :param stemming: Whether to apply Porter stemming
+    :param workers: Number of processes, batches of documents are indexed in parallel
+    :param batch_size: Number of documents per batch sent to a worker
+    :param debug_path: Path of the debug dump of every document's terms, None for no dump
+    :param forward_path: Path of the forward index, None for no forward index
     :return: List of unique terms
     """
     global terms_dict
     terms_dict = {}
 
     # check if stopwords removal is enabled and if file exists
-    stopword_set = set()
-    if stopwords and stopwords_file.exists():
-        with stopwords_file.open("r", encoding="utf-8") as f:
-            for line in f:
-                stopword_set.add(normalize(line.strip()))
-
-    debug_path = Path("debug/docs_terms_debug.txt")
-    debug_path.parent.mkdir(parents=True, exist_ok=True)
-
-    with debug_path.open("w", encoding="utf-8") as f:
+    stopword_set = read_stopword_set(stopwords, stopwords_file)
+
+    if workers > 1:
+        partials = []
+
+        def collect(result) -> None:
+            partial, debug, stats, table, entries = result
+            if dump is not None:
+                dump.write_text(debug)
+            for entry in entries:
+                forward.add(*entry)
+            stem_cache.hits += stats["hits"]
+            stem_cache.misses += stats["misses"]
+            stem_cache.table.update(table)
+            stem_cache.resize(stem_cache.maxsize)
+            partials.append(partial)
+
+        with open_debug_dump(debug_path) as dump, open_forward_writer(
+            forward_path
+        ) as forward, ProcessPoolExecutor(
+            max_workers=workers, initializer=set_tokenizer, initargs=(tokenizer,)
+        ) as executor:
+            # a couple of batches per worker in flight, results are collected in document order
+            pending = deque()
+            for batch in batched(Documents, batch_size):
+                pending.append(
+                    executor.submit(
+                        index_shard,
+                        batch,
+                        stopwords,
+                        stopword_set,
+                        stemming,
+                        dump is not None,
+                        forward is not None,
+                    )
+                )
+                if len(pending) >= 2 * workers:
+                    collect(pending.popleft().result())
+            while pending:
+                collect(pending.popleft().result())
+
+        terms_dict = merge_shards(partials)
+        return list(terms_dict.keys())
+
+    with open_debug_dump(debug_path) as dump, open_forward_writer(forward_path) as forward:
         for doc in Documents:
             doc_terms = grab_terms(doc)
+            if dump is not None:
+                dump.write(doc, doc_terms)
+            sequence = index_document(doc, doc_terms, stopwords, stopword_set, stemming, terms_dict)
+            if forward is not None:
+                forward.add(doc.document_id, sequence, term_spans(doc.text))
+
+    return list(terms_dict.keys())
 
-            f.write(
-                f"Document ID: {doc.document_id}\n"
-                f"Title: {doc.title}\n"
-                f"Text: {doc.text}\n"
-                f"Terms: {sorted(doc_terms)}\n\n"
+
+def write_run(path: Path, terms: dict[str, Term]) -> None:
+    """
+    Write an in-memory block as a run file: a stream of pickled (term, frequency, postings)
+    records in sorted term order
+    :param path: Path to the run file
+    :param terms: Dictionary of term -> Term of the block
+    :return: None
+    """
+    with path.open("wb") as f:
+        for term in sorted(terms):
+            term_obj = terms[term]
+            pickle.dump(
+                (term, term_obj.frequency, term_obj.postings.inorder_with_positions()),
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
             )
 
-            position_pointer = 0
 
-            # count terms in global index
-            for term in doc_terms:
-                # Skip empty terms
-                if not term:
-                    position_pointer += 1
-                    continue
+def read_run(path: Path, run: int) -> Iterator[Tuple[str, int, int, list]]:
+    """
+    Read the records of a run file written by write_run
+    :param path: Path to the run file
+    :param run: Number of the run, runs of earlier documents have lower numbers
+    :return: Iterator of (term, run, frequency, postings)
+    """
+    with path.open("rb") as f:
+        while True:
+            try:
+                term, frequency, postings = pickle.load(f)
+            except EOFError:
+                return
+            yield term, run, frequency, postings
 
-                # Skip stopwords but still increment position
-                if stopwords and term in stopword_set:
-                    position_pointer += 1
-                    continue
 
-                # Apply stemming if enabled
-                processed_term = term
-                if stemming:
-                    processed_term = PorterStemmer().stem(term, 0, len(term) - 1)
+def merge_runs(paths: List[Path]) -> Iterator[Tuple[str, int, list]]:
+    """
+    Heap-based multi-way merge of run files, the postings of a term are concatenated in run order,
+    which is document ID order since every document is in a single run
+    :param paths: Run files in the order they were written
+    :return: Iterator of (term, frequency, postings) in sorted term order
+    """
+    records = heapq.merge(*(read_run(path, run) for run, path in enumerate(paths)))
+    for term, group in groupby(records, key=lambda record: record[0]):
+        frequency = 0
+        postings = []
+        for _, _, run_frequency, run_postings in group:
+            frequency += run_frequency
+            postings.extend(run_postings)
+        yield term, frequency, postings
+
+
+def spimi_build(
+    Documents: Iterable[Document],
+    stopwords: bool,
+    stopwords_file: Path,
+    stemming: bool,
+    memory_budget: int,
+    output_dir: Path,
+    codec: str = "vbyte",
+    debug_path: Optional[Path] = None,
+    forward_path: Optional[Path] = None,
+) -> int:
+    """
+    Single-pass in-memory indexing: documents are indexed into a block until its estimated size
+    reaches the memory budget, then the block is sorted and written as a run file. Runs are merged
+    straight into index.txt, postings.txt, dictionary.bin, postings.bin and doclengths.bin, which
+    are the same as the files of the in-memory build
+    :param Documents: Document objects in document ID order
+    :param stopwords: Whether to remove stopwords
+    :param stopwords_file: Path to stopwords file
+    :param stemming: Whether to apply Porter stemming
+    :param memory_budget: Size of the in-memory block in bytes
+    :param output_dir: Directory the index files are written to
+    :param codec: Compression codec for the postings file
+    :param debug_path: Path of the debug dump of every document's terms, None for no dump
+    :param forward_path: Path of the forward index, written in the same pass, None for none
+    :return: Number of terms
+    """
+    global document_ids
+
+    stopword_set = read_stopword_set(stopwords, stopwords_file)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=output_dir, prefix="runs-") as tmp:
+        tmp = Path(tmp)
+        runs: List[Path] = []
+        # terms in order of first occurrence, the order of postings.txt
+        first_seen: dict[str, int] = {}
+        lengths: dict[int, int] = {}
+        norms: dict[int, float] = {}
+
+        def flush(block: dict[str, Term]) -> None:
+            # a document never spans two blocks, so its stats are complete within one
+            block_lengths, block_norms = document_stats(block)
+            lengths.update(block_lengths)
+            norms.update(block_norms)
+            path = tmp / f"run-{len(runs):05d}.pkl"
+            write_run(path, block)
+            runs.append(path)
+
+        block: dict[str, Term] = {}
+        occurrences = 0
+        with open_debug_dump(debug_path) as dump, open_forward_writer(forward_path) as forward:
+            for doc in Documents:
+                doc_terms = grab_terms(doc)
+                if dump is not None:
+                    dump.write(doc, doc_terms)
+                block_terms = len(block)
+                sequence = index_document(doc, doc_terms, stopwords, stopword_set, stemming, block)
+                if forward is not None:
+                    forward.add(doc.document_id, sequence, term_spans(doc.text))
+                if len(block) > block_terms:
+                    for term in islice(block, block_terms, None):
+                        first_seen.setdefault(term, len(first_seen))
+                occurrences += len(doc_terms)
+                if len(block) * TERM_BYTES + occurrences * OCCURRENCE_BYTES >= memory_budget:
+                    flush(block)
+                    block = {}
+                    occurrences = 0
+            if block or not runs:
+                flush(block)
+
+        for document_id in document_ids:
+            lengths.setdefault(document_id, 0)
+        average = average_length(lengths)
+        print(f"Wrote {len(runs)} runs.")
+
+        # postings.txt is in order of first occurrence, lines are spooled in sorted order and
+        # copied over once the merge is done
+        spool_path = tmp / "postings.spool"
+        offsets: List[Tuple[int, int]] = [(0, 0)] * len(first_seen)
+        bounds: dict[str, Tuple[float, float]] = {}
+
+        with (output_dir / "index.txt").open("w", encoding="utf-8") as index_file, spool_path.open(
+            "wb"
+        ) as spool:
+
+            def entries() -> Iterator[Tuple[str, int, int, list]]:
+                for term, frequency, postings in merge_runs(runs):
+                    term_obj = Term(term, frequency, PostingsList.from_sorted(postings))
+                    index_file.write(f"{term}: {len(postings)}\n")
+                    line = f"{term_obj}\n".encode("utf-8")
+                    offsets[first_seen[term]] = (spool.tell(), len(line))
+                    spool.write(line)
+                    bounds[term] = term_bounds(term_obj.postings.inorder(), lengths, norms, average)
+                    yield term, len(postings), frequency, postings
+
+            count = write_binary_index(
+                output_dir / "dictionary.bin", output_dir / "postings.bin", entries(), bounds, codec
+            )
 
-                # Get or create term object
-                term_obj = terms_dict.get(processed_term)
-                if term_obj is None:
-                    term_obj = Term(processed_term)
-                    terms_dict[processed_term] = term_obj
+        with spool_path.open("rb") as spool, (output_dir / "postings.txt").open("wb") as f:
+            for offset, size in offsets:
+                spool.seek(offset)
+                f.write(spool.read(size))
 
-                # Add occurrence with current position
-                term_obj.add_occurrence(doc.document_id, position_pointer)
+    write_document_stats(output_dir / "doclengths.bin", lengths, norms)
+    return count
 
-                position_pointer += 1
 
-    return list(terms_dict.keys())
+def append_documents(
+    file_path: Path,
+    output_dir: Path,
+    stopwords: bool,
+    stopwords_file: Path,
+    stemming: bool,
+    codec: str = "vbyte",
+    batch_size: int = 256,
+) -> List[int]:
+    """
+    Index the documents of a file into an in-memory delta index and add it to the index in
+    output_dir as a new segment, without rebuilding the main index. The documents are appended to
+    documents.pkl.gz, documents already in the index are skipped
+    :param file_path: Path to a file in the format of cacm.all
+    :param output_dir: Directory of the index
+    :param stopwords: Whether to remove stopwords, as when the index was built
+    :param stopwords_file: Path to stopwords file
+    :param stemming: Whether to apply Porter stemming, as when the index was built
+    :param codec: Compression codec for the postings file
+    :param batch_size: Number of documents per pickled batch
+    :return: IDs of the documents added
+    """
+    global terms_dict
+
+    with SegmentedIndex.open(output_dir / "dictionary.bin", output_dir / "postings.bin") as index:
+        live = index.live_documents()
+    stopword_set = read_stopword_set(stopwords, stopwords_file)
+
+    def new_documents() -> Iterator[Document]:
+        for doc in iter_documents(file_path):
+            if doc.document_id in live:
+                print(
+                    f"Document {doc.document_id} is already indexed, delete it first.",
+                    file=sys.stderr,
+                )
+                continue
+            live.add(doc.document_id)
+            yield doc
+
+    terms_dict = {}
+    forward_path = output_dir / "forward.bin"
+    # the forward index is only kept up to date when the index has one
+    with open_forward_writer(
+        forward_path if forward_path.is_file() else None, append=True
+    ) as forward:
+        for doc in spool_documents(
+            new_documents(), output_dir / "documents.pkl.gz", batch_size, mode="ab"
+        ):
+            sequence = index_document(
+                doc, grab_terms(doc), stopwords, stopword_set, stemming, terms_dict
+            )
+            if forward is not None:
+                forward.add(doc.document_id, sequence, term_spans(doc.text))
+
+    if document_ids:
+        add_segment(output_dir, terms_dict, *collection_stats(), codec)
+    return document_ids
+
+
+def update_index(args: argparse.Namespace) -> None:
+    """
+    Delete, append and compact in that order on the index next to args.output, then rewrite
+    index.txt so the document frequencies match the updated collection
+    :param args: Command line arguments
+    :return: None
+    """
+    global index
+
+    output_dir = args.output.parent
+    dict_path = output_dir / "dictionary.bin"
+    postings_path = output_dir / "postings.bin"
+    if not dict_path.is_file() or not is_binary_index(dict_path):
+        print(f"Error: {dict_path} is not a binary index, build one first.", file=sys.stderr)
+        sys.exit(1)
+
+    if args.delete:
+        deleted = delete_documents(dict_path, postings_path, args.delete)
+        print(f"Deleted {len(deleted)} of {len(args.delete)} documents.")
+
+    if args.append:
+        added = append_documents(
+            args.append,
+            output_dir,
+            args.stopwords,
+            args.stopwords_file,
+            args.stemming,
+            args.codec,
+            args.batch_size,
+        )
+        print(f"Appended {len(added)} documents.")
+
+    if args.compact:
+        with SegmentedIndex.open(dict_path, postings_path) as segmented:
+            live = segmented.live_documents()
+        count = compact(dict_path, postings_path, args.codec)
+        kept = compact_documents(output_dir / "documents.pkl.gz", live)
+        print(f"Compacted the index into {count} terms and {kept} documents.")
+
+    with SegmentedIndex.open(dict_path, postings_path) as segmented:
+        index = dict(segmented.frequencies().items())
+        write_index(output_dir / "index.txt", index)
+        if args.compact:
+            with (output_dir / "postings.txt").open("w", encoding="utf-8") as f:
+                for term, term_obj in segmented.terms().items():
+                    f.write(f"{term_obj}\n")
+        deleted = sum(len(segment.deleted) for segment in segmented.segments)
+        print(
+            f"Index has {len(index)} terms, {len(segmented.segments) - 1} delta segments "
+            f"and {deleted} deleted documents."
+        )
 
 
 def grab_postings_list(term: Term) -> List[int]:
@@ -404,6 +1097,18 @@ def indexer() -> dict[str, int]:
     return index
 
 
+def document_id_list(text: str) -> List[int]:
+    """
+    Parse a comma separated list of document IDs
+    :param text: e.g. "123,456"
+    :return: List of document IDs
+    """
+    try:
+        return [int(part) for part in text.split(",") if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid document ID list '{text}'")
+
+
 def read_cli() -> argparse.Namespace:
     """
     Read command line arguments
@@ -416,7 +1121,7 @@ def read_cli() -> argparse.Namespace:
         "--input",
         "-i",
         type=Path,
-        required=True,
+        default=None,
         help="Path to cacm.all file",
     )
     parser.add_argument(
@@ -444,7 +1149,102 @@ def read_cli() -> argparse.Namespace:
         default=False,
         help="Enable Porter stemming",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--format",
+        choices=("binary", "pickle"),
+        default="binary",
+        help="Output format of the dictionary and postings list",
+    )
+    parser.add_argument(
+        "--codec",
+        choices=sorted(CODECS),
+        default="vbyte",
+        help="Compression codec for the binary postings file",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes documents are indexed in, the output is the same as with 1",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="Number of documents parsed, written and indexed at a time",
+    )
+    parser.add_argument(
+        "--debug-dump",
+        type=Path,
+        nargs="?",
+        const=DEFAULT_PATH,
+        default=None,
+        metavar="PATH",
+        help=f"Write every document's text and terms to PATH (default {DEFAULT_PATH}), "
+        "from a background thread",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        choices=TOKENIZERS,
+        default="nltk",
+        help="nltk: word_tokenize, split_tokens without the punkt model, fast: single pass "
+        "tokenizer with the terms of split_tokens, the same tokenizer must be used by test.py",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        default=None,
+        metavar="MB",
+        help="Index in blocks of about MB megabytes written as sorted runs and merged at the end, "
+        "for collections that do not fit in memory. Binary format only",
+    )
+    parser.add_argument(
+        "--append",
+        type=Path,
+        default=None,
+        metavar="PATH",
+        help="Add the documents of a file in the format of cacm.all to the existing index as a "
+        "delta segment, pass the same --stopwords and --stemming flags the index was built with",
+    )
+    parser.add_argument(
+        "--delete",
+        type=document_id_list,
+        default=None,
+        metavar="IDS",
+        help="Comma separated IDs of documents to delete from the existing index",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        default=False,
+        help="Merge the delta segments and deletions into the main index",
+    )
+    parser.add_argument(
+        "--stem-cache-size",
+        type=int,
+        default=DEFAULT_SIZE,
+        help="Number of words kept in the word -> stem cache",
+    )
+    parser.add_argument(
+        "--save-stems",
+        action="store_true",
+        default=False,
+        help="Write the word -> stem cache to stems.pkl.gz next to the index, test.py loads it at startup",
+    )
+    args = parser.parse_args()
+    updating = args.append is not None or args.delete is not None or args.compact
+    if args.input is None and not updating:
+        parser.error("--input is required to build an index")
+    if args.input is not None and updating:
+        parser.error("--append, --delete and --compact update an existing index, drop --input")
+    if args.memory_budget is not None:
+        if args.memory_budget <= 0:
+            parser.error("--memory-budget must be positive")
+        if args.format != "binary":
+            parser.error("--memory-budget writes the binary format only")
+        if args.workers > 1:
+            parser.error("--memory-budget indexes in a single process, drop --workers")
+    return args
 
 
 def main():
@@ -467,38 +1267,94 @@ def main():
     # make sure output directory exists
     args.output.parent.mkdir(parents=True, exist_ok=True)
 
-    docs = read_documents(args.input)
+    stem_cache.resize(args.stem_cache_size)
+    set_tokenizer(args.tokenizer)
+
+    if args.input is None:
+        update_index(args)
+        print(f"Update completed in {time.time() - start:.6f} seconds.")
+        return
+
+    # a full build replaces the collection, the updates of the previous index no longer apply
+    removed = clear_updates(args.output.parent)
+    if removed:
+        print(f"Removed {len(removed)} delta segments of the previous index.")
+
+    # documents are parsed, written to documents.pkl.gz and indexed one batch at a time
+    docs = spool_documents(
+        iter_documents(args.input), args.output.parent / "documents.pkl.gz", args.batch_size
+    )
 
     #   write_documents(args.output, docs)
     #   print(f"\nParsed {len(docs)} documents -> {args.output}")
 
-    terms = grab_terms_from_all_documents(
-        docs, args.stopwords, args.stopwords_file, args.stemming
-    )
-    print(f"Extracted {len(terms)} unique terms.")
-    print(f"Extracted {len(docs)} documents.")
+    if args.memory_budget is not None:
+        # sorted runs of at most --memory-budget are merged into the output files
+        count = spimi_build(
+            docs,
+            args.stopwords,
+            args.stopwords_file,
+            args.stemming,
+            int(args.memory_budget * 1024 * 1024),
+            args.output.parent,
+            args.codec,
+            args.debug_dump,
+            args.output.parent / "forward.bin",
+        )
+    else:
+        count = len(
+            grab_terms_from_all_documents(
+                docs,
+                args.stopwords,
+                args.stopwords_file,
+                args.stemming,
+                args.workers,
+                args.batch_size,
+                args.debug_dump,
+                args.output.parent / "forward.bin",
+            )
+        )
+    print(f"Extracted {count} unique terms.")
+    print(f"Extracted {len(document_ids)} documents.")
+    if args.stemming:
+        stats = stem_cache.stats()
+        print(
+            f"Stem cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({100 * stats['hit_rate']:.1f}% hit rate), {stats['size']}/{stats['maxsize']} words"
+        )
 
-    index = indexer()
-    #   print(f"Created index with {len(index)} unique terms.")
-    index_output_path = args.output.parent / "index.txt"
-    write_index(index_output_path, index)
+    if args.memory_budget is None:
+        index = indexer()
+        #   print(f"Created index with {len(index)} unique terms.")
+        index_output_path = args.output.parent / "index.txt"
+        write_index(index_output_path, index)
 
-    #   terms_output_path = args.output.parent / "terms.txt"
-    #   write_terms(terms_output_path, sorted(terms))
+        #   terms_output_path = args.output.parent / "terms.txt"
+        #   write_terms(terms_output_path, sorted(terms))
 
-    #   text_output_path = args.output.parent / "all_text.txt"
-    #   all_text = "\n".join(doc.text for doc in docs)
-    #   write_text(text_output_path, all_text)
+        #   text_output_path = args.output.parent / "all_text.txt"
+        #   all_text = "\n".join(doc.text for doc in docs)
+        #   write_text(text_output_path, all_text)
 
-    # write postings for each term in the same file
-    postings_dir = args.output.parent / "postings.txt"
-    write_postings_list(postings_dir)
+        # write postings for each term in the same file
+        postings_dir = args.output.parent / "postings.txt"
+        write_postings_list(postings_dir)
+
+        if args.format == "binary":
+            write_binary_postings(
+                index_output_path.parent / "dictionary.bin",
+                postings_dir.parent / "postings.bin",
+                args.codec,
+            )
+        else:
+            pickle_postings_list(postings_dir.parent / "postings.pkl.gz")
 
-    pickle_postings_list(postings_dir.parent / "postings.pkl.gz")
+            pickle_index(index_output_path.parent / "index.pkl.gz")
 
-    pickle_index(index_output_path.parent / "index.pkl.gz")
+        write_doc_stats(index_output_path.parent / "doclengths.bin")
 
-    pickle_documents(index_output_path.parent / "documents.pkl.gz")
+    if args.save_stems:
+        stem_cache.save(args.output.parent / "stems.pkl.gz")
 
     duration = time.time() - start
     print(f"Indexing completed in {duration:.6f} seconds.")
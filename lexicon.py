@@ -0,0 +1,255 @@
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Iterable, List, Optional, Tuple
+
+# length of the grams of the wildcard and fuzzy index, "$" marks the start and end of a term
+GRAM_SIZE = 2
+BOUNDARY = "$"
+
+# sorts after every character of a term, so prefix + PREFIX_END bounds the terms starting with prefix
+PREFIX_END = "\U0010ffff"
+
+# most terms a prefix, wildcard or fuzzy operand expands to
+MAX_EXPANSIONS = 64
+
+# largest edit distance of a fuzzy operand
+MAX_DISTANCE = 2
+
+
+def grams(text: str, k: int = GRAM_SIZE) -> List[str]:
+    """
+    k-grams of a string
+    :param text: String, with BOUNDARY marks where a term starts or ends
+    :param k: Length of the grams
+    :return: Grams in order, none if the string is shorter than k
+    """
+    return [text[i : i + k] for i in range(len(text) - k + 1)]
+
+
+def auto_distance(word: str) -> int:
+    """
+    Edit distance of a fuzzy operand written without one, "word~": none for one or two
+    characters, one up to five, two for longer words
+    :param word: Normalized word
+    :return: Edit distance
+    """
+    if len(word) <= 2:
+        return 0
+    return 1 if len(word) <= 5 else 2
+
+
+def levenshtein_row(previous: List[int], char: str, word: str) -> List[int]:
+    """
+    Next row of the Levenshtein matrix of word against a string, one character longer
+    :param previous: Row of the string without char
+    :param char: Next character of the string
+    :param word: Word the string is compared to
+    :return: Row of the string with char
+    """
+    row = [previous[0] + 1]
+    for j, expected in enumerate(word):
+        row.append(min(row[j] + 1, previous[j + 1] + 1, previous[j] + (expected != char)))
+    return row
+
+
+def edit_distance(word: str, term: str, bound: int) -> int:
+    """
+    Levenshtein distance, given up as soon as it is over a bound. Only the diagonal band of width
+    2 * bound + 1 of the matrix is computed, cells outside it are over the bound anyway
+    :param word: First string
+    :param term: Second string
+    :param bound: Largest distance of interest
+    :return: Distance, or bound + 1 if it is over bound
+    """
+    size = len(word)
+    if abs(size - len(term)) > bound:
+        return bound + 1
+    over = bound + 1
+    previous = [j if j <= bound else over for j in range(size + 1)]
+    for i, char in enumerate(term, 1):
+        current = [over] * (size + 1)
+        if i <= bound:
+            current[0] = i
+        smallest = current[0]
+        for j in range(max(1, i - bound), min(size, i + bound) + 1):
+            cell = previous[j - 1] + (word[j - 1] != char)
+            if current[j - 1] + 1 < cell:
+                cell = current[j - 1] + 1
+            if previous[j] + 1 < cell:
+                cell = previous[j] + 1
+            current[j] = cell
+            if cell < smallest:
+                smallest = cell
+        if smallest > bound:
+            return over
+        previous = current
+    return min(previous[size], over)
+
+
+class Lexicon:
+    """
+    Prefix, wildcard and fuzzy lookup over the vocabulary
+
+    The vocabulary is kept as a sorted list, so the terms with a prefix are one contiguous range
+    found by binary search, like the subtree of a trie. Wildcards go through a k-gram index of
+    term IDs: the grams of the pattern's literal parts are intersected and the few candidates left
+    are checked against the pattern. Fuzzy lookup uses the same index as a filter: a term within
+    distance k of a word shares all but GRAM_SIZE * k of the word's grams, so only terms sharing
+    that many are compared to the word. When the word is too short for the filter, the sorted
+    list is walked as an implicit trie, computing one row of the Levenshtein matrix per character,
+    reusing the rows of the prefix shared with the previous term, and skipping the whole range of
+    a prefix once every entry of its row is over the bound.
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        """
+        :param terms: Distinct index terms, such as the keys of invert.indexer
+        """
+        self.terms = sorted(terms)
+        self._grams: Optional[dict[str, array]] = None
+
+    @property
+    def gram_index(self) -> dict[str, array]:
+        """Gram -> ascending term IDs, built on the first wildcard or fuzzy lookup"""
+        if self._grams is None:
+            postings = defaultdict(lambda: array("I"))
+            for term_id, term in enumerate(self.terms):
+                for gram in set(grams(BOUNDARY + term + BOUNDARY)):
+                    postings[gram].append(term_id)
+            self._grams = dict(postings)
+        return self._grams
+
+    def prefix(self, prefix: str, limit: Optional[int] = MAX_EXPANSIONS) -> List[str]:
+        """
+        Terms starting with a prefix
+        :param prefix: Prefix
+        :param limit: Most terms returned, None for all of them
+        :return: Matching terms in sorted order
+        """
+        start = bisect_left(self.terms, prefix)
+        end = bisect_left(self.terms, prefix + PREFIX_END, start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return self.terms[start:end]
+
+    def wildcard(self, pattern: str, limit: Optional[int] = MAX_EXPANSIONS) -> List[str]:
+        """
+        Terms matching a pattern where * stands for any run of characters
+        :param pattern: Pattern, e.g. "comput*", "*ation" or "c*r"
+        :param limit: Most terms returned, None for all of them
+        :return: Matching terms in sorted order
+        """
+        if "*" not in pattern:
+            return [pattern] if self.contains(pattern) else []
+        head, _, rest = pattern.partition("*")
+        if rest.strip("*") == "":
+            return self.prefix(head, limit)
+
+        parts = (BOUNDARY + pattern + BOUNDARY).split("*")
+        keys = sorted(
+            {gram for part in parts for gram in grams(part)},
+            key=lambda gram: len(self.gram_index.get(gram, ())),
+        )
+        if keys:
+            candidates = None
+            for gram in keys:
+                ids = self.gram_index.get(gram)
+                if ids is None:
+                    return []
+                candidates = set(ids) if candidates is None else candidates.intersection(ids)
+                if not candidates:
+                    return []
+            candidates = [self.terms[term_id] for term_id in sorted(candidates)]
+        else:
+            # no literal part is long enough for a gram, narrow by the prefix only
+            candidates = self.prefix(head, None)
+
+        # grams can match out of order, check the candidates against the pattern itself
+        matcher = re.compile(".*".join(map(re.escape, pattern.split("*"))), re.DOTALL)
+        matches = []
+        for term in candidates:
+            if matcher.fullmatch(term):
+                matches.append(term)
+                if limit is not None and len(matches) == limit:
+                    break
+        return matches
+
+    def fuzzy(
+        self, word: str, max_distance: int = MAX_DISTANCE, limit: Optional[int] = MAX_EXPANSIONS
+    ) -> List[Tuple[str, int]]:
+        """
+        Terms within an edit distance of a word
+        :param word: Word to match
+        :param max_distance: Largest Levenshtein distance allowed
+        :param limit: Most terms returned, None for all of them
+        :return: (term, distance) pairs, closest first then in sorted order
+        """
+        keys = set(grams(BOUNDARY + word + BOUNDARY))
+        threshold = len(keys) - GRAM_SIZE * max_distance
+        if threshold > 0:
+            counts = Counter()
+            for gram in keys:
+                counts.update(self.gram_index.get(gram, ()))
+            matches = []
+            for term_id in sorted(term_id for term_id, count in counts.items() if count >= threshold):
+                term = self.terms[term_id]
+                distance = edit_distance(word, term, max_distance)
+                if distance <= max_distance:
+                    matches.append((term, distance))
+        else:
+            matches = self._walk(word, max_distance)
+
+        matches.sort(key=lambda match: match[1])
+        return matches if limit is None else matches[:limit]
+
+    def _walk(self, word: str, max_distance: int) -> List[Tuple[str, int]]:
+        """
+        Fuzzy lookup over every term, walking the sorted list as an implicit trie
+        :param word: Word to match
+        :param max_distance: Largest Levenshtein distance allowed
+        :return: (term, distance) pairs in sorted order
+        """
+        terms = self.terms
+        size = len(word)
+        # rows[d] is the row of the first d characters of path
+        rows = [list(range(size + 1))]
+        path = ""
+        matches = []
+        i = 0
+        while i < len(terms):
+            term = terms[i]
+            common = 0
+            shared = min(len(path), len(term))
+            while common < shared and path[common] == term[common]:
+                common += 1
+            del rows[common + 1 :]
+            path = term[:common]
+
+            pruned = False
+            for depth in range(common, len(term)):
+                row = levenshtein_row(rows[-1], term[depth], word)
+                rows.append(row)
+                path += term[depth]
+                if min(row) > max_distance:
+                    # no term below this prefix can come back under the bound
+                    i = bisect_left(terms, path + PREFIX_END, i + 1)
+                    pruned = True
+                    break
+            if pruned:
+                continue
+            if rows[-1][size] <= max_distance:
+                matches.append((term, rows[-1][size]))
+            i += 1
+        return matches
+
+    def contains(self, term: str) -> bool:
+        i = bisect_left(self.terms, term)
+        return i < len(self.terms) and self.terms[i] == term
+
+    def __contains__(self, term) -> bool:
+        return isinstance(term, str) and self.contains(term)
+
+    def __len__(self) -> int:
+        return len(self.terms)
@@ -1,111 +1,302 @@
+from array import array
+from bisect import bisect_left
+from math import isqrt
+
+
 class Node:
-    def __init__(self, document_id, tf=0):
-        self.left = None
-        self.right = None
+    """
+    A single posting, the view handed out by PostingsList lookups
+
+    Slotted, and the positions list is only allocated when it is first used, so postings without
+    positions cost no list.
+    """
+
+    __slots__ = ("document_id", "tf", "_positions")
+
+    def __init__(self, document_id, tf=0, positions=None):
         self.document_id = document_id
         self.tf = tf
-        self.positions = []  # position pointer within the text
+        self._positions = positions or None  # position pointer within the text
+
+    @property
+    def positions(self):
+        if self._positions is None:
+            self._positions = []
+        return self._positions
+
+    @positions.setter
+    def positions(self, positions):
+        self._positions = positions
 
 
 class PostingsList:
-    """Binary Search Tree for Postings List"""
+    """
+    Append-only, array-backed Postings List
+
+    Documents are processed in ascending document ID order, so postings arrive already sorted
+    and each insert either updates the last posting or appends a new one. Postings are kept in
+    parallel arrays: document IDs, term frequencies, and a flat positions buffer where the
+    positions of posting i live in positions[offsets[i]:offsets[i + 1]].
+    """
+
+    __slots__ = ("doc_ids", "tfs", "offsets", "positions", "skip_interval")
+
+    def __init__(self, skip_interval=None):
+        """Initialize the parallel arrays."""
+        self.doc_ids = array("I")
+        self.tfs = array("I")
+        self.offsets = array("I", [0])
+        self.positions = array("I")
+        self.skip_interval = skip_interval  # None for sqrt(df)
+
+    @classmethod
+    def from_sorted(cls, postings):
+        """
+        Build a postings list in one pass from (document_id, tf, positions) tuples already in
+        document ID order, such as the snapshot written by invert.pickle_postings_list
+        """
+        plist = cls()
+        doc_ids = plist.doc_ids
+        tfs = plist.tfs
+        offsets = plist.offsets
+        positions_buffer = plist.positions
+        extend = positions_buffer.extend
+        end = 0
+        for document_id, tf, positions in postings:
+            doc_ids.append(document_id)
+            tfs.append(tf)
+            extend(positions)
+            end += len(positions)
+            offsets.append(end)
+        return plist
 
-    def __init__(self):
-        """Initialize the root and size."""
-        self.root = None
-        self.size = 0
+    @property
+    def size(self):
+        """Number of documents in the postings list (document frequency)."""
+        return len(self.doc_ids)
 
     def insert(self, document_id, position=None):
         """Insert an occurrence for `document_id`; record `position` if given."""
-        if self.root is None:
-            self.root = Node(document_id, tf=1)
+        doc_ids = self.doc_ids
+
+        # fast path, same document as the last insert
+        if doc_ids and doc_ids[-1] == document_id:
+            self.tfs[-1] += 1
+            if position is not None:
+                self.positions.append(position)
+                self.offsets[-1] += 1
+            return
+
+        # fast path, new document in ascending order
+        if not doc_ids or document_id > doc_ids[-1]:
+            doc_ids.append(document_id)
+            self.tfs.append(1)
+            if position is not None:
+                self.positions.append(position)
+            self.offsets.append(len(self.positions))
+            return
+
+        # out of order insert, shift everything after the posting
+        i = bisect_left(doc_ids, document_id)
+        if doc_ids[i] == document_id:
+            self.tfs[i] += 1
             if position is not None:
-                self.root.positions.append(position)
-            self.size += 1
+                self.positions.insert(self.offsets[i + 1], position)
+                for j in range(i + 1, len(self.offsets)):
+                    self.offsets[j] += 1
             return
 
-        cur = self.root
-        while True:
-
-            # left if smaller, right if larger
-            if document_id == cur.document_id:
-                cur.tf += 1
-                if position is not None:
-                    cur.positions.append(position)
-                return
-            elif document_id < cur.document_id:
-                if cur.left is None:
-                    cur.left = Node(document_id, tf=1)
-                    if position is not None:
-                        cur.left.positions.append(position)
-                    self.size += 1
-                    return
-                cur = cur.left
-            else:
-                if cur.right is None:
-                    cur.right = Node(document_id, tf=1)
-                    if position is not None:
-                        cur.right.positions.append(position)
-                    self.size += 1
-                    return
-                cur = cur.right
+        doc_ids.insert(i, document_id)
+        self.tfs.insert(i, 1)
+        self.offsets.insert(i + 1, self.offsets[i])
+        if position is not None:
+            self.positions.insert(self.offsets[i], position)
+            for j in range(i + 1, len(self.offsets)):
+                self.offsets[j] += 1
+
+    def _find(self, document_id):
+        """Binary search for the index of `document_id`, -1 if missing"""
+        i = bisect_left(self.doc_ids, document_id)
+        if i < len(self.doc_ids) and self.doc_ids[i] == document_id:
+            return i
+        return -1
 
     def inorder(self):
-        """Inorder traversal of the BST, left-root-right."""
-        result = []
-        stack = []
-        cur = self.root
-
-        # while there are nodes to process
-        while stack or cur:
-            while cur:
-                stack.append(cur)
-                cur = cur.left
-            cur = stack.pop()
-            result.append((cur.document_id, cur.tf))
-            cur = cur.right
-        return result
+        """Postings in document ID order as (document_id, tf) pairs."""
+        return list(zip(self.doc_ids, self.tfs))
 
     def inorder_with_positions(self):
         """inorder but with positions, vertix model to inverted index"""
-        result = []
-        stack = []
-        cur = self.root
-        while stack or cur:
-            while cur:
-                stack.append(cur)
-                cur = cur.left
-            cur = stack.pop()
-            result.append((cur.document_id, cur.tf, list(cur.positions)))
-            cur = cur.right
-        return result
+        offsets = self.offsets
+        positions = self.positions
+        return [
+            (document_id, tf, positions[offsets[i] : offsets[i + 1]].tolist())
+            for i, (document_id, tf) in enumerate(zip(self.doc_ids, self.tfs))
+        ]
 
     def __contains__(self, document_id):
         """Check if a term shows up in a certain document"""
-        cur = self.root
-        while cur:
-            if document_id == cur.document_id:
-                return True
-            cur = cur.left if document_id < cur.document_id else cur.right
-        return False
+        return self._find(document_id) != -1
 
     def __getitem__(self, document_id):
         """Get the postings for a specific document"""
-        cur = self.root
-        while cur:
-            if document_id == cur.document_id:
-                return cur
-            cur = cur.left if document_id < cur.document_id else cur.right
-        raise KeyError(f"Document ID {document_id} not found in postings list.")
+        i = self._find(document_id)
+        if i == -1:
+            raise KeyError(f"Document ID {document_id} not found in postings list.")
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return Node(
+            document_id,
+            self.tfs[i],
+            self.positions[start:end].tolist() if end > start else None,
+        )
 
     def grab_positions(self, document_id):
         """grab positions for a specific document"""
-        cur = self.root
-        while cur:
-            if document_id == cur.document_id:
-                return list(cur.positions)  # return a copy
-            cur = cur.left if document_id < cur.document_id else cur.right
-        raise KeyError(f"Document ID {document_id} not found in postings list.")
+        i = self._find(document_id)
+        if i == -1:
+            raise KeyError(f"Document ID {document_id} not found in postings list.")
+        return self.positions[self.offsets[i] : self.offsets[i + 1]].tolist()  # return a copy
+
+    def cursor(self):
+        """Cursor over the postings in document ID order, see PostingsCursor"""
+        return PostingsCursor(self.doc_ids, self.tfs, self.offsets, self.positions)
+
+    def skips(self):
+        """
+        Spacing of the skip pointers, posting i can jump to posting i + skips(). Pointers are
+        implicit in the array layout so nothing has to be rebuilt on insert
+        """
+        if self.skip_interval:
+            return self.skip_interval
+        return max(1, isqrt(len(self.doc_ids)))
+
+    def intersect(self, other, method="skip"):
+        """
+        Document IDs found in both postings lists
+        :param other: PostingsList to intersect with
+        :param method: "merge" for a linear merge, "skip" to follow skip pointers, "gallop" for exponential search
+        :return: Sorted list of document IDs
+        """
+        if method == "merge":
+            return merge_intersect(self.doc_ids, other.doc_ids)
+        if method == "skip":
+            return skip_intersect(self.doc_ids, self.skips(), other.doc_ids, other.skips())
+        if method == "gallop":
+            return gallop_intersect(self.doc_ids, other.doc_ids)
+        raise ValueError(f"Unknown intersection method '{method}'.")
 
     def __len__(self):
-        return self.size
+        return len(self.doc_ids)
+
+
+class PostingsCursor:
+    """
+    Cursor over the postings of a PostingsList, or over a bare sorted array of document IDs. `doc`
+    is the current document ID, None once the cursor is exhausted
+    """
+
+    __slots__ = ("doc_ids", "tfs", "offsets", "positions_buffer", "i", "doc")
+
+    def __init__(self, doc_ids, tfs=None, offsets=None, positions=None):
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.offsets = offsets
+        self.positions_buffer = positions
+        self.i = 0
+        self.doc = doc_ids[0] if doc_ids else None
+
+    @property
+    def tf(self):
+        return self.tfs[self.i]
+
+    def positions(self):
+        """
+        Positions of the current posting
+        :return: (positions buffer, start, end)
+        """
+        return self.positions_buffer, self.offsets[self.i], self.offsets[self.i + 1]
+
+    def next(self):
+        self.i += 1
+        self.doc = self.doc_ids[self.i] if self.i < len(self.doc_ids) else None
+
+    def advance(self, target: int):
+        """Move to the first document ID >= target"""
+        if self.doc is None or self.doc >= target:
+            return
+        doc_ids = self.doc_ids
+        n = len(doc_ids)
+
+        # usually the next posting, otherwise binary search the rest of the list
+        i = self.i + 1
+        if i < n and doc_ids[i] < target:
+            i = bisect_left(doc_ids, target, i + 1)
+        self.i = i
+        self.doc = doc_ids[i] if i < n else None
+
+
+def merge_intersect(a, b):
+    """Linear merge of two sorted document ID arrays"""
+    result = []
+    i = j = 0
+    len_a, len_b = len(a), len(b)
+    while i < len_a and j < len_b:
+        x, y = a[i], b[j]
+        if x == y:
+            result.append(x)
+            i += 1
+            j += 1
+        elif x < y:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def skip_intersect(a, skip_a, b, skip_b):
+    """
+    Walk the shorter sorted document ID array and advance through the longer one by following
+    its skip pointers over runs of non-matching document IDs
+    """
+    if len(a) > len(b):
+        a, skip_a, b, skip_b = b, skip_b, a, skip_a
+    result = []
+    i = 0
+    len_b = len(b)
+    for x in a:
+        while i + skip_b < len_b and b[i + skip_b] <= x:
+            i += skip_b
+        while i < len_b and b[i] < x:
+            i += 1
+        if i == len_b:
+            break
+        if b[i] == x:
+            result.append(x)
+    return result
+
+
+def gallop_intersect(a, b):
+    """Look up each document ID of the shorter array in the longer one with exponential search"""
+    if len(a) > len(b):
+        a, b = b, a
+    result = []
+    if not a:
+        return result
+    lo = 0
+    len_b = len(b)
+    base = max(1, len_b // len(a))  # expected distance between matches
+    for x in a:
+        # double the step until we pass x, then binary search the last step
+        step = base
+        hi = lo + step
+        while hi < len_b and b[hi] < x:
+            lo = hi + 1
+            step <<= 1
+            hi = lo + step
+        lo = bisect_left(b, x, lo, hi + 1 if hi < len_b else len_b)
+        if lo == len_b:
+            break
+        if b[lo] == x:
+            result.append(x)
+            lo += 1
+    return result
@@ -0,0 +1,654 @@
+import heapq
+import re
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+
+from invert import normalize, text_terms
+from lexicon import MAX_DISTANCE, Lexicon, auto_distance
+from postings import PostingsCursor, PostingsList
+from stemcache import stem_cache
+
+OPERATORS = ("AND", "OR", "NOT")
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(\()|(\))|("[^"]*"?)|([^\s()"]+))')
+
+NEAR_PATTERN = re.compile(r"NEAR/(\d+)")
+
+# fuzzy operand, "word~" or "word~1"
+FUZZY_PATTERN = re.compile(r"(.+)~(\d*)")
+
+
+class QuerySyntaxError(ValueError):
+    """Raised when a boolean query cannot be parsed"""
+
+
+def read_stopwords(path: Optional[Path]) -> set[str]:
+    """
+    Read a stopwords file, normalized the same way invert.py does
+    :param path: Path to the stopwords file, None for no stopwords
+    :return: Set of stopwords
+    """
+    stopword_set = set()
+    if path is not None and path.exists():
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                stopword_set.add(normalize(line.strip()))
+    stopword_set.discard("")
+    return stopword_set
+
+
+def analyze(text: str, stopword_set: set[str], stemming: bool) -> List[str]:
+    """
+    Turn text into index terms the same way invert.py processes documents
+    :param text: Input text
+    :param stopword_set: Normalized stopwords to drop
+    :param stemming: Whether to apply Porter stemming
+    :return: Index terms in text order
+    """
+    terms = []
+    for term in text_terms(text):
+        if not term or term in stopword_set:
+            continue
+        if stemming:
+            term = stem_cache.stem(term)
+        terms.append(term)
+    return terms
+
+
+# query tree
+
+
+class TermNode:
+    def __init__(self, term: str):
+        self.term = term
+
+    def __repr__(self):
+        return f"Term({self.term})"
+
+
+class AndNode:
+    def __init__(self, children: list):
+        self.children = children
+
+    def __repr__(self):
+        return f"And({', '.join(map(repr, self.children))})"
+
+
+class OrNode:
+    def __init__(self, children: list):
+        self.children = children
+
+    def __repr__(self):
+        return f"Or({', '.join(map(repr, self.children))})"
+
+
+class PhraseNode:
+    def __init__(self, terms: list):
+        self.terms = terms  # (offset, term) pairs, offsets keep the gaps left by stopwords
+
+    def __repr__(self):
+        return f"Phrase({', '.join(f'{term}@{offset}' for offset, term in self.terms)})"
+
+
+class NearNode:
+    def __init__(self, left: TermNode, right: TermNode, k: int):
+        self.left = left
+        self.right = right
+        self.k = k
+
+    def __repr__(self):
+        return f"Near({self.left!r}, {self.right!r}, {self.k})"
+
+
+class NotNode:
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return f"Not({self.child!r})"
+
+
+# cursors, each walks a sorted stream of document IDs and can jump ahead. The cursors of
+# postings lists come from their cursor() method, postings.PostingsCursor for a PostingsList and
+# compression.CompressedCursor for a CompressedPostingsList
+
+
+class AndCursor:
+    """Leapfrog intersection, `include` sorted cheapest first, `exclude` are AND NOT operands"""
+
+    def __init__(self, include: list, exclude: list):
+        self.include = include
+        self.exclude = exclude
+        self.doc = None
+        self._settle()
+
+    def _settle(self):
+        """Move every cursor forward until they agree on a document that no excluded cursor has"""
+        lead = self.include[0]
+        while lead.doc is not None:
+            candidate = lead.doc
+            for cursor in self.include[1:]:
+                cursor.advance(candidate)
+                if cursor.doc is None:
+                    self.doc = None
+                    return
+                if cursor.doc != candidate:
+                    lead.advance(cursor.doc)
+                    break
+            else:
+                excluded = False
+                for cursor in self.exclude:
+                    cursor.advance(candidate)
+                    if cursor.doc == candidate:
+                        excluded = True
+                        break
+                if not excluded:
+                    self.doc = candidate
+                    return
+                lead.next()
+        self.doc = None
+
+    def next(self):
+        self.include[0].next()
+        self._settle()
+
+    def advance(self, target: int):
+        if self.doc is None or self.doc >= target:
+            return
+        self.include[0].advance(target)
+        self._settle()
+
+
+def phrase_starts(ranges: list) -> List[int]:
+    """
+    Merge the positions of the terms of a phrase
+    :param ranges: (positions buffer, start, end, offset) per term
+    :return: Positions where every term occurs at its offset from the start of the phrase
+    """
+    cursors = [start for _, start, _, _ in ranges]
+    result = []
+    buffer, start, end, offset = ranges[0]
+    if start == end:
+        return result
+    candidate = buffer[start] - offset
+    while True:
+        # jump every term to its first position at or past the candidate
+        for t, (buffer, start, end, offset) in enumerate(ranges):
+            i = bisect_left(buffer, candidate + offset, cursors[t], end)
+            cursors[t] = i
+            if i == end:
+                return result
+            if buffer[i] - offset != candidate:
+                candidate = buffer[i] - offset
+                break
+        else:
+            result.append(candidate)
+            candidate += 1
+
+
+def within(left: tuple, right: tuple, k: int) -> bool:
+    """
+    Check if two sorted position ranges have a pair of positions at most k apart
+    :param left: (positions buffer, start, end)
+    :param right: (positions buffer, start, end)
+    :param k: Maximum distance
+    :return: True if the terms are within k positions of each other
+    """
+    a, i, end_a = left
+    b, j, end_b = right
+    while i < end_a and j < end_b:
+        x, y = a[i], b[j]
+        if abs(x - y) <= k:
+            return True
+        if x < y:
+            i += 1
+        else:
+            j += 1
+    return False
+
+
+class PositionalCursor:
+    """
+    Documents containing every postings list that pass a check on their positions. Walks the
+    cursor of the shortest list and moves the others to its documents, positions are only read
+    for documents they share
+    """
+
+    def __init__(self, postings: list, matches: Callable[[list], bool]):
+        """
+        :param postings: Postings lists, PostingsList or CompressedPostingsList
+        :param matches: Check of a shared document, called with the (positions buffer, start,
+                        end) of every list in the order of postings
+        """
+        self.matches = matches
+        self.cursors = [p.cursor() for p in postings]
+        order = sorted(range(len(postings)), key=lambda t: len(postings[t]))
+        self.lead = self.cursors[order[0]]
+        self.others = [self.cursors[t] for t in order[1:]]
+        self.doc = None
+        self._settle()
+
+    def _settle(self):
+        """Move the cursors forward until they agree on a document that passes the check"""
+        lead = self.lead
+        while lead.doc is not None:
+            candidate = lead.doc
+            for cursor in self.others:
+                cursor.advance(candidate)
+                if cursor.doc is None:
+                    self.doc = None
+                    return
+                if cursor.doc != candidate:
+                    lead.advance(cursor.doc)
+                    break
+            else:
+                if self.matches([cursor.positions() for cursor in self.cursors]):
+                    self.doc = candidate
+                    return
+                lead.next()
+        self.doc = None
+
+    def next(self):
+        if self.doc is not None:
+            self.lead.next()
+            self._settle()
+
+    def advance(self, target: int):
+        if self.doc is not None and self.doc < target:
+            self.lead.advance(target)
+            self._settle()
+
+
+class PhraseCursor(PositionalCursor):
+    """Documents where the terms occur at their offsets from the start of the phrase"""
+
+    def __init__(self, postings: list, offsets: list):
+        self.offsets = offsets
+        super().__init__(postings, self._matches)
+
+    def _matches(self, ranges: list) -> bool:
+        return bool(
+            phrase_starts([(*r, offset) for r, offset in zip(ranges, self.offsets)])
+        )
+
+
+class NearCursor(PositionalCursor):
+    """Documents where two terms occur within k positions of each other, in either order"""
+
+    def __init__(self, left, right, k: int):
+        self.k = k
+        super().__init__([left, right], self._matches)
+
+    def _matches(self, ranges: list) -> bool:
+        return within(ranges[0], ranges[1], self.k)
+
+
+class OrCursor:
+    """Union of cursors, merged with a heap"""
+
+    def __init__(self, children: list):
+        self.heap = [(c.doc, i, c) for i, c in enumerate(children) if c.doc is not None]
+        heapq.heapify(self.heap)
+        self.doc = self.heap[0][0] if self.heap else None
+
+    def _pop_until(self, target: int):
+        """Move every child below target to its first document ID >= target"""
+        heap = self.heap
+        while heap and heap[0][0] < target:
+            _, i, cursor = heap[0]
+            cursor.advance(target)
+            if cursor.doc is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (cursor.doc, i, cursor))
+        self.doc = heap[0][0] if heap else None
+
+    def next(self):
+        if self.doc is not None:
+            self._pop_until(self.doc + 1)
+
+    def advance(self, target: int):
+        if self.doc is not None and self.doc < target:
+            self._pop_until(target)
+
+
+class NotCursor:
+    """Complement of a cursor against every document ID in the collection"""
+
+    def __init__(self, universe, child):
+        self.universe = PostingsCursor(universe)
+        self.child = child
+        self.doc = None
+        self._settle()
+
+    def _settle(self):
+        while self.universe.doc is not None:
+            self.child.advance(self.universe.doc)
+            if self.child.doc != self.universe.doc:
+                self.doc = self.universe.doc
+                return
+            self.universe.next()
+        self.doc = None
+
+    def next(self):
+        self.universe.next()
+        self._settle()
+
+    def advance(self, target: int):
+        if self.doc is not None and self.doc < target:
+            self.universe.advance(target)
+            self._settle()
+
+
+class EmptyCursor:
+    doc = None
+
+    def next(self):
+        pass
+
+    def advance(self, target: int):
+        pass
+
+
+class QueryEngine:
+    """
+    Boolean query parser and evaluator over the inverted index
+
+    Queries combine terms with AND, OR, NOT and parentheses, adjacent operands are ANDed.
+    "quoted phrases" match the terms at consecutive positions and `a NEAR/k b` matches a and b
+    within k positions of each other. Operands are normalized and stemmed like the indexed text,
+    and evaluated as streaming merges over the postings, intersecting the operands with the
+    smallest document frequency first. `comput*` and `c*r` match every indexed term fitting the
+    pattern and `word~` or `word~1` every term within that edit distance of the stemmed word, these
+    operands are expanded into an OR of the matching terms.
+    """
+
+    def __init__(
+        self,
+        terms_dict,
+        index,
+        stopword_set: Optional[set[str]] = None,
+        stemming: bool = True,
+        universe=None,
+    ):
+        """
+        :param terms_dict: Mapping of term -> Term object
+        :param index: Mapping of term -> document frequency
+        :param stopword_set: Stopwords removed at indexing time
+        :param stemming: Whether the index was stemmed
+        :param universe: Sorted document IDs of the collection, used by NOT
+        """
+        self.terms_dict = terms_dict
+        self.index = index
+        self.stopword_set = stopword_set or set()
+        self.stemming = stemming
+        self._universe = universe
+        self._lexicon = None
+
+    @property
+    def universe(self):
+        """Every document ID in the collection, from the postings if none were given"""
+        if self._universe is None:
+            doc_ids = set()
+            for term in self.terms_dict:
+                doc_ids.update(document_id for document_id, _ in self._postings(term).inorder())
+            self._universe = array("I", sorted(doc_ids))
+        return self._universe
+
+    @property
+    def lexicon(self) -> Lexicon:
+        """Prefix, wildcard and fuzzy lookup over the indexed terms, built on first use"""
+        if self._lexicon is None:
+            self._lexicon = Lexicon(self.index)
+        return self._lexicon
+
+    # parsing
+
+    def parse(self, query: str):
+        """
+        Parse a boolean query into a query tree
+        :param query: Query string
+        :return: Query tree, None if every operand was a stopword
+        """
+        self._tokens = self._lex(query)
+        self._i = 0
+        if not self._tokens:
+            raise QuerySyntaxError("Empty query.")
+        node = self._parse_or()
+        if self._i != len(self._tokens):
+            raise QuerySyntaxError(f"Unexpected '{self._tokens[self._i]}'.")
+        return node
+
+    def _lex(self, query: str) -> List[str]:
+        tokens = []
+        pos = 0
+        query = query.strip()
+        while pos < len(query):
+            match = TOKEN_PATTERN.match(query, pos)
+            tokens.append(match.group(match.lastindex))
+            pos = match.end()
+        return tokens
+
+    def _peek(self) -> Optional[str]:
+        return self._tokens[self._i] if self._i < len(self._tokens) else None
+
+    def _parse_or(self):
+        children = [self._parse_and()]
+        while self._peek() == "OR":
+            self._i += 1
+            children.append(self._parse_and())
+        children = [c for c in children if c is not None]
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else OrNode(children)
+
+    def _parse_and(self):
+        children = [self._parse_not()]
+        while self._peek() not in (None, ")", "OR"):
+            if self._peek() == "AND":
+                self._i += 1
+            children.append(self._parse_not())
+        children = [c for c in children if c is not None]
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else AndNode(children)
+
+    def _parse_not(self):
+        if self._peek() == "NOT":
+            self._i += 1
+            child = self._parse_not()
+            return None if child is None else NotNode(child)
+        return self._parse_near()
+
+    def _parse_near(self):
+        left = self._parse_primary()
+        while self._peek() is not None and NEAR_PATTERN.fullmatch(self._peek()):
+            k = int(NEAR_PATTERN.fullmatch(self._peek()).group(1))
+            self._i += 1
+            right = self._parse_primary()
+            for operand in (left, right):
+                if operand is not None and not isinstance(operand, TermNode):
+                    raise QuerySyntaxError("NEAR operands must be single terms.")
+            # a stopword operand does not constrain the other term
+            if left is None or right is None:
+                left = left if right is None else right
+            else:
+                left = NearNode(left, right, k)
+        return left
+
+    def _parse_primary(self):
+        token = self._peek()
+        if token is None:
+            raise QuerySyntaxError("Unexpected end of query.")
+        if token == "(":
+            self._i += 1
+            node = self._parse_or()
+            if self._peek() != ")":
+                raise QuerySyntaxError("Missing ')'.")
+            self._i += 1
+            return node
+        if token == ")" or token in OPERATORS or NEAR_PATTERN.fullmatch(token):
+            raise QuerySyntaxError(f"Unexpected '{token}'.")
+        self._i += 1
+        if token.startswith('"'):
+            if len(token) < 2 or not token.endswith('"'):
+                raise QuerySyntaxError("Missing closing quote.")
+            return self._phrase(token[1:-1])
+        return self._operand(token)
+
+    def _phrase(self, text: str):
+        """
+        Analyze a quoted phrase, keeping the position gaps that empty tokens and stopwords leave
+        in the index so the offsets between terms match the indexed positions
+        """
+        terms = []
+        position = 0
+        for term in text_terms(text):
+            if term and term not in self.stopword_set:
+                terms.append((position, self._resolve(term, term)))
+            position += 1
+        if not terms:
+            return None
+        if len(terms) == 1:
+            return TermNode(terms[0][1])
+        first = terms[0][0]
+        return PhraseNode([(offset - first, term) for offset, term in terms])
+
+    def _operand(self, word: str):
+        """Analyze a query word, words that split into several terms are ANDed"""
+        if "*" in word:
+            return self._wildcard(word)
+        fuzzy = FUZZY_PATTERN.fullmatch(word)
+        if fuzzy is not None:
+            return self._fuzzy(fuzzy.group(1), fuzzy.group(2))
+        terms = [self._resolve(word, term) for term in analyze(word, self.stopword_set, False)]
+        if not terms:
+            return None
+        nodes = [TermNode(term) for term in terms]
+        return nodes[0] if len(nodes) == 1 else AndNode(nodes)
+
+    def _expand(self, operand: str, terms: List[str]):
+        """OR of the terms an operand expands to, the operand itself matches nothing if there are none"""
+        if not terms:
+            return TermNode(operand)
+        nodes = [TermNode(term) for term in terms]
+        return nodes[0] if len(nodes) == 1 else OrNode(nodes)
+
+    def _wildcard(self, word: str):
+        """Expand a pattern with * over the indexed terms, it is matched unstemmed"""
+        pattern = "".join(char for char in word.lower() if char.isalnum() or char == "*")
+        if not pattern.strip("*"):
+            raise QuerySyntaxError(f"Wildcard '{word}' needs at least one letter or digit.")
+        return self._expand(pattern, self.lexicon.wildcard(pattern))
+
+    def _fuzzy(self, word: str, distance: str):
+        """Expand a word~ operand to the indexed terms within the edit distance of its term"""
+        term = normalize(word)
+        if not term or term in self.stopword_set:
+            return None
+        term = self._resolve(word, term)
+        max_distance = min(int(distance), MAX_DISTANCE) if distance else auto_distance(term)
+        return self._expand(term, [match for match, _ in self.lexicon.fuzzy(term, max_distance)])
+
+    def _resolve(self, word: str, term: str) -> str:
+        """Stem a normalized operand, keeping the unstemmed form if only that one is indexed"""
+        if not self.stemming:
+            return term
+        stemmed = stem_cache.stem(term)
+        if stemmed not in self.index and term in self.index:
+            return term
+        return stemmed
+
+    # evaluation
+
+    def _postings(self, term: str):
+        """Postings of a term, a PostingsList or a CompressedPostingsList, empty if not indexed"""
+        if term not in self.terms_dict:
+            return PostingsList()
+        return self.terms_dict[term].postings
+
+    def cost(self, node) -> int:
+        """
+        Estimated number of documents matched by a query tree, from the document frequencies
+        :param node: Query tree
+        :return: Estimated document count
+        """
+        if isinstance(node, TermNode):
+            return self.index.get(node.term, 0)
+        if isinstance(node, PhraseNode):
+            return min(self.index.get(term, 0) for _, term in node.terms)
+        if isinstance(node, NearNode):
+            return min(self.cost(node.left), self.cost(node.right))
+        if isinstance(node, AndNode):
+            positive = [self.cost(c) for c in node.children if not isinstance(c, NotNode)]
+            return min(positive) if positive else len(self.universe)
+        if isinstance(node, OrNode):
+            return sum(self.cost(c) for c in node.children)
+        if isinstance(node, NotNode):
+            return max(0, len(self.universe) - self.cost(node.child))
+        return 0
+
+    def cursor(self, node):
+        """
+        Build the cursor tree that evaluates a query tree
+        :param node: Query tree
+        :return: Cursor positioned on the first matching document
+        """
+        if node is None:
+            return EmptyCursor()
+        if isinstance(node, TermNode):
+            return self._postings(node.term).cursor()
+        if isinstance(node, PhraseNode):
+            return PhraseCursor(
+                [self._postings(term) for _, term in node.terms],
+                [offset for offset, _ in node.terms],
+            )
+        if isinstance(node, NearNode):
+            return NearCursor(
+                self._postings(node.left.term), self._postings(node.right.term), node.k
+            )
+        if isinstance(node, OrNode):
+            return OrCursor([self.cursor(c) for c in node.children])
+        if isinstance(node, NotNode):
+            return NotCursor(self.universe, self.cursor(node.child))
+
+        include = sorted(
+            (c for c in node.children if not isinstance(c, NotNode)), key=self.cost
+        )
+        exclude = sorted(
+            (c.child for c in node.children if isinstance(c, NotNode)), key=self.cost
+        )
+        if not include:
+            return NotCursor(self.universe, OrCursor([self.cursor(c) for c in exclude]))
+        return AndCursor(
+            [self.cursor(c) for c in include], [self.cursor(c) for c in exclude]
+        )
+
+    def execute(self, node) -> Iterator[int]:
+        """
+        Evaluate a parsed query tree lazily
+        :param node: Query tree
+        :return: Iterator over matching document IDs in ascending order
+        """
+        cursor = self.cursor(node)
+        while cursor.doc is not None:
+            yield cursor.doc
+            cursor.next()
+
+    def stream(self, query: str) -> Iterator[int]:
+        """
+        Evaluate a boolean query lazily
+        :param query: Query string
+        :return: Iterator over matching document IDs in ascending order
+        """
+        return self.execute(self.parse(query))
+
+    def search(self, query: str) -> List[int]:
+        """
+        Evaluate a boolean query
+        :param query: Query string
+        :return: Matching document IDs in ascending order
+        """
+        return list(self.stream(query))
@@ -0,0 +1,235 @@
+import hashlib
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Hashable, Optional
+
+from segments import MANIFEST
+
+# default number of queries kept
+DEFAULT_SIZE = 1024
+
+# seconds between two checks of the build ID of the watched index
+CHECK_INTERVAL = 1.0
+
+# returned by QueryCache.get when a key is not cached, None is a valid cached value
+MISSING = object()
+
+
+def index_build_id(dict_path: Path, postings_path: Path) -> str:
+    """
+    Identify a build of the index by the files invert.py writes: the dictionary, the postings and
+    the other index files next to them (documents, forward index, delta segments, deletions and
+    the manifest). Any rebuild, append or delete rewrites one of them, so it changes the ID
+    :param dict_path: Path to the dictionary file
+    :param postings_path: Path to the postings file
+    :return: Hex digest of the files' names, sizes and modification times
+    """
+    directory = postings_path.parent
+    paths = {dict_path, postings_path}
+    if directory.is_dir():
+        paths.update(
+            path
+            for path in directory.iterdir()
+            if path.suffix in (".bin", ".gz") or path.name == MANIFEST
+        )
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        digest.update(f"{path.name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class QueryCache:
+    """
+    Bounded LRU table of query -> result in front of the query engine, the ranker and term lookups
+
+    Keys are the analyzed form of a query (normalized and stemmed terms, or the parsed query
+    tree), so inputs that differ only in case, inflection or stopwords share an entry. Entries
+    optionally expire ttl seconds after they are stored. The cache watches the build ID of the
+    index it is filled from, checked at most every check_interval seconds, and drops the whole
+    table when an update or rebuild replaces the index, after letting its owner reload it.
+    Cached results are shared and must not be modified by the caller.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_SIZE, ttl: Optional[float] = None):
+        """
+        :param maxsize: Maximum number of queries kept, 0 disables the cache
+        :param ttl: Seconds an entry stays valid, None for no expiry
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.build_id: Optional[str] = None
+        self.source: Optional[Callable[[], str]] = None
+        self.on_change: Optional[Callable[[], None]] = None
+        self.check_interval = CHECK_INTERVAL
+        self.next_check = 0.0
+        self.pending: Optional[str] = None
+        # key -> (expiry time or None, result)
+        self.table: OrderedDict[Hashable, tuple] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default=MISSING):
+        """
+        Cached result of a query
+        :param key: Analyzed query
+        :param default: Returned when the query is not cached or has expired
+        :return: Result, or default
+        """
+        entry = self.table.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires, value = entry
+        if expires is not None and time.monotonic() >= expires:
+            del self.table[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.table.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value) -> None:
+        """
+        Store the result of a query, evicting the least recently used ones over maxsize
+        :param key: Analyzed query
+        :param value: Result
+        :return: None
+        """
+        if not self.maxsize:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        self.table[key] = (expires, value)
+        self.table.move_to_end(key)
+        while len(self.table) > self.maxsize:
+            self.table.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], object]):
+        """
+        Cached result of a query, computed and stored on a miss. Exceptions raised by compute are
+        not cached
+        :param key: Analyzed query
+        :param compute: Function of no arguments computing the result
+        :return: Result
+        """
+        self.check()
+        value = self.get(key)
+        if value is MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def watch(
+        self,
+        source: Callable[[], str],
+        on_change: Optional[Callable[[], None]] = None,
+        interval: float = CHECK_INTERVAL,
+    ) -> None:
+        """
+        Tie the cache to the index a build ID is computed from, such as index_build_id
+        :param source: Function of no arguments returning the current build ID
+        :param on_change: Called when the build ID changes, before the entries are dropped, to
+                          reload the index
+        :param interval: Seconds between two checks of the build ID
+        :return: None
+        """
+        self.source = source
+        self.on_change = on_change
+        self.check_interval = interval
+        self.pending = None
+        self.invalidate(source())
+        self.next_check = time.monotonic() + interval
+
+    def check(self) -> bool:
+        """
+        Compare the build ID of the watched index with the one the cache was filled from, unless
+        it was checked less than check_interval seconds ago. A new ID is only acted on once two
+        checks in a row see it, so an index still being written is not reloaded half way
+        :return: True if the index changed and the entries were dropped
+        """
+        if self.source is None:
+            return False
+        now = time.monotonic()
+        if now < self.next_check:
+            return False
+        self.next_check = now + self.check_interval
+        build_id = self.source()
+        if build_id == self.build_id:
+            self.pending = None
+            return False
+        if build_id != self.pending:
+            self.pending = build_id
+            return False
+        self.pending = None
+        if self.on_change is not None:
+            self.on_change()
+        self.invalidate(build_id)
+        return True
+
+    def invalidate(self, build_id: str) -> bool:
+        """
+        Tie the cache to a build of the index, dropping every entry if it was filled from another
+        :param build_id: ID from index_build_id
+        :return: True if entries of another build were dropped
+        """
+        if build_id == self.build_id:
+            return False
+        dropped = self.build_id is not None and bool(self.table)
+        if dropped:
+            self.invalidations += 1
+        self.table.clear()
+        self.build_id = build_id
+        return dropped
+
+    def configure(self, maxsize: int, ttl: Optional[float] = None) -> None:
+        """
+        Change the maximum number of queries kept and the expiry of new entries, evicting the
+        least recently used queries
+        :param maxsize: New maximum, 0 disables the cache
+        :param ttl: Seconds an entry stays valid, None for no expiry
+        :return: None
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        while len(self.table) > maxsize:
+            self.table.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.table.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        """
+        Counters of the cache
+        :return: Dictionary of size, maxsize, ttl, hits, misses, evictions, expirations,
+                 invalidations and hit_rate
+        """
+        return {
+            "size": len(self.table),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hit_rate,
+        }
+
+
+# shared by test.py and server.py
+query_cache = QueryCache()
@@ -0,0 +1,319 @@
+import heapq
+import math
+import time
+from bisect import insort
+from collections import Counter
+from typing import List, Mapping, Optional, Tuple
+
+from query import analyze
+from stemcache import stem_cache
+from storage import BM25_B, BM25_K1
+
+SCHEMES = ("bm25", "cosine")
+PRUNING = ("wand", "exhaustive")
+
+# slack for rounding differences between a sum of bounds and the threshold it is compared to
+EPSILON = 1e-9
+
+
+class Ranker:
+    """
+    Ranked retrieval over the inverted index
+
+    Scores documents with BM25, or cosine similarity of lnc.ltc TF-IDF vectors, using document
+    lengths and norms computed at index time and an IDF table built from the document
+    frequencies. Postings of the query terms are traversed document-at-a-time and the top k
+    documents are kept in a bounded heap. With WAND pruning, per-term score upper bounds are
+    used to skip documents that cannot enter the top k.
+    """
+
+    def __init__(
+        self,
+        terms_dict,
+        index,
+        lengths: dict[int, int],
+        norms: dict[int, float],
+        stopword_set: Optional[set[str]] = None,
+        stemming: bool = True,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        bounds: Optional[Mapping[str, Tuple[float, float]]] = None,
+    ):
+        """
+        :param terms_dict: Mapping of term -> Term object
+        :param index: Mapping of term -> document frequency
+        :param lengths: Document ID -> number of indexed tokens
+        :param norms: Document ID -> norm of the document's 1 + log10(tf) weights
+        :param stopword_set: Stopwords removed at indexing time
+        :param stemming: Whether the index was stemmed
+        :param k1: BM25 term frequency saturation
+        :param b: BM25 length normalization
+        :param bounds: Term -> (BM25 bound, cosine bound) stored with the dictionary, computed for
+                       BM25_K1 and BM25_B. Bounds are computed from the postings when missing
+        """
+        self.terms_dict = terms_dict
+        self.index = index
+        self.lengths = lengths
+        self.norms = norms
+        self.stopword_set = stopword_set or set()
+        self.stemming = stemming
+        self.k1 = k1
+        self.b = b
+        self.bounds = bounds if bounds is not None and (k1, b) == (BM25_K1, BM25_B) else None
+        self._computed_bounds = {}
+
+        # counters of the last search
+        self.last_stats = {"postings_evaluated": 0, "documents_scored": 0, "latency": 0.0}
+
+        self.n = len(lengths)
+        self.average_length = sum(lengths.values()) / self.n if self.n else 0.0
+
+        # idf tables
+        self.bm25_idf = {}
+        self.idf = {}
+        for term, df in index.items():
+            self.bm25_idf[term] = math.log(1 + (self.n - df + 0.5) / (df + 0.5))
+            self.idf[term] = math.log10(self.n / df) if df else 0.0
+
+    def query_terms(self, text: str) -> Counter:
+        """
+        Analyzed terms of a query, in sorted order so the scores are summed in the same order
+        whatever the order of the words, and queries with the same terms get the same results
+        :param text: Query text
+        :return: Term -> number of occurrences in the query, terms missing from the index are dropped
+        """
+        terms = (self._resolve(term) for term in analyze(text, self.stopword_set, False))
+        return Counter(sorted(term for term in terms if term in self.index))
+
+    def _resolve(self, term: str) -> str:
+        """Stem a normalized query term, keeping the unstemmed form if only that one is indexed"""
+        if not self.stemming:
+            return term
+        stemmed = stem_cache.stem(term)
+        if stemmed not in self.index and term in self.index:
+            return term
+        return stemmed
+
+    def query_weights(self, text: str, scheme: str) -> dict[str, float]:
+        """
+        Weight of each query term
+        :param text: Query text
+        :param scheme: "bm25" or "cosine"
+        :return: Term -> weight, terms missing from the index are dropped
+        """
+        counts = self.query_terms(text)
+        if scheme == "bm25":
+            return {term: count * self.bm25_idf[term] for term, count in counts.items()}
+        if scheme == "cosine":
+            weights = {
+                term: (1 + math.log10(count)) * self.idf[term] for term, count in counts.items()
+            }
+            norm = math.sqrt(sum(w * w for w in weights.values()))
+            return {term: w / norm for term, w in weights.items()} if norm else {}
+        raise ValueError(f"Unknown scoring scheme '{scheme}', expected one of {SCHEMES}.")
+
+    def term_bound(self, term: str, scheme: str) -> float:
+        """
+        Highest score a term can contribute to a document, before the query weight is applied
+        :param term: Indexed term
+        :param scheme: "bm25" or "cosine"
+        :return: Upper bound
+        """
+        column = 0 if scheme == "bm25" else 1
+        if self.bounds is not None and term in self.bounds:
+            return self.bounds[term][column]
+
+        if term not in self._computed_bounds:
+            k1 = self.k1
+            b = self.b
+            average_length = self.average_length or 1.0
+            bm25 = 0.0
+            cosine = 0.0
+            for document_id, tf in self.terms_dict[term].postings.inorder():
+                length_norm = k1 * (1 - b + b * self.lengths.get(document_id, 0) / average_length)
+                bm25 = max(bm25, tf * (k1 + 1) / (tf + length_norm))
+                cosine = max(cosine, (1 + math.log10(tf)) / (self.norms.get(document_id) or 1.0))
+            self._computed_bounds[term] = (bm25, cosine)
+        return self._computed_bounds[term][column]
+
+    def search(
+        self, text: str, k: int = 10, scheme: str = "bm25", pruning: str = "wand"
+    ) -> List[Tuple[int, float]]:
+        """
+        Rank documents for a natural language query, counters are left in last_stats
+        :param text: Query text
+        :param k: Number of results
+        :param scheme: "bm25" or "cosine"
+        :param pruning: "wand" to skip documents that cannot enter the top k, "exhaustive" to score
+                        every document containing a query term
+        :return: (document ID, score) pairs, best first
+        """
+        start = time.perf_counter()
+        weights = self.query_weights(text, scheme)
+        if pruning == "wand":
+            results = self.top_k_wand(weights, k, scheme)
+        elif pruning == "exhaustive":
+            results = self.top_k(weights, k, scheme)
+        else:
+            raise ValueError(f"Unknown pruning strategy '{pruning}', expected one of {PRUNING}.")
+        self.last_stats["latency"] = time.perf_counter() - start
+        return results
+
+    def _lists(self, weights: dict[str, float]) -> List[Tuple]:
+        """
+        Postings cursors of the weighted query terms, a PostingsList or a CompressedPostingsList
+        :param weights: Term -> query weight
+        :return: (cursor, weight, term, number of postings) for every term with postings
+        """
+        lists = []
+        for term, weight in weights.items():
+            postings = self.terms_dict[term].postings
+            if len(postings):
+                lists.append((postings.cursor(), weight, term, len(postings)))
+        return lists
+
+    def top_k(self, weights: dict[str, float], k: int, scheme: str) -> List[Tuple[int, float]]:
+        """
+        Document-at-a-time traversal of the postings of the weighted query terms
+        :param weights: Term -> query weight
+        :param k: Number of results
+        :param scheme: "bm25" or "cosine"
+        :return: (document ID, score) pairs, best first
+        """
+        lists = self._lists(weights)
+
+        # heap of (current document ID, list number)
+        cursors = [(cursor.doc, t) for t, (cursor, _, _, _) in enumerate(lists)]
+        heapq.heapify(cursors)
+
+        bm25 = scheme == "bm25"
+        k1 = self.k1
+        b = self.b
+        average_length = self.average_length or 1.0
+        lengths = self.lengths
+        norms = self.norms
+
+        documents = 0
+        top: list = []  # min-heap of (score, -document ID)
+        while cursors:
+            document_id = cursors[0][0]
+            documents += 1
+            score = 0.0
+            if bm25:
+                length_norm = k1 * (1 - b + b * lengths.get(document_id, 0) / average_length)
+            while cursors and cursors[0][0] == document_id:
+                t = cursors[0][1]
+                cursor, weight, _, _ = lists[t]
+                tf = cursor.tf
+                if bm25:
+                    score += weight * tf * (k1 + 1) / (tf + length_norm)
+                else:
+                    score += weight * (1 + math.log10(tf))
+                cursor.next()
+                if cursor.doc is not None:
+                    heapq.heapreplace(cursors, (cursor.doc, t))
+                else:
+                    heapq.heappop(cursors)
+            if not bm25:
+                score /= norms.get(document_id) or 1.0
+
+            entry = (score, -document_id)
+            if len(top) < k:
+                heapq.heappush(top, entry)
+            elif entry > top[0]:
+                heapq.heapreplace(top, entry)
+
+        self.last_stats["postings_evaluated"] = sum(size for _, _, _, size in lists)
+        self.last_stats["documents_scored"] = documents
+        return [(-neg_id, score) for score, neg_id in sorted(top, reverse=True)]
+
+    def top_k_wand(
+        self, weights: dict[str, float], k: int, scheme: str
+    ) -> List[Tuple[int, float]]:
+        """
+        WAND traversal: cursors are kept sorted by current document, and the pivot is the first
+        cursor at which the summed upper bounds of the cursors before it reach the score of the
+        k-th best document so far. Documents before the pivot document cannot enter the top k, so
+        the lagging cursors jump straight to it. Returns the same documents as top_k
+        :param weights: Term -> query weight
+        :param k: Number of results
+        :param scheme: "bm25" or "cosine"
+        :return: (document ID, score) pairs, best first
+        """
+        lists = self._lists(weights)
+        postings_cursors = [cursor for cursor, _, _, _ in lists]
+        upper = [weight * self.term_bound(term, scheme) for _, weight, term, _ in lists]
+
+        # sorted (current document ID, list number) of the cursors that are not exhausted
+        cursors = sorted((cursor.doc, t) for t, cursor in enumerate(postings_cursors))
+
+        bm25 = scheme == "bm25"
+        k1 = self.k1
+        b = self.b
+        average_length = self.average_length or 1.0
+        lengths = self.lengths
+        norms = self.norms
+
+        postings = 0
+        documents = 0
+        top: list = []  # min-heap of (score, -document ID)
+        while cursors and k > 0:
+            # find the pivot, every document is a candidate until the heap is full
+            pivot = 0
+            if len(top) == k:
+                threshold = top[0][0] - EPSILON
+                bound = 0.0
+                for pivot, (_, t) in enumerate(cursors):
+                    bound += upper[t]
+                    if bound >= threshold:
+                        break
+                else:
+                    break
+            pivot_doc = cursors[pivot][0]
+
+            if cursors[0][0] == pivot_doc:
+                # every cursor up to the pivot is on the pivot document, score it fully
+                documents += 1
+                score = 0.0
+                if bm25:
+                    length_norm = k1 * (1 - b + b * lengths.get(pivot_doc, 0) / average_length)
+                moved = 0
+                for document_id, t in cursors:
+                    if document_id != pivot_doc:
+                        break
+                    moved += 1
+                    cursor, weight, _, _ = lists[t]
+                    tf = cursor.tf
+                    if bm25:
+                        score += weight * tf * (k1 + 1) / (tf + length_norm)
+                    else:
+                        score += weight * (1 + math.log10(tf))
+                    cursor.next()
+                postings += moved
+                if not bm25:
+                    score /= norms.get(pivot_doc) or 1.0
+
+                entry = (score, -pivot_doc)
+                if len(top) < k:
+                    heapq.heappush(top, entry)
+                elif entry > top[0]:
+                    heapq.heapreplace(top, entry)
+            else:
+                # no document before the pivot document can reach the threshold, move the
+                # lagging cursors to it
+                moved = 0
+                for document_id, t in cursors:
+                    if document_id >= pivot_doc:
+                        break
+                    moved += 1
+                    postings_cursors[t].advance(pivot_doc)
+
+            for _, t in cursors[:moved]:
+                document_id = postings_cursors[t].doc
+                if document_id is not None:
+                    insort(cursors, (document_id, t), moved)
+            del cursors[:moved]
+
+        self.last_stats["postings_evaluated"] = postings
+        self.last_stats["documents_scored"] = documents
+        return [(-neg_id, score) for score, neg_id in sorted(top, reverse=True)]
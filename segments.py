@@ -0,0 +1,572 @@
+import heapq
+import json
+import os
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+
+from postings import PostingsList
+from storage import (
+    DiskIndex,
+    average_length,
+    read_document_stats,
+    term_bounds,
+    write_binary_index,
+    write_document_stats,
+)
+from term import Term
+
+# lists the delta segments written next to the main index by invert.py --append
+MANIFEST = "segments.json"
+
+DELETED_MAGIC = b"CPSDEL01"
+
+# logarithmic merge policy, this many segments on one level are merged into one on the next
+MERGE_FACTOR = 2
+
+
+class DeletionBitmap:
+    """
+    Deleted document IDs of a segment, one bit per document ID
+    """
+
+    def __init__(self, bits: bytearray | None = None):
+        self.bits = bits if bits is not None else bytearray()
+
+    @classmethod
+    def load(cls, path: Path) -> "DeletionBitmap":
+        """
+        Read a bitmap written by save, an empty bitmap if the file does not exist
+        :param path: Path to the bitmap file
+        :return: DeletionBitmap
+        """
+        if not path.is_file():
+            return cls()
+        data = path.read_bytes()
+        if data[: len(DELETED_MAGIC)] != DELETED_MAGIC:
+            raise ValueError(f"{path} is not a deletion bitmap file.")
+        return cls(bytearray(data[len(DELETED_MAGIC) :]))
+
+    def save(self, path: Path) -> None:
+        """
+        Write the bitmap, the file is removed when nothing is deleted
+        :param path: Path to the bitmap file
+        :return: None
+        """
+        if not self:
+            path.unlink(missing_ok=True)
+            return
+        path.write_bytes(DELETED_MAGIC + bytes(self.bits))
+
+    def add(self, document_id: int) -> None:
+        byte = document_id >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte + 1 - len(self.bits)))
+        self.bits[byte] |= 1 << (document_id & 7)
+
+    def __contains__(self, document_id: int) -> bool:
+        byte = document_id >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] >> (document_id & 7) & 1)
+
+    def __iter__(self) -> Iterator[int]:
+        for byte, value in enumerate(self.bits):
+            for bit in range(8):
+                if value >> bit & 1:
+                    yield byte * 8 + bit
+
+    def __len__(self) -> int:
+        return int.from_bytes(self.bits, "little").bit_count()
+
+
+def segment_paths(directory: Path, name: str) -> dict[str, Path]:
+    """
+    Files of a segment, the main index is the segment with an empty name
+    :param directory: Directory of the index
+    :param name: Segment name from the manifest
+    :return: Kind ("dictionary", "postings", "doclengths", "deleted") -> path
+    """
+    prefix = f"{name}." if name else ""
+    return {
+        kind: directory / f"{prefix}{kind}.bin"
+        for kind in ("dictionary", "postings", "doclengths", "deleted")
+    }
+
+
+def read_manifest(directory: Path) -> dict:
+    """
+    Read the list of delta segments
+    :param directory: Directory of the index
+    :return: {"next": next segment number, "segments": [{"name", "level", "documents"}]}
+    """
+    path = directory / MANIFEST
+    if not path.is_file():
+        return {"next": 1, "segments": []}
+    with path.open(encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(directory: Path, manifest: dict) -> None:
+    """
+    Replace the manifest in one step, the manifest is removed when there are no delta segments
+    :param directory: Directory of the index
+    :param manifest: Manifest from read_manifest
+    :return: None
+    """
+    path = directory / MANIFEST
+    if not manifest["segments"]:
+        path.unlink(missing_ok=True)
+        return
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def has_updates(directory: Path) -> bool:
+    """
+    Check if the index in a directory has delta segments or deletions
+    :param directory: Directory of the index
+    :return: True if a manifest or the main deletion bitmap exists
+    """
+    return (directory / MANIFEST).is_file() or segment_paths(directory, "")["deleted"].is_file()
+
+
+def clear_updates(directory: Path) -> List[str]:
+    """
+    Remove the manifest, every delta segment and the main deletion bitmap, so a full rebuild of
+    the main index does not pick up the updates of the index it replaces
+    :param directory: Directory of the index
+    :return: Names of the delta segments that were removed
+    """
+    names = [entry["name"] for entry in read_manifest(directory)["segments"]]
+    # the manifest goes first, readers then no longer open the segments
+    (directory / MANIFEST).unlink(missing_ok=True)
+    segment_paths(directory, "")["deleted"].unlink(missing_ok=True)
+    # segments left behind by an interrupted merge are not in the manifest
+    names.extend(
+        name
+        for path in sorted(directory.glob("delta-*.dictionary.bin"))
+        if (name := path.name.split(".", 1)[0]) not in names
+    )
+    for name in names:
+        for path in segment_paths(directory, name).values():
+            path.unlink(missing_ok=True)
+    return names
+
+
+class Segment:
+    """
+    A dictionary and postings pair with its document stats and deletion bitmap
+    """
+
+    def __init__(self, name: str, dict_path: Path, postings_path: Path, directory: Path):
+        """
+        :param name: Segment name, empty for the main index
+        :param dict_path: Path to the dictionary file
+        :param postings_path: Path to the postings file
+        :param directory: Directory of the index, where the stats and bitmap files are
+        """
+        paths = segment_paths(directory, name)
+        self.name = name
+        self.paths = {**paths, "dictionary": dict_path, "postings": postings_path}
+        self.disk_index = DiskIndex(dict_path, postings_path)
+        if paths["doclengths"].is_file():
+            self.lengths, self.norms = read_document_stats(paths["doclengths"])
+        else:
+            self.lengths, self.norms = {}, {}
+        self.deleted = DeletionBitmap.load(paths["deleted"])
+
+    @classmethod
+    def open(cls, directory: Path, name: str) -> "Segment":
+        """
+        Open a delta segment
+        :param directory: Directory of the index
+        :param name: Segment name from the manifest
+        :return: Segment
+        """
+        paths = segment_paths(directory, name)
+        return cls(name, paths["dictionary"], paths["postings"], directory)
+
+    def postings(self, term: str) -> List[Tuple[int, int, List[int]]] | None:
+        """
+        Postings of a term without the deleted documents
+        :param term: Term to look up
+        :return: (document_id, tf, positions) tuples, None if the segment does not have the term
+        """
+        postings = self.disk_index.postings(term)
+        if postings is None or not self.deleted:
+            return postings
+        deleted = self.deleted
+        return [posting for posting in postings if posting[0] not in deleted]
+
+    def document_frequency(self, term: str) -> int:
+        """
+        Number of live documents containing a term
+        :param term: Term to look up
+        :return: Document frequency, 0 if the segment does not have the term
+        """
+        if not self.deleted:
+            return self.disk_index.document_frequency(term) or 0
+        return len(self.postings(term) or ())
+
+    def live_documents(self) -> Iterator[int]:
+        deleted = self.deleted
+        return (document_id for document_id in self.lengths if document_id not in deleted)
+
+    def vocabulary(self) -> Iterator[str]:
+        for i in range(len(self.disk_index)):
+            yield self.disk_index.term_at(i)
+
+    def close(self) -> None:
+        self.disk_index.close()
+
+
+class SegmentedIndex:
+    """
+    The main index together with the delta segments written by invert.py --append, with deleted
+    documents left out
+
+    Postings of a term are the live postings of every segment merged by document ID, so lookups,
+    boolean queries and ranking see the same postings and document frequencies as a rebuild of
+    the current collection.
+    """
+
+    def __init__(self, segments: List[Segment]):
+        """
+        :param segments: Segments of the index, the main index first
+        """
+        self.segments = segments
+        self._size = None
+
+    @classmethod
+    def open(cls, dict_path: Path, postings_path: Path) -> "SegmentedIndex":
+        """
+        Open the main index and every delta segment listed in the manifest next to it
+        :param dict_path: Path to the main dictionary file
+        :param postings_path: Path to the main postings file
+        :return: SegmentedIndex
+        """
+        directory = postings_path.parent
+        segments = [Segment("", dict_path, postings_path, directory)]
+        for entry in read_manifest(directory)["segments"]:
+            segments.append(Segment.open(directory, entry["name"]))
+        return cls(segments)
+
+    @property
+    def main(self) -> Segment:
+        return self.segments[0]
+
+    def is_plain(self) -> bool:
+        """
+        :return: True if there are no delta segments or deletions, the main index is the index
+        """
+        return len(self.segments) == 1 and not self.main.deleted
+
+    def postings(self, term: str) -> List[Tuple[int, int, List[int]]] | None:
+        """
+        Live postings of a term across the segments
+        :param term: Term to look up
+        :return: (document_id, tf, positions) tuples in document ID order, None if no live
+                 document contains the term
+        """
+        parts = [postings for segment in self.segments if (postings := segment.postings(term))]
+        if not parts:
+            return None
+        if len(parts) == 1:
+            return parts[0]
+        return list(heapq.merge(*parts, key=lambda posting: posting[0]))
+
+    def term(self, term: str) -> Term | None:
+        """
+        Build a Term object from the live postings
+        :param term: Term to look up
+        :return: Term object if found, None otherwise
+        """
+        postings = self.postings(term)
+        if postings is None:
+            return None
+        frequency = sum(tf for _, tf, _ in postings)
+        return Term(term, frequency=frequency, postings=PostingsList.from_sorted(postings))
+
+    def document_frequency(self, term: str) -> int | None:
+        """
+        Number of live documents containing a term
+        :param term: Term to look up
+        :return: Document frequency if found, None otherwise
+        """
+        df = sum(segment.document_frequency(term) for segment in self.segments)
+        return df or None
+
+    def vocabulary(self) -> Iterator[str]:
+        """
+        Terms with at least one live posting, in dictionary order
+        """
+        merged = heapq.merge(
+            *(segment.vocabulary() for segment in self.segments), key=lambda t: t.encode("utf-8")
+        )
+        previous = None
+        deletions = any(segment.deleted for segment in self.segments)
+        for term in merged:
+            if term == previous:
+                continue
+            previous = term
+            if not deletions or self.document_frequency(term):
+                yield term
+
+    def document_stats(self) -> Tuple[dict[int, int], dict[int, float]]:
+        """
+        Lengths and norms of the live documents, every document is live in one segment only
+        :return: (document ID -> length, document ID -> norm)
+        """
+        lengths: dict[int, int] = {}
+        norms: dict[int, float] = {}
+        for segment in self.segments:
+            for document_id in segment.live_documents():
+                lengths[document_id] = segment.lengths[document_id]
+                norms[document_id] = segment.norms.get(document_id, 0.0)
+        return lengths, norms
+
+    def live_documents(self) -> set[int]:
+        return {document_id for segment in self.segments for document_id in segment.live_documents()}
+
+    def bounds(self):
+        """
+        Stored score bounds of the main index, None once there are updates since the bounds of
+        each segment were computed for that segment's documents only
+        """
+        return self.main.disk_index.bounds() if self.is_plain() else None
+
+    def terms(self) -> "SegmentedTermsView":
+        """
+        Read-only `term: str -> Term` mapping over the live postings
+        """
+        return SegmentedTermsView(self)
+
+    def frequencies(self) -> "SegmentedFrequencyView":
+        """
+        Read-only `term: str -> document frequency: int` mapping over the live postings
+        """
+        return SegmentedFrequencyView(self)
+
+    def close(self) -> None:
+        for segment in self.segments:
+            segment.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        if self._size is None:
+            self._size = sum(1 for _ in self.vocabulary())
+        return self._size
+
+
+class SegmentedTermsView(Mapping):
+    """Lazy stand-in for terms_dict over a SegmentedIndex"""
+
+    def __init__(self, segmented_index: SegmentedIndex):
+        self.segmented_index = segmented_index
+
+    def __getitem__(self, term):
+        term_obj = self.segmented_index.term(term) if isinstance(term, str) else None
+        if term_obj is None:
+            raise KeyError(term)
+        return term_obj
+
+    def __contains__(self, term):
+        return isinstance(term, str) and self.segmented_index.document_frequency(term) is not None
+
+    def __iter__(self):
+        return self.segmented_index.vocabulary()
+
+    def __len__(self):
+        return len(self.segmented_index)
+
+
+class SegmentedFrequencyView(Mapping):
+    """Lazy stand-in for the index dict of document frequencies over a SegmentedIndex"""
+
+    def __init__(self, segmented_index: SegmentedIndex):
+        self.segmented_index = segmented_index
+
+    def __getitem__(self, term):
+        df = self.segmented_index.document_frequency(term) if isinstance(term, str) else None
+        if df is None:
+            raise KeyError(term)
+        return df
+
+    def __contains__(self, term):
+        return isinstance(term, str) and self.segmented_index.document_frequency(term) is not None
+
+    def __iter__(self):
+        return self.segmented_index.vocabulary()
+
+    def __len__(self):
+        return len(self.segmented_index)
+
+
+def write_segment(
+    paths: dict[str, Path],
+    terms: Iterable[Tuple[str, List[Tuple[int, int, List[int]]]]],
+    lengths: dict[int, int],
+    norms: dict[int, float],
+    codec: str = "vbyte",
+) -> int:
+    """
+    Write the dictionary, postings and document stats files of a segment
+    :param paths: Files of the segment, from segment_paths
+    :param terms: (term, postings) in sorted term order
+    :param lengths: Document ID -> number of indexed tokens of the segment's documents
+    :param norms: Document ID -> norm of the 1 + log10(tf) weights
+    :param codec: Compression codec for the postings file
+    :return: Number of terms written
+    """
+    average = average_length(lengths)
+    bounds = {}
+
+    def entries():
+        for term, postings in terms:
+            bounds[term] = term_bounds(
+                ((document_id, tf) for document_id, tf, _ in postings), lengths, norms, average
+            )
+            yield term, len(postings), sum(tf for _, tf, _ in postings), postings
+
+    count = write_binary_index(paths["dictionary"], paths["postings"], entries(), bounds, codec)
+    write_document_stats(paths["doclengths"], lengths, norms)
+    return count
+
+
+def merge_level(directory: Path, manifest: dict, codec: str = "vbyte") -> List[str]:
+    """
+    Apply the logarithmic merge policy: while MERGE_FACTOR segments share a level, merge them,
+    dropping their deleted documents, into one segment on the next level
+    :param directory: Directory of the index
+    :param manifest: Manifest from read_manifest, updated in place and written
+    :param codec: Compression codec for the postings file
+    :return: Names of the segments that were merged away
+    """
+    removed = []
+    while True:
+        levels: dict[int, list] = {}
+        for entry in manifest["segments"]:
+            levels.setdefault(entry["level"], []).append(entry)
+        full = sorted(level for level, entries in levels.items() if len(entries) >= MERGE_FACTOR)
+        if not full:
+            break
+        level = full[0]
+        sources = levels[level][:MERGE_FACTOR]
+        merged = SegmentedIndex([Segment.open(directory, entry["name"]) for entry in sources])
+
+        name = f"delta-{manifest['next']:05d}"
+        manifest["next"] += 1
+        lengths, norms = merged.document_stats()
+        write_segment(
+            segment_paths(directory, name),
+            ((term, merged.postings(term)) for term in merged.vocabulary()),
+            lengths,
+            norms,
+            codec,
+        )
+        merged.close()
+
+        position = manifest["segments"].index(sources[0])
+        manifest["segments"] = [
+            entry for entry in manifest["segments"] if entry not in sources
+        ]
+        manifest["segments"].insert(
+            position, {"name": name, "level": level + 1, "documents": len(lengths)}
+        )
+        write_manifest(directory, manifest)
+        for entry in sources:
+            for path in segment_paths(directory, entry["name"]).values():
+                path.unlink(missing_ok=True)
+            removed.append(entry["name"])
+    return removed
+
+
+def add_segment(
+    directory: Path,
+    terms_dict,
+    lengths: dict[int, int],
+    norms: dict[int, float],
+    codec: str = "vbyte",
+) -> str:
+    """
+    Write an in-memory delta index as a new segment on level 0 and apply the merge policy
+    :param directory: Directory of the index
+    :param terms_dict: Mapping of term -> Term object of the new documents
+    :param lengths: Document ID -> number of indexed tokens of the new documents
+    :param norms: Document ID -> norm of the 1 + log10(tf) weights
+    :param codec: Compression codec for the postings file
+    :return: Name of the new segment
+    """
+    manifest = read_manifest(directory)
+    name = f"delta-{manifest['next']:05d}"
+    manifest["next"] += 1
+    write_segment(
+        segment_paths(directory, name),
+        (
+            (term, terms_dict[term].postings.inorder_with_positions())
+            for term in sorted(terms_dict)
+        ),
+        lengths,
+        norms,
+        codec,
+    )
+    manifest["segments"].append({"name": name, "level": 0, "documents": len(lengths)})
+    write_manifest(directory, manifest)
+    merge_level(directory, manifest, codec)
+    return name
+
+
+def delete_documents(dict_path: Path, postings_path: Path, document_ids: Iterable[int]) -> List[int]:
+    """
+    Mark documents as deleted in the segment they are live in
+    :param dict_path: Path to the main dictionary file
+    :param postings_path: Path to the main postings file
+    :param document_ids: Documents to delete
+    :return: IDs of the documents that were deleted, unknown or already deleted IDs are left out
+    """
+    deleted = []
+    with SegmentedIndex.open(dict_path, postings_path) as index:
+        for document_id in document_ids:
+            for segment in index.segments:
+                if document_id in segment.lengths and document_id not in segment.deleted:
+                    segment.deleted.add(document_id)
+                    deleted.append(document_id)
+                    break
+        for segment in index.segments:
+            segment.deleted.save(segment.paths["deleted"])
+    return deleted
+
+
+def compact(dict_path: Path, postings_path: Path, codec: str = "vbyte") -> int:
+    """
+    Merge every delta segment into the main index and drop the deleted documents
+    :param dict_path: Path to the main dictionary file
+    :param postings_path: Path to the main postings file
+    :param codec: Compression codec for the postings file
+    :return: Number of terms of the compacted index
+    """
+    directory = postings_path.parent
+    main = {**segment_paths(directory, ""), "dictionary": dict_path, "postings": postings_path}
+    tmp = {kind: path.with_name(f"{path.name}.tmp") for kind, path in main.items()}
+
+    with SegmentedIndex.open(dict_path, postings_path) as index:
+        lengths, norms = index.document_stats()
+        count = write_segment(
+            tmp, ((term, index.postings(term)) for term in index.vocabulary()), lengths, norms, codec
+        )
+        names = [segment.name for segment in index.segments[1:]]
+
+    for kind in ("dictionary", "postings", "doclengths"):
+        os.replace(tmp[kind], main[kind])
+    main["deleted"].unlink(missing_ok=True)
+    write_manifest(directory, {"next": 1, "segments": []})
+    for name in names:
+        for path in segment_paths(directory, name).values():
+            path.unlink(missing_ok=True)
+    return count
@@ -0,0 +1,393 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import test
+from invert import TOKENIZERS, set_tokenizer
+from query import QuerySyntaxError
+from querycache import DEFAULT_SIZE, query_cache
+from ranking import SCHEMES
+from stemcache import stem_cache
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8842
+
+# longest request line accepted, in bytes
+LINE_LIMIT = 1 << 20
+
+# documents listed in a search response when the request gives no limit
+DEFAULT_LIMIT = 50
+
+
+class RequestError(ValueError):
+    """Raised when a request is malformed or refers to something that is not in the index"""
+
+
+def argument(request: dict, name: str, kind: type, default=None):
+    """
+    Read an argument of a request
+    :param request: Decoded request
+    :param name: Argument name
+    :param kind: Expected type
+    :param default: Value when the argument is missing, None if it is required
+    :return: Argument value
+    """
+    if name not in request:
+        if default is None:
+            raise RequestError(f"Missing argument '{name}'.")
+        return default
+    value = request[name]
+    if not isinstance(value, kind) or isinstance(value, bool):
+        raise RequestError(f"Argument '{name}' must be of type {kind.__name__}.")
+    return value
+
+
+class QueryServer:
+    """
+    Line-delimited JSON server over the index loaded by test.load_collection
+
+    Every request is one JSON object on one line, with an "op" naming the operation, its arguments
+    and an optional "id" echoed in the response. Every response is one line, {"id", "ok": true,
+    "result"} or {"id", "ok": false, "error"}. The index is loaded once when the server starts.
+    Requests run one at a time on a single worker thread, as the index and the caches are not
+    thread-safe, while the event loop keeps accepting clients and reading their requests, so a
+    slow query delays the requests queued behind it but never stops the server from taking new
+    ones. Each client gets its responses in order.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query")
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.clients = 0
+        self.connections = 0
+        self.operations = {
+            "ping": self.ping,
+            "lookup": self.lookup,
+            "postings": self.postings,
+            "summary": self.summary,
+            "search": self.search,
+            "rank": self.rank,
+            "stats": self.stats,
+        }
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serve one client until it closes the connection
+        :param reader: Stream of request lines
+        :param writer: Stream of response lines
+        :return: None
+        """
+        self.clients += 1
+        self.connections += 1
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # the line is longer than LINE_LIMIT, the stream cannot be resynchronized
+                    self.errors += 1
+                    writer.write(encode({"id": None, "ok": False, "error": "Request line too long."}))
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                writer.write(await loop.run_in_executor(self.executor, self.respond, line))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def respond(self, line: bytes) -> bytes:
+        """
+        Run one request
+        :param line: Request line
+        :return: Encoded response line
+        """
+        self.requests += 1
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestError("Request must be a JSON object.")
+            request_id = request.get("id")
+            operation = self.operations.get(request.get("op"))
+            if operation is None:
+                raise RequestError(f"Unknown op '{request.get('op')}'.")
+            return encode({"id": request_id, "ok": True, "result": operation(request)})
+        except json.JSONDecodeError as e:
+            error = f"Invalid JSON: {e}"
+        except (RequestError, QuerySyntaxError) as e:
+            error = str(e)
+        except Exception as e:
+            print(f"[ERROR]: {type(e).__name__}: {e} while serving {line[:200]!r}", file=sys.stderr)
+            error = f"Internal error: {type(e).__name__}"
+        self.errors += 1
+        return encode({"id": request_id, "ok": False, "error": error})
+
+    # operations
+
+    def ping(self, request: dict) -> str:
+        return "pong"
+
+    def find_term(self, word: str):
+        """
+        Term object of a word, stemmed first then as written, like the prompt of test.main
+        :param word: Word to look up
+        :return: Term object
+        """
+        word = "".join(char for char in word.lower() if char.isalnum())
+        if not word:
+            raise RequestError("Term must have a letter or digit.")
+        term = test.find_term(word)
+        if term is not None:
+            return term
+        suggestions = test.suggestions(word)
+        hint = f" Did you mean: {', '.join(suggestions)}?" if suggestions else ""
+        raise RequestError(f"Term '{word}' not found in the index.{hint}")
+
+    def lookup(self, request: dict) -> dict:
+        """
+        {"op": "lookup", "term": str, "limit": int (optional)}: document frequency, collection
+        frequency and the (document ID, tf) postings of a term
+        """
+        term = self.find_term(argument(request, "term", str))
+        postings = term.postings.inorder()
+        limit = argument(request, "limit", int, len(postings))
+        return {
+            "term": term.term,
+            "document_frequency": len(postings),
+            "frequency": term.frequency,
+            "postings": postings[:limit],
+        }
+
+    def postings(self, request: dict) -> dict:
+        """
+        {"op": "postings", "term": str, "document_id": int}: tf and positions of a term in a document
+        """
+        term = self.find_term(argument(request, "term", str))
+        document_id = argument(request, "document_id", int)
+        if document_id not in term.postings:
+            raise RequestError(f"Document ID '{document_id}' not found for term '{term.term}'.")
+        return term.get_occurrence(document_id)
+
+    def summary(self, request: dict) -> dict:
+        """
+        {"op": "summary", "term": str, "document_id": int, "n": int (optional)}: the document's
+        text around the first occurrence of the term, highlighted
+        """
+        term = self.find_term(argument(request, "term", str))
+        document_id = argument(request, "document_id", int)
+        try:
+            summary = test.document_summary(document_id, term, argument(request, "n", int, 10))
+        except LookupError as e:
+            raise RequestError(e.args[0])
+        doc = test.document_dict[document_id]
+        return {"document_id": document_id, "title": doc.title, "term": term.term, **summary}
+
+    def search(self, request: dict) -> dict:
+        """
+        {"op": "search", "query": str, "limit": int (optional)}: documents matching a boolean query
+        """
+        results = test.search_documents(argument(request, "query", str))
+        limit = argument(request, "limit", int, DEFAULT_LIMIT)
+        return {"count": len(results), "documents": self.documents(results[:limit])}
+
+    def rank(self, request: dict) -> dict:
+        """
+        {"op": "rank", "query": str, "scheme": "bm25" | "cosine" (optional), "k": int (optional)}:
+        top k documents of a ranked query
+        """
+        scheme = argument(request, "scheme", str, "bm25")
+        if scheme not in SCHEMES:
+            raise RequestError(f"Unknown scheme '{scheme}', expected one of {', '.join(SCHEMES)}.")
+        results = test.rank_documents(
+            argument(request, "query", str), scheme, argument(request, "k", int, 10)
+        )
+        documents = self.documents([document_id for document_id, _ in results])
+        for document, (_, score) in zip(documents, results):
+            document["score"] = score
+        return {"scheme": scheme, "documents": documents}
+
+    def stats(self, request: dict) -> dict:
+        """
+        {"op": "stats"}: counters of the server, the stem cache and the query cache
+        """
+        return {
+            "uptime": time.time() - self.started,
+            "requests": self.requests,
+            "errors": self.errors,
+            "clients": self.clients,
+            "connections": self.connections,
+            "terms": len(test.terms_dict),
+            "documents": len(test.document_dict),
+            "stem_cache": stem_cache.stats(),
+            "query_cache": query_cache.stats(),
+        }
+
+    def documents(self, document_ids: list) -> list[dict]:
+        """
+        IDs and titles of documents
+        :param document_ids: Document IDs
+        :return: {"document_id", "title"} per document
+        """
+        documents = []
+        for document_id in document_ids:
+            doc = test.document_dict.get(document_id)
+            documents.append({"document_id": document_id, "title": doc.title if doc is not None else ""})
+        return documents
+
+
+def encode(response: dict) -> bytes:
+    """
+    One response line
+    :param response: Response object
+    :return: JSON followed by a newline
+    """
+    return (json.dumps(response) + "\n").encode("utf-8")
+
+
+async def serve(args: argparse.Namespace) -> None:
+    """
+    Accept clients until the process is interrupted
+    :param args: Parsed command line arguments
+    :return: None
+    """
+    server = QueryServer()
+    if args.unix is not None:
+        listener = await asyncio.start_unix_server(server.handle, path=args.unix, limit=LINE_LIMIT)
+        print(f"Listening on {args.unix}")
+    else:
+        listener = await asyncio.start_server(
+            server.handle, args.host, args.port, limit=LINE_LIMIT
+        )
+        print(f"Listening on {args.host}:{args.port}")
+    sys.stdout.flush()
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def read_cli() -> argparse.Namespace:
+    """
+    Read command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Serve term lookups, postings, summaries and queries over a socket",
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        type=Path,
+        nargs=2,
+        metavar=("DICT", "POSTINGS"),
+        required=True,
+        help="Dictionary and Postings files",
+    )
+    parser.add_argument(
+        "--stopwords-file",
+        type=Path,
+        default=None,
+        help="Stopwords file used when the index was built, stopwords are dropped from queries",
+    )
+    parser.add_argument(
+        "--stemming",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Whether the index was built with --stemming, pass --no-stemming for an unstemmed index",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        choices=TOKENIZERS,
+        default="nltk",
+        help="Tokenizer the index was built with, used to analyze queries",
+    )
+    parser.add_argument(
+        "--compressed-postings",
+        action="store_true",
+        default=False,
+        help="Keep postings encoded in memory, with the codec of the binary postings file or "
+        "vbyte for a pickled index, and decode them while queries walk them",
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port to listen on")
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_SIZE,
+        help="Number of query results kept in the query cache, 0 to disable it",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=None,
+        help="Seconds a cached query result stays valid, no expiry by default",
+    )
+    parser.add_argument(
+        "--unix",
+        type=Path,
+        default=None,
+        help="Listen on this Unix socket instead of TCP",
+    )
+    args = parser.parse_args()
+    dict_path, postings_path = args.input
+
+    # validate paths
+    if not dict_path.is_file():
+        parser.error(f"Dictionary file {dict_path} does not exist or is not a file.")
+    if not postings_path.is_file():
+        parser.error(f"Postings file {postings_path} does not exist or is not a file.")
+    if args.unix is not None and args.unix.exists():
+        parser.error(f"Socket path {args.unix} already exists.")
+    if args.cache_size < 0:
+        parser.error("--cache-size must not be negative.")
+    if args.cache_ttl is not None and args.cache_ttl <= 0:
+        parser.error("--cache-ttl must be positive.")
+
+    return args
+
+
+def main():
+    args = read_cli()
+    set_tokenizer(args.tokenizer)
+    query_cache.configure(args.cache_size, args.cache_ttl)
+    dict_path, postings_path = args.input
+    print(f"Dictionary file: {dict_path}")
+    print(f"Postings file: {postings_path}")
+
+    test.load_collection(
+        dict_path,
+        postings_path,
+        args.stopwords_file,
+        True,
+        args.stemming,
+        args.compressed_postings,
+    )
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("Server stopped.")
+    finally:
+        if args.unix is not None and args.unix.exists():
+            args.unix.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import gzip
+import pickle
+from collections import OrderedDict
+from pathlib import Path
+
+from stemming import FastPorterStemmer
+
+# default number of words kept, well above the vocabulary of CACM
+DEFAULT_SIZE = 65536
+
+
+class StemCache:
+    """
+    Bounded LRU table of word -> stem in front of a single FastPorterStemmer
+
+    Token frequencies are Zipfian, so most lookups are hits and the stemmer only runs once per
+    distinct word. Hits and misses are counted so the table can be sized.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_SIZE):
+        """
+        :param maxsize: Maximum number of words kept, least recently used words are evicted first
+        """
+        self.maxsize = maxsize
+        self.stemmer = FastPorterStemmer()
+        self.table: OrderedDict[str, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def stem(self, word: str) -> str:
+        """
+        Stem a lowercase word
+        :param word: Word to stem
+        :return: Stem of the word
+        """
+        table = self.table
+        stem = table.get(word)
+        if stem is not None:
+            self.hits += 1
+            table.move_to_end(word)
+            return stem
+
+        self.misses += 1
+        stem = self.stemmer.stem_word(word)
+        table[word] = stem
+        if len(table) > self.maxsize:
+            table.popitem(last=False)
+        return stem
+
+    def resize(self, maxsize: int) -> None:
+        """
+        Change the maximum number of words kept, evicting the least recently used ones
+        :param maxsize: New maximum
+        :return: None
+        """
+        self.maxsize = maxsize
+        while len(self.table) > maxsize:
+            self.table.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        """
+        Counters of the cache
+        :return: Dictionary of size, maxsize, hits, misses and hit_rate
+        """
+        return {
+            "size": len(self.table),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+        }
+
+    def save(self, path: Path) -> None:
+        """
+        Persist the word -> stem table, least recently used first
+        :param path: Path to the gzip file
+        :return: None
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(path, "wb") as f:
+            pickle.dump(list(self.table.items()), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, path: Path) -> int:
+        """
+        Warm the table with one written by save, counters are left untouched
+        :param path: Path to the gzip file
+        :return: Number of words loaded
+        """
+        with gzip.open(path, "rb") as f:
+            items = pickle.load(f)
+        for word, stem in items[-self.maxsize :] if self.maxsize else []:
+            self.table[word] = stem
+            self.table.move_to_end(word)
+        self.resize(self.maxsize)
+        return min(len(items), self.maxsize)
+
+
+# shared by invert.py, query.py and test.py
+stem_cache = StemCache()
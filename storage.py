@@ -0,0 +1,558 @@
+import argparse
+import gzip
+import math
+import mmap
+import os
+import pickle
+import struct
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+from compression import (
+    CODECS,
+    CompressedPostingsList,
+    encode_postings,
+    get_codec,
+    iter_postings,
+)
+from postings import PostingsList
+from term import Term
+
+DICT_MAGIC = b"CPSDICT2"
+POSTINGS_MAGIC = b"CPSPOST2"
+
+# postings files written before codecs were added are always raw
+LEGACY_POSTINGS_MAGIC = b"CPSPOST1"
+
+# magic, codec name
+POSTINGS_HEADER = struct.Struct("<8s8s")
+
+DOCS_MAGIC = b"CPSDOCS1"
+
+# magic, number of documents
+DOCS_HEADER = struct.Struct("<8sI")
+
+# dictionaries written before score bounds were added
+LEGACY_DICT_MAGIC = b"CPSDICT1"
+LEGACY_DICT_HEADER = struct.Struct("<8sII")
+LEGACY_ENTRY_FORMAT = "<{width}sIIQI"
+
+# magic, number of terms, width of the term field in bytes, BM25 k1 and b of the score bounds
+DICT_HEADER = struct.Struct("<8sIIdd")
+
+# term, document frequency, collection frequency, postings offset, postings length,
+# BM25 and cosine score bounds
+ENTRY_FORMAT = "<{width}sIIQIdd"
+
+# BM25 parameters the score bounds are computed for
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def write_binary_index(
+    dict_path: Path,
+    postings_path: Path,
+    entries: Iterable[Tuple[str, int, int, List[Tuple[int, int, List[int]]]]],
+    bounds: dict[str, Tuple[float, float]],
+    codec: str = "vbyte",
+) -> int:
+    """
+    Write the dictionary and postings files. Both are written to temporary files that replace
+    the old ones once complete, since a running test.py or server.py may have them memory mapped
+    :param dict_path: Path to the dictionary file
+    :param postings_path: Path to the postings file
+    :param entries: (term, document frequency, collection frequency, postings) in sorted term order
+    :param bounds: Term -> (BM25 bound, cosine bound) from score_bounds
+    :param codec: Name of the codec used for the postings file
+    :return: Number of terms written
+    """
+    dict_path.parent.mkdir(parents=True, exist_ok=True)
+    postings_path.parent.mkdir(parents=True, exist_ok=True)
+    codec = get_codec(codec)
+
+    dict_tmp = dict_path.with_name(f"{dict_path.name}.tmp")
+    postings_tmp = postings_path.with_name(f"{postings_path.name}.tmp")
+
+    rows = []
+    offset = POSTINGS_HEADER.size
+    with postings_tmp.open("wb") as f:
+        f.write(POSTINGS_HEADER.pack(POSTINGS_MAGIC, codec.name.encode("ascii")))
+        for term, df, cf, postings in entries:
+            payload = encode_postings(postings, codec)
+            f.write(payload)
+            rows.append((term.encode("utf-8"), df, cf, offset, len(payload), *bounds[term]))
+            offset += len(payload)
+
+    # terms must be sorted by their encoded bytes for the binary search
+    rows.sort(key=lambda row: row[0])
+    width = max((len(row[0]) for row in rows), default=1)
+    entry = struct.Struct(ENTRY_FORMAT.format(width=width))
+
+    with dict_tmp.open("wb") as f:
+        f.write(DICT_HEADER.pack(DICT_MAGIC, len(rows), width, BM25_K1, BM25_B))
+        for row in rows:
+            f.write(entry.pack(*row))
+
+    os.replace(postings_tmp, postings_path)
+    os.replace(dict_tmp, dict_path)
+    return len(rows)
+
+
+def document_stats(terms_dict) -> Tuple[dict[int, int], dict[int, float]]:
+    """
+    Compute document lengths and cosine norms from the postings
+    :param terms_dict: Mapping of term -> Term object
+    :return: (document ID -> number of indexed tokens, document ID -> norm of the 1 + log10(tf) weights)
+    """
+    lengths: dict[int, int] = {}
+    squares: dict[int, float] = {}
+    # sorted so the sums are the same however the terms were collected, see invert.spimi_build
+    for term in sorted(terms_dict):
+        for document_id, tf in terms_dict[term].postings.inorder():
+            lengths[document_id] = lengths.get(document_id, 0) + tf
+            weight = 1 + math.log10(tf)
+            squares[document_id] = squares.get(document_id, 0.0) + weight * weight
+    norms = {document_id: math.sqrt(total) for document_id, total in squares.items()}
+    return lengths, norms
+
+
+def average_length(lengths: dict[int, int]) -> float:
+    """
+    Average document length used by BM25, 1.0 for an empty collection
+    :param lengths: Document ID -> number of indexed tokens
+    :return: Average length
+    """
+    return (sum(lengths.values()) / len(lengths) if lengths else 0.0) or 1.0
+
+
+def term_bounds(
+    postings: Iterable[Tuple[int, int]],
+    lengths: dict[int, int],
+    norms: dict[int, float],
+    average: float,
+    k1: float = BM25_K1,
+    b: float = BM25_B,
+) -> Tuple[float, float]:
+    """
+    Highest score a single term can contribute to a document, before the query weight is applied
+    :param postings: (document ID, tf) pairs of the term
+    :param lengths: Document ID -> number of indexed tokens
+    :param norms: Document ID -> norm of the 1 + log10(tf) weights
+    :param average: Average document length, from average_length
+    :param k1: BM25 term frequency saturation
+    :param b: BM25 length normalization
+    :return: (max of tf * (k1 + 1) / (tf + K), max of (1 + log10(tf)) / norm)
+    """
+    bm25 = 0.0
+    cosine = 0.0
+    for document_id, tf in postings:
+        length_norm = k1 * (1 - b + b * lengths.get(document_id, 0) / average)
+        bm25 = max(bm25, tf * (k1 + 1) / (tf + length_norm))
+        cosine = max(cosine, (1 + math.log10(tf)) / (norms.get(document_id) or 1.0))
+    return bm25, cosine
+
+
+def score_bounds(
+    terms_dict,
+    lengths: dict[int, int],
+    norms: dict[int, float],
+    k1: float = BM25_K1,
+    b: float = BM25_B,
+) -> dict[str, Tuple[float, float]]:
+    """
+    Highest score each term can contribute to a document, before the query weight is applied
+    :param terms_dict: Mapping of term -> Term object
+    :param lengths: Document ID -> number of indexed tokens
+    :param norms: Document ID -> norm of the 1 + log10(tf) weights
+    :param k1: BM25 term frequency saturation
+    :param b: BM25 length normalization
+    :return: Term -> (BM25 bound, cosine bound) from term_bounds
+    """
+    average = average_length(lengths)
+    return {
+        term: term_bounds(term_obj.postings.inorder(), lengths, norms, average, k1, b)
+        for term, term_obj in terms_dict.items()
+    }
+
+
+def write_document_stats(
+    path: Path, lengths: dict[int, int], norms: dict[int, float]
+) -> None:
+    """
+    Write document lengths and norms, used to rank documents
+    :param path: Path to the file
+    :param lengths: Document ID -> number of indexed tokens
+    :param norms: Document ID -> norm of the 1 + log10(tf) weights
+    :return: None
+    """
+    document_ids = sorted(lengths)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.tmp")
+    with tmp.open("wb") as f:
+        f.write(DOCS_HEADER.pack(DOCS_MAGIC, len(document_ids)))
+        f.write(struct.pack(f"<{len(document_ids)}I", *document_ids))
+        f.write(struct.pack(f"<{len(document_ids)}I", *(lengths[d] for d in document_ids)))
+        f.write(struct.pack(f"<{len(document_ids)}d", *(norms.get(d, 0.0) for d in document_ids)))
+    os.replace(tmp, path)
+
+
+def read_document_stats(path: Path) -> Tuple[dict[int, int], dict[int, float]]:
+    """
+    Read document lengths and norms written by write_document_stats
+    :param path: Path to the file
+    :return: (document ID -> length, document ID -> norm)
+    """
+    data = path.read_bytes()
+    magic, count = DOCS_HEADER.unpack_from(data, 0)
+    if magic != DOCS_MAGIC:
+        raise ValueError(f"{path} is not a document stats file.")
+    offset = DOCS_HEADER.size
+    document_ids = struct.unpack_from(f"<{count}I", data, offset)
+    offset += 4 * count
+    lengths = struct.unpack_from(f"<{count}I", data, offset)
+    offset += 4 * count
+    norms = struct.unpack_from(f"<{count}d", data, offset)
+    return dict(zip(document_ids, lengths)), dict(zip(document_ids, norms))
+
+
+def is_binary_index(path: Path) -> bool:
+    """
+    Check if a file is a binary dictionary file
+    :param path: Path to the file
+    :return: True if the file starts with the dictionary magic, or the one of dictionaries
+             written before the score bounds
+    """
+    with path.open("rb") as f:
+        return f.read(len(DICT_MAGIC)) in (DICT_MAGIC, LEGACY_DICT_MAGIC)
+
+
+class DiskIndex:
+    """
+    Memory mapped dictionary and postings files
+
+    Nothing is read up front, the dictionary is binary searched in place and postings are
+    decoded one term at a time, so only the pages touched by queries are loaded.
+    """
+
+    def __init__(self, dict_path: Path, postings_path: Path, compressed: bool = False):
+        """
+        Open and map the dictionary and postings files
+        :param compressed: Keep the postings of looked up terms encoded in memory, decoded while
+                           queries walk them, instead of decoding them into a PostingsList
+        """
+        self.has_bounds = True
+        self.k1 = BM25_K1
+        self.b = BM25_B
+        self._dict_file = dict_path.open("rb")
+        self._postings_file = postings_path.open("rb")
+        self._dict = mmap.mmap(self._dict_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._postings = mmap.mmap(
+            self._postings_file.fileno(), 0, access=mmap.ACCESS_READ
+        )
+
+        magic = self._dict[: len(DICT_MAGIC)]
+        if magic == DICT_MAGIC:
+            _, self.size, self.width, self.k1, self.b = DICT_HEADER.unpack_from(self._dict, 0)
+            self._header_size = DICT_HEADER.size
+            entry_format = ENTRY_FORMAT
+        elif magic == LEGACY_DICT_MAGIC:
+            _, self.size, self.width = LEGACY_DICT_HEADER.unpack_from(self._dict, 0)
+            self._header_size = LEGACY_DICT_HEADER.size
+            entry_format = LEGACY_ENTRY_FORMAT
+            self.has_bounds = False
+        else:
+            raise ValueError(f"{dict_path} is not a binary dictionary file.")
+        if self._postings[: len(LEGACY_POSTINGS_MAGIC)] == LEGACY_POSTINGS_MAGIC:
+            self.codec = get_codec("raw")
+        else:
+            magic, codec = POSTINGS_HEADER.unpack_from(self._postings, 0)
+            if magic != POSTINGS_MAGIC:
+                raise ValueError(f"{postings_path} is not a binary postings file.")
+            self.codec = get_codec(codec.rstrip(b"\0").decode("ascii"))
+        self.compressed = compressed
+
+        self._entry = struct.Struct(entry_format.format(width=self.width))
+
+    def _read_entry(self, i: int) -> tuple:
+        """
+        Read the i-th dictionary entry
+        :param i: Entry number
+        :return: (term bytes, df, cf, offset, length, bm25 bound, cosine bound), without the bounds
+                 for dictionaries written before they were added
+        """
+        return self._entry.unpack_from(self._dict, self._header_size + i * self._entry.size)
+
+    def find(self, term: str) -> int:
+        """
+        Binary search the dictionary for a term
+        :param term: Term to look up
+        :return: Entry number, -1 if not found
+        """
+        key = term.encode("utf-8")
+        if len(key) > self.width:
+            return -1
+        key = key.ljust(self.width, b"\0")
+
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self._read_entry(mid)[0]
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def term_at(self, i: int) -> str:
+        """
+        Term stored in the i-th entry
+        :param i: Entry number
+        :return: Term string
+        """
+        return self._read_entry(i)[0].rstrip(b"\0").decode("utf-8")
+
+    def document_frequency(self, term: str) -> int | None:
+        """
+        Document frequency of a term
+        :param term: Term to look up
+        :return: Document frequency if found, None otherwise
+        """
+        i = self.find(term)
+        return None if i == -1 else self._read_entry(i)[1]
+
+    def postings(self, term: str) -> List[Tuple[int, int, List[int]]] | None:
+        """
+        Decode the postings of a term
+        :param term: Term to look up
+        :return: (document_id, tf, positions) tuples if found, None otherwise
+        """
+        i = self.find(term)
+        if i == -1:
+            return None
+        _, _, _, offset, length = self._read_entry(i)[:5]
+        return list(iter_postings(self._postings[offset : offset + length], self.codec))
+
+    def term(self, term: str) -> Term | None:
+        """
+        Build a Term object from the stored postings
+        :param term: Term to look up
+        :return: Term object if found, None otherwise
+        """
+        i = self.find(term)
+        if i == -1:
+            return None
+        _, df, cf, offset, length = self._read_entry(i)[:5]
+        if self.compressed:
+            postings = CompressedPostingsList(
+                self._postings[offset : offset + length], self.codec, df
+            )
+        else:
+            postings = PostingsList.from_sorted(
+                iter_postings(self._postings[offset : offset + length], self.codec)
+            )
+        return Term(term, frequency=cf, postings=postings)
+
+    def score_bound(self, term: str) -> Tuple[float, float] | None:
+        """
+        Score bounds of a term, computed for BM25 with self.k1 and self.b
+        :param term: Term to look up
+        :return: (BM25 bound, cosine bound) if found and stored, None otherwise
+        """
+        i = self.find(term)
+        if i == -1 or not self.has_bounds:
+            return None
+        return self._read_entry(i)[5:7]
+
+    def bounds(self) -> "BoundsView | None":
+        """
+        Read-only `term: str -> (BM25 bound, cosine bound)` mapping, None if the dictionary has no bounds
+        """
+        return BoundsView(self) if self.has_bounds else None
+
+    def terms(self) -> "TermsView":
+        """
+        Read-only `term: str -> Term` mapping over the index
+        """
+        return TermsView(self)
+
+    def frequencies(self) -> "FrequencyView":
+        """
+        Read-only `term: str -> document frequency: int` mapping over the index
+        """
+        return FrequencyView(self)
+
+    def close(self) -> None:
+        """
+        Unmap and close the files
+        """
+        self._dict.close()
+        self._postings.close()
+        self._dict_file.close()
+        self._postings_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+
+class TermsView(Mapping):
+    """Lazy stand-in for terms_dict, Term objects are built on access"""
+
+    def __init__(self, disk_index: DiskIndex):
+        self.disk_index = disk_index
+
+    def __getitem__(self, term):
+        term_obj = self.disk_index.term(term)
+        if term_obj is None:
+            raise KeyError(term)
+        return term_obj
+
+    def __contains__(self, term):
+        return isinstance(term, str) and self.disk_index.find(term) != -1
+
+    def __iter__(self):
+        for i in range(len(self.disk_index)):
+            yield self.disk_index.term_at(i)
+
+    def __len__(self):
+        return len(self.disk_index)
+
+
+class FrequencyView(Mapping):
+    """Lazy stand-in for the index dict of document frequencies"""
+
+    def __init__(self, disk_index: DiskIndex):
+        self.disk_index = disk_index
+
+    def __getitem__(self, term):
+        df = self.disk_index.document_frequency(term) if isinstance(term, str) else None
+        if df is None:
+            raise KeyError(term)
+        return df
+
+    def __contains__(self, term):
+        return isinstance(term, str) and self.disk_index.find(term) != -1
+
+    def __iter__(self):
+        for i in range(len(self.disk_index)):
+            yield self.disk_index.term_at(i)
+
+    def __len__(self):
+        return len(self.disk_index)
+
+
+class BoundsView(Mapping):
+    """Lazy `term -> (BM25 bound, cosine bound)` mapping over the dictionary"""
+
+    def __init__(self, disk_index: DiskIndex):
+        self.disk_index = disk_index
+        self.k1 = disk_index.k1
+        self.b = disk_index.b
+
+    def __getitem__(self, term):
+        bound = self.disk_index.score_bound(term) if isinstance(term, str) else None
+        if bound is None:
+            raise KeyError(term)
+        return bound
+
+    def __iter__(self):
+        for i in range(len(self.disk_index)):
+            yield self.disk_index.term_at(i)
+
+    def __len__(self):
+        return len(self.disk_index)
+
+
+def convert_pickles(
+    index_path: Path,
+    postings_path: Path,
+    dict_output: Path,
+    postings_output: Path,
+    codec: str = "vbyte",
+) -> int:
+    """
+    Convert gzip+pickle index and postings snapshots into the binary format
+    :param index_path: Path to index.pkl.gz
+    :param postings_path: Path to postings.pkl.gz
+    :param dict_output: Path to the dictionary file to write
+    :param postings_output: Path to the postings file to write
+    :param codec: Name of the codec used for the postings file
+    :return: Number of terms converted
+    """
+    with gzip.open(index_path, "rb") as f:
+        index: dict[str, int] = pickle.load(f)
+    with gzip.open(postings_path, "rb") as f:
+        snapshot: dict[str, dict] = pickle.load(f)
+
+    terms_dict = {term: Term.from_snapshot(term, payload) for term, payload in snapshot.items()}
+    lengths, norms = document_stats(terms_dict)
+    write_document_stats(dict_output.parent / "doclengths.bin", lengths, norms)
+
+    entries = (
+        (
+            term,
+            index.get(term, len(snapshot[term]["postings"])),
+            snapshot[term]["freq"],
+            snapshot[term]["postings"],
+        )
+        for term in sorted(snapshot)
+    )
+    bounds = score_bounds(terms_dict, lengths, norms)
+    return write_binary_index(dict_output, postings_output, entries, bounds, codec)
+
+
+def read_cli() -> argparse.Namespace:
+    """
+    Read command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Convert index.pkl.gz and postings.pkl.gz snapshots into the binary index format",
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        type=Path,
+        nargs=2,
+        metavar=("INDEX", "POSTINGS"),
+        required=True,
+        help="index.pkl.gz and postings.pkl.gz files",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=Path,
+        default=Path("output"),
+        help="Directory for dictionary.bin and postings.bin",
+    )
+    parser.add_argument(
+        "--codec",
+        choices=sorted(CODECS),
+        default="vbyte",
+        help="Compression codec for the postings file",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = read_cli()
+    index_path, postings_path = args.input
+    count = convert_pickles(
+        index_path,
+        postings_path,
+        args.output / "dictionary.bin",
+        args.output / "postings.bin",
+        args.codec,
+    )
+    print(f"Converted {count} terms -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
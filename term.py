@@ -4,15 +4,43 @@ from postings import PostingsList
 class Term:
     """
     Class representing a term in the inverted index
+
+    Slotted, and the postings list is only allocated when it is first used.
     """
 
+    __slots__ = ("term", "frequency", "_postings")
+
     def __init__(self, term, frequency=0, postings=None):
         """
         Initialize a Term object
         """
         self.term = term
         self.frequency = frequency
-        self.postings = postings if postings is not None else PostingsList()
+        self._postings = postings
+
+    @property
+    def postings(self) -> PostingsList:
+        if self._postings is None:
+            self._postings = PostingsList()
+        return self._postings
+
+    @postings.setter
+    def postings(self, postings: PostingsList) -> None:
+        self._postings = postings
+
+    @classmethod
+    def from_snapshot(cls, term, payload) -> "Term":
+        """
+        Build a Term directly from its pickled snapshot without replaying every occurrence
+        :param term: Term string
+        :param payload: Dictionary with "freq" and sorted "postings" (document_id, tf, positions) tuples
+        :return: Term object
+        """
+        return cls(
+            term,
+            frequency=payload["freq"],
+            postings=PostingsList.from_sorted(payload["postings"]),
+        )
 
     def add_occurrence(self, document_id, position=None) -> None:
         """
@@ -5,8 +5,24 @@ import sys
 import time
 from pathlib import Path
 
+from compression import get_codec
+from dictionary import CompactIndex
+from forward import ForwardIndex
+from invert import TOKENIZERS, set_tokenizer
+from lexicon import auto_distance
 from postings import PostingsList
-from stemming import PorterStemmer
+from query import QueryEngine, QuerySyntaxError, read_stopwords
+from querycache import DEFAULT_SIZE, index_build_id, query_cache
+from ranking import SCHEMES, Ranker
+from segments import SegmentedIndex, has_updates
+from stemcache import stem_cache
+from storage import (
+    DiskIndex,
+    TermsView,
+    document_stats,
+    is_binary_index,
+    read_document_stats,
+)
 from term import Term
 
 global terms_dict
@@ -18,6 +34,15 @@ index: dict[str, int] = {}
 global document_dict
 document_dict: dict[int, dict] = {}
 
+global query_engine
+query_engine: QueryEngine | None = None
+
+global ranker
+ranker: Ranker | None = None
+
+global forward_index
+forward_index: ForwardIndex | None = None
+
 
 def read_cli() -> argparse.Namespace:
     """
@@ -33,6 +58,49 @@ def read_cli() -> argparse.Namespace:
         required=True,
         help="Dictionary and Postings files",
     )
+    parser.add_argument(
+        "--stopwords-file",
+        type=Path,
+        default=None,
+        help="Stopwords file used when the index was built, stopwords are dropped from queries",
+    )
+    parser.add_argument(
+        "--stemming",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Whether the index was built with --stemming, pass --no-stemming for an unstemmed index",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        choices=TOKENIZERS,
+        default="nltk",
+        help="Tokenizer the index was built with, used to analyze queries",
+    )
+    parser.add_argument(
+        "--ranking",
+        choices=SCHEMES,
+        default=None,
+        help="Rank multi-word queries with this scoring scheme instead of evaluating them as boolean queries",
+    )
+    parser.add_argument(
+        "--compressed-postings",
+        action="store_true",
+        default=False,
+        help="Keep postings encoded in memory, with the codec of the binary postings file or "
+        "vbyte for a pickled index, and decode them while queries walk them",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_SIZE,
+        help="Number of query results kept in the query cache, 0 to disable it",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=None,
+        help="Seconds a cached query result stays valid, no expiry by default",
+    )
     args = parser.parse_args()
     dict_path, postings_path = args.input
 
@@ -41,20 +109,40 @@ def read_cli() -> argparse.Namespace:
         parser.error(f"Dictionary file {dict_path} does not exist or is not a file.")
     if not postings_path.is_file():
         parser.error(f"Postings file {postings_path} does not exist or is not a file.")
-
-    return dict_path, postings_path
+    if args.cache_size < 0:
+        parser.error("--cache-size must not be negative.")
+    if args.cache_ttl is not None and args.cache_ttl <= 0:
+        parser.error("--cache-ttl must be positive.")
+
+    return (
+        dict_path,
+        postings_path,
+        args.stopwords_file,
+        args.ranking,
+        args.tokenizer,
+        args.stemming,
+        args.cache_size,
+        args.cache_ttl,
+        args.compressed_postings,
+    )
 
 
 def load_documents(path: Path) -> dict:
     """
-    Load documents from the pickle gzip file
+    Load documents from the pickle gzip file, written by invert.py as a sequence of pickled
+    {document ID: Document} batches
     :param path: Path to the gzip file
     :return: Dictionary of document IDs and their metadata
     """
     global document_dict
 
+    document_dict = {}
     with gzip.open(path, "rb") as f:
-        document_dict = pickle.load(f)
+        while True:
+            try:
+                document_dict.update(pickle.load(f))
+            except EOFError:
+                break
     return document_dict
 
 
@@ -71,55 +159,238 @@ def load_index(path: Path) -> dict:
     return index
 
 
-def load_postings(path: Path) -> dict:
+def load_postings(path: Path, compressed: bool = False) -> TermsView:
     """
-    Load postings from the pickle gzip file
+    Load postings from the pickle gzip file into a CompactIndex, Term objects are built on lookup
     :param path: Path to the gzip file
-    :return: Dictionary of Term objects
+    :param compressed: Keep the postings encoded with vbyte
+    :return: Mapping of terms to Term objects
     """
     global terms_dict
 
     with gzip.open(path, "rb") as f:
         snapshot: dict[str, dict] = pickle.load(f)
 
-    terms_dict = {}
-    for term, payload in snapshot.items():
-        term = Term(term, frequency=0)
-        for doc_id, tf, positions in payload["postings"]:
-            if positions:
-                for pos in positions:
-                    term.add_occurrence(doc_id, pos)
-            else:
-                for _ in range(tf):
-                    term.add_occurrence(doc_id, None)
-        terms_dict[term.term] = term
+    codec = get_codec("vbyte") if compressed else None
+    terms_dict = CompactIndex.from_snapshot(snapshot, codec).terms()
     return terms_dict
 
 
-def lookup(user_input: str) -> Term | None:
+def load_binary(
+    dict_path: Path, postings_path: Path, compressed: bool = False
+) -> DiskIndex | SegmentedIndex:
     """
-    Look up a term in the index and return its Term object if found
-    :param user_input: Term to look up
-    :return: Term object if found, None otherwise
+    Open the binary dictionary and postings files, terms are read lazily on lookup. Delta
+    segments and deletions written by invert.py --append/--delete are merged in at query time
+    :param dict_path: Path to the dictionary file
+    :param postings_path: Path to the postings file
+    :param compressed: Keep looked up postings encoded, unless the index has updates, whose
+                       merged postings are built in memory
+    :return: DiskIndex over both files, or SegmentedIndex when the index has updates
     """
     global terms_dict
     global index
 
-    start = time.time()
+    if has_updates(postings_path.parent):
+        disk_index = SegmentedIndex.open(dict_path, postings_path)
+    else:
+        disk_index = DiskIndex(dict_path, postings_path, compressed)
+    terms_dict = disk_index.terms()
+    index = disk_index.frequencies()
+    return disk_index
+
+
+def load_forward(path: Path) -> ForwardIndex | None:
+    """
+    Open the forward index written by invert.py, if there is one
+    :param path: Path to forward.bin
+    :return: ForwardIndex, or None when the file does not exist
+    """
+    global forward_index
+
+    forward_index = ForwardIndex(path) if path.is_file() else None
+    return forward_index
+
+
+def find_term(user_input: str) -> Term | None:
+    """
+    Look up a word normalized and stemmed like the indexed text, the word itself is looked up when
+    only the unstemmed form is indexed. Lookups go through the query cache, keyed on the term
+    :param user_input: Word to look up
+    :return: Term object if found, None otherwise
+    """
+    global terms_dict
+    global query_engine
+
+    query_cache.check()
+    word = "".join(char for char in user_input.lower() if char.isalnum())
+    if not word:
+        return None
+    term = stem_cache.stem(word) if query_engine is None or query_engine.stemming else word
+    if term not in terms_dict and word in terms_dict:
+        term = word
+    return query_cache.get_or_compute(
+        ("term", term), lambda: terms_dict[term] if term in terms_dict else None
+    )
 
+
+def lookup(user_input: str) -> Term | None:
+    """
+    Look up a term in the index and return its Term object if found
+    :param user_input: Term to look up
+    :return: Term object if found, None otherwise
+    """
     # check if term is in index
-    if user_input in terms_dict:
-        term_obj = terms_dict[user_input]
+    term_obj = find_term(user_input)
+    if term_obj is not None:
         print(f"Term: {term_obj.__str__()}")
-        end = time.time()
-        duration = end - start
-        #   print(f"Time taken to lookup term '{user_input}': {duration:.6f} seconds")
         return term_obj
     else:
         print(f"Term '{user_input}' not found in the index.")
         return None
 
 
+def is_boolean_query(user_input: str) -> bool:
+    """
+    Check if the input is a boolean query rather than a single term
+    :param user_input: User input
+    :return: True if the input has several words, parentheses, quotes, or wildcard or fuzzy operands
+    """
+    return (
+        len(user_input.split()) > 1
+        or any(char in user_input for char in '()"')
+        or is_pattern_query(user_input)
+    )
+
+
+def is_pattern_query(user_input: str) -> bool:
+    """
+    Check if the input has wildcard (comput*) or fuzzy (algoritm~) operands, which only the
+    boolean query engine expands
+    :param user_input: User input
+    :return: True if the input has * or ~
+    """
+    return any(char in user_input for char in "*~")
+
+
+def suggestions(user_input: str, n: int = 5) -> list[str]:
+    """
+    Indexed terms closest to a term that was not found
+    :param user_input: Term that was looked up
+    :param n: Number of suggestions
+    :return: Suggested terms, closest first
+    """
+    global query_engine
+
+    word = "".join(char for char in user_input.lower() if char.isalnum())
+    if query_engine is None or not word:
+        return []
+    stemmed = stem_cache.stem(word)
+    terms = []
+    for candidate in (stemmed, word):
+        for term, _ in query_engine.lexicon.fuzzy(candidate, max(1, auto_distance(candidate))):
+            if term not in terms:
+                terms.append(term)
+    return terms[:n]
+
+
+def suggest(user_input: str, n: int = 5) -> list[str]:
+    """
+    Print the indexed terms closest to a term that was not found
+    :param user_input: Term that was looked up
+    :param n: Number of suggestions
+    :return: Suggested terms, closest first
+    """
+    terms = suggestions(user_input, n)
+    if terms:
+        print(f"Did you mean: {', '.join(terms)}? (search 'term~' or 'prefix*' to expand)")
+    return terms
+
+
+def search_documents(user_input: str) -> list[int]:
+    """
+    Evaluate a boolean query through the query cache, keyed on its parsed query tree
+    :param user_input: Query with AND, OR, NOT and parentheses
+    :return: Matching document IDs, shared with the cache
+    :raises QuerySyntaxError: If the query is not valid
+    """
+    global query_engine
+
+    query_cache.check()
+    node = query_engine.parse(user_input)
+    return query_cache.get_or_compute(
+        ("search", repr(node)), lambda: list(query_engine.execute(node))
+    )
+
+
+def rank_documents(user_input: str, scheme: str, k: int = 10) -> list[tuple[int, float]]:
+    """
+    Rank documents for a natural language query through the query cache, keyed on its analyzed
+    terms
+    :param user_input: Query text
+    :param scheme: Scoring scheme, "bm25" or "cosine"
+    :param k: Number of results
+    :return: (document ID, score) pairs, best first, shared with the cache
+    """
+    global ranker
+
+    query_cache.check()
+    key = ("rank", scheme, k, tuple(sorted(ranker.query_terms(user_input).items())))
+    return query_cache.get_or_compute(key, lambda: ranker.search(user_input, k, scheme))
+
+
+def boolean_search(user_input: str) -> list[int]:
+    """
+    Evaluate a boolean query and print the matching documents
+    :param user_input: Query with AND, OR, NOT and parentheses
+    :return: Matching document IDs
+    """
+    global query_engine
+    global document_dict
+
+    try:
+        results = search_documents(user_input)
+    except QuerySyntaxError as e:
+        print(f"Invalid query: {e}")
+        return []
+
+    print(f"Query '{user_input}' matched {len(results)} document(s).")
+    for document_id in results:
+        doc = document_dict.get(document_id)
+        title = doc.title if doc is not None else ""
+        print(f"  {document_id}: {title}")
+    return results
+
+
+def ranked_search(user_input: str, scheme: str, k: int = 10) -> list[tuple[int, float]]:
+    """
+    Rank documents for a natural language query and print the top k
+    :param user_input: Query text
+    :param scheme: Scoring scheme, "bm25" or "cosine"
+    :param k: Number of results
+    :return: (document ID, score) pairs, best first
+    """
+    global ranker
+    global document_dict
+
+    hits = query_cache.hits
+    results = rank_documents(user_input, scheme, k)
+    print(f"Top {len(results)} document(s) for '{user_input}' ({scheme}):")
+    for rank, (document_id, score) in enumerate(results, start=1):
+        doc = document_dict.get(document_id)
+        title = doc.title if doc is not None else ""
+        print(f"  {rank:>2}. {document_id} ({score:.4f}): {title}")
+    if query_cache.hits > hits:
+        print("Results served from the query cache.")
+        return results
+    stats = ranker.last_stats
+    print(
+        f"Postings evaluated: {stats['postings_evaluated']}, "
+        f"documents scored: {stats['documents_scored']}"
+    )
+    return results
+
+
 def get_common_occurrences(
     document_id: int, positions: list[int], n: int
 ) -> list[dict]:
@@ -132,18 +403,23 @@ def get_common_occurrences(
     :return: List of terms that occur in the same document within the specified range
     """
     global terms_dict
+    global forward_index
 
     common_terms = []
 
-    # find all terms that have the same document ID
-    for term, term_obj in terms_dict.items():
-        node_document = (
-            term_obj.postings.__getitem__(document_id)
-            if document_id in term_obj.postings
-            else None
-        )
-        if node_document:
-            common_terms.append(term)
+    # the forward index lists the terms of the document directly
+    if forward_index is not None and document_id in forward_index:
+        common_terms = forward_index.terms(document_id)
+    else:
+        # otherwise find all terms that have the same document ID
+        for term, term_obj in terms_dict.items():
+            node_document = (
+                term_obj.postings.__getitem__(document_id)
+                if document_id in term_obj.postings
+                else None
+            )
+            if node_document:
+                common_terms.append(term)
 
     # document terms
     common_terms.sort()
@@ -173,18 +449,61 @@ def get_summary(document_id: int, term: Term, n: int) -> str:
     :param n: Number of words to include before and after (total context is 2n+1)
     :return: Summary string
     """
+    try:
+        summary = document_summary(document_id, term, n)
+    except LookupError as e:
+        print(e.args[0])
+        return ""
+
+    print(f"\nDocument ID: {document_id}")
+    print(f"Term: '{term.term}' at position {summary['position']}")
+    start_pos, end_pos = summary["window"]
+    print(
+        f"Context window: [{start_pos}:{end_pos}] (showing {end_pos - start_pos} {summary['unit']})"
+    )
+    print(f"\nSummary: {summary['summary']}\n")
+
+    return summary["summary"]
+
+
+def document_summary(document_id: int, term: Term, n: int) -> dict:
+    """
+    summarize through the query cache, keyed on the term, the document and n
+    :param document_id: Document ID to look up
+    :param term: Term object containing positions
+    :param n: Number of words to include before and after
+    :return: Dictionary like summarize, shared with the cache
+    :raises LookupError: If the document or the term in it is not found
+    """
+    return query_cache.get_or_compute(
+        ("summary", term.term, document_id, n), lambda: summarize(document_id, term, n)
+    )
+
+
+def summarize(document_id: int, term: Term, n: int) -> dict:
+    """
+    Summary of the document highlighting the first occurrence of the term, without printing it
+    :param document_id: Document ID to look up
+    :param term: Term object containing positions
+    :param n: Number of words to include before and after
+    :return: Dictionary with the term's position, the [start:end] window, its unit ("words" or
+             "tokens") and the summary
+    :raises LookupError: If the document or the term in it is not found, with the message to show
+    """
     global terms_dict
     global document_dict
+    global forward_index
 
     if document_id not in document_dict:
-        print(f"Document ID '{document_id}' not found in document dictionary.")
-        return ""
+        raise LookupError(f"Document ID '{document_id}' not found in document dictionary.")
 
     doc = document_dict[document_id]
 
     if document_id not in term.postings:
-        print(f"Term '{term.term}' not found in document {document_id}.")
-        return ""
+        raise LookupError(f"Term '{term.term}' not found in document {document_id}.")
+
+    if forward_index is not None and document_id in forward_index:
+        return forward_summary(document_id, doc, term, n)
 
     full_text = f"{doc.text}"
     words = full_text.split()
@@ -201,18 +520,15 @@ def get_summary(document_id: int, term: Term, n: int) -> str:
             term_position = index
             break
 
-        stemmed_word = PorterStemmer().stem(
-            normalized_word, 0, len(normalized_word) - 1
-        )
+        stemmed_word = stem_cache.stem(normalized_word)
         if stemmed_word == search_term:
             term_position = index
             break
 
     if term_position == -1:
-        print(
+        raise LookupError(
             f"Term '{term.term}' not found in document text for document {document_id}."
         )
-        return ""
 
     # start position is the maximum between 0 and the first position - n, which ensures no out of bounds issue
     # end position is the minimum between the length and current position + n,
@@ -220,12 +536,6 @@ def get_summary(document_id: int, term: Term, n: int) -> str:
     start_pos = max(0, term_position - n)
     end_pos = min(len(words), term_position + n)
 
-    print(f"\nDocument ID: {document_id}")
-    print(f"Term: '{term.term}' at position {term_position}")
-    print(
-        f"Context window: [{start_pos}:{end_pos}] (showing {end_pos - start_pos} words)"
-    )
-
     context_words = words[start_pos:end_pos]
 
     highlighted_words = []
@@ -235,38 +545,112 @@ def get_summary(document_id: int, term: Term, n: int) -> str:
         else:
             highlighted_words.append(word)
 
-    summary = " ".join(highlighted_words)
-    print(f"\nSummary: {summary}\n")
+    return {
+        "position": term_position,
+        "window": (start_pos, end_pos),
+        "unit": "words",
+        "summary": " ".join(highlighted_words),
+    }
 
-    return summary
 
+def forward_summary(document_id: int, doc, term: Term, n: int) -> dict:
+    """
+    summarize from the forward index: the window around the first position of the term is cut
+    out of the text by its character offsets, so only the document's arrays are read
+    :param document_id: Document ID to look up
+    :param doc: Document object
+    :param term: Term object containing positions
+    :param n: Number of words to include before and after
+    :return: Dictionary like summarize
+    """
+    global forward_index
 
-def main():
+    term_position = term.postings[document_id].positions[0]
+    ids = forward_index.token_ids(document_id)
+    if term_position >= len(ids):
+        raise LookupError(
+            f"Term '{term.term}' not found in document text for document {document_id}."
+        )
+
+    first, last, start_char, end_char = forward_index.window(document_id, term_position, n)
+    spans = forward_index.spans(document_id)
+    term_start, term_end = spans[2 * term_position], spans[2 * term_position + 1]
+
+    text = doc.text
+    summary = " ".join(
+        (
+            text[start_char:term_start]
+            + f"**{text[term_start:term_end]}**"
+            + text[term_end:end_char]
+        ).split()
+    )
+    return {
+        "position": term_position,
+        "window": (first, last + 1),
+        "unit": "tokens",
+        "summary": summary,
+    }
+
+
+def load_collection(
+    dict_path: Path,
+    postings_path: Path,
+    stopwords_file: Path | None,
+    build_ranker: bool,
+    stemming: bool = True,
+    compressed: bool = False,
+) -> None:
     """
-    You need to write the second program test to test your inverting program. The inputs to the program are the two files generated from the previous program invert.
-    It then keeps asking user to type in a single term. If the term is in one of the documents in the collection, the program should display the document frequency
-    and all the documents which contain this term, for each document, it should display the document ID, the title, the term frequency, all the positions the term occurs
-    in that document, and a summary of the document highlighting the first occurrence of this term with 10 terms in its context. When user types in the term ZZEND,
-    the program will stop (this requirement is valid only when your program doesn't have a graphical interface). Each time, when user types in a valid term, the program
-    should also output the time from getting the user input to outputting the results. Finally, when the program stops, the average value
-    for above-mentioned time should also be displayed.
+    Load the index, the documents and the forward index, and build the query engine and ranker
+    :param dict_path: Path to the dictionary file
+    :param postings_path: Path to the postings file
+    :param stopwords_file: Stopwords file the index was built with, None for no stopwords
+    :param build_ranker: Also build the ranker for ranked queries
+    :param stemming: Whether the index was built with --stemming
+    :param compressed: Keep postings encoded in memory
+    :return: None
     """
+    global query_engine, ranker
 
-    dict_path, postings_path = read_cli()
-    print(f"Dictionary file: {dict_path}")
-    print(f"Postings file: {postings_path}")
+    def reload() -> None:
+        print(f"Index next to {postings_path} changed, reloading.")
+        load_collection(
+            dict_path, postings_path, stopwords_file, build_ranker, stemming, compressed
+        )
+
+    # results cached from another build of the index are dropped, and an index updated or
+    # rebuilt while the program runs is loaded again
+    query_cache.watch(lambda: index_build_id(dict_path, postings_path), reload)
 
     start = time.time()
 
-    terms_dict = load_postings(postings_path)
-    print(f"Loaded {len(terms_dict)} terms from postings.")
+    bounds = None
+    segmented = None
+    binary = is_binary_index(dict_path)
+    if binary:
+        disk_index = load_binary(dict_path, postings_path, compressed)
+        bounds = disk_index.bounds()
+        if isinstance(disk_index, SegmentedIndex):
+            segmented = disk_index
+            print(f"Opened {len(segmented.segments) - 1} delta segments next to {dict_path}.")
+        print(f"Opened {len(terms_dict)} terms from {dict_path}.")
+    else:
+        load_postings(postings_path, compressed)
+        print(f"Loaded {len(terms_dict)} terms from postings.")
 
     #   for term, term_obj in terms_dict.items():
     #       print(term_obj)
 
-    document_dict = load_documents(Path("output/documents.pkl.gz"))
+    document_dict = load_documents(postings_path.parent / "documents.pkl.gz")
+    if segmented is not None:
+        live = segmented.live_documents()
+        for document_id in [document_id for document_id in document_dict if document_id not in live]:
+            del document_dict[document_id]
     print(f"Loaded {len(document_dict)} documents from documents.pkl.gz.")
 
+    if load_forward(postings_path.parent / "forward.bin") is not None:
+        print(f"Opened forward index of {len(forward_index)} documents.")
+
     end = time.time()
     duration = end - start
 
@@ -274,7 +658,8 @@ def main():
 
     start = time.time()
 
-    index = load_index(dict_path)
+    if not binary:
+        load_index(dict_path)
     print(f"Loaded {len(index)} terms from dictionary.")
 
     end = time.time()
@@ -282,6 +667,71 @@ def main():
 
     print(f"Time taken to load dictionary: '{duration:.6f}' seconds")
 
+    stems_path = postings_path.parent / "stems.pkl.gz"
+    if stems_path.is_file():
+        print(f"Loaded {stem_cache.load(stems_path)} stems from {stems_path.name}.")
+
+    stopword_set = read_stopwords(stopwords_file)
+    query_engine = QueryEngine(
+        terms_dict,
+        index,
+        stopword_set=stopword_set,
+        stemming=stemming,
+        universe=sorted(document_dict),
+    )
+
+    if build_ranker:
+        stats_path = postings_path.parent / "doclengths.bin"
+        if segmented is not None:
+            lengths, norms = segmented.document_stats()
+        elif stats_path.is_file():
+            lengths, norms = read_document_stats(stats_path)
+        else:
+            lengths, norms = document_stats(terms_dict)
+            for document_id in document_dict:
+                lengths.setdefault(document_id, 0)
+        ranker = Ranker(
+            terms_dict,
+            index,
+            lengths,
+            norms,
+            stopword_set=stopword_set,
+            stemming=stemming,
+            bounds=bounds,
+        )
+
+
+def main():
+    """
+    You need to write the second program test to test your inverting program. The inputs to the program are the two files generated from the previous program invert.
+    It then keeps asking user to type in a single term. If the term is in one of the documents in the collection, the program should display the document frequency
+    and all the documents which contain this term, for each document, it should display the document ID, the title, the term frequency, all the positions the term occurs
+    in that document, and a summary of the document highlighting the first occurrence of this term with 10 terms in its context. When user types in the term ZZEND,
+    the program will stop (this requirement is valid only when your program doesn't have a graphical interface). Each time, when user types in a valid term, the program
+    should also output the time from getting the user input to outputting the results. Finally, when the program stops, the average value
+    for above-mentioned time should also be displayed.
+    """
+
+    (
+        dict_path,
+        postings_path,
+        stopwords_file,
+        ranking,
+        tokenizer,
+        stemming,
+        cache_size,
+        cache_ttl,
+        compressed,
+    ) = read_cli()
+    set_tokenizer(tokenizer)
+    query_cache.configure(cache_size, cache_ttl)
+    print(f"Dictionary file: {dict_path}")
+    print(f"Postings file: {postings_path}")
+
+    load_collection(
+        dict_path, postings_path, stopwords_file, ranking is not None, stemming, compressed
+    )
+
     total_attempts = 0
     total_time = 0.0
 
@@ -291,15 +741,36 @@ def main():
         # exit condition
         if user_input == "ZZEND":
             print(f"Exiting program. Total attempts: {total_attempts}, Total time: {total_time:.6f} seconds, Average time: {(total_time / total_attempts) if total_attempts > 0 else 0:.6f} seconds")
+            stats = stem_cache.stats()
+            print(f"Stem cache: {stats['hits']} hits, {stats['misses']} misses ({100 * stats['hit_rate']:.1f}% hit rate)")
+            stats = query_cache.stats()
+            print(
+                f"Query cache: {stats['hits']} hits, {stats['misses']} misses, "
+                f"{stats['evictions']} evictions, {stats['expirations']} expirations "
+                f"({100 * stats['hit_rate']:.1f}% hit rate)"
+            )
             break
 
+        # several words, rank the documents when a scoring scheme was given
+        elif ranking is not None and is_boolean_query(user_input) and not is_pattern_query(user_input):
+            query_start = time.time()
+            ranked_search(user_input, ranking)
+            query_duration = time.time() - query_start
+            print(f"Time taken to rank query '{user_input}': {query_duration:.6f} seconds")
+
+        # several words, parentheses, wildcards or fuzzy words, evaluate as a boolean query
+        elif is_boolean_query(user_input):
+            query_start = time.time()
+            boolean_search(user_input)
+            query_duration = time.time() - query_start
+            print(f"Time taken to evaluate query '{user_input}': {query_duration:.6f} seconds")
+
         # if user input is not empty, look up term
         elif user_input is not None:
-            stemmed_input = PorterStemmer().stem(user_input, 0, len(user_input) - 1)
             lookup_start = time.time()
-            user_term = lookup(stemmed_input)
+            user_term = lookup(user_input)
             if user_term is None:
-                user_term = lookup(user_input.lower())
+                suggest(user_input)
             try:
                 if user_term is not None:
                     lookup_end = time.time()